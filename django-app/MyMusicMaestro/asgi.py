@@ -0,0 +1,11 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyMusicMaestro.settings')
+# The async versions of the read views, see label_music_manager/async_urls.py
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'label_music_manager.async_urls')
+
+# Run with an ASGI server, e.g.
+#   uvicorn MyMusicMaestro.asgi:application --workers 4
+application = get_asgi_application()
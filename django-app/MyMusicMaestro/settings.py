@@ -1,5 +1,7 @@
 # You should not edit this file
 from django.contrib import messages
+import os
+import sys
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -12,7 +14,26 @@ SECRET_KEY = 'django-insecure-session-key'
 
 # For our React SPA, we will explicitly allow unauthenticated users
 REST_FRAMEWORK = {
-    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny']}
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.AllowAny'],
+    'DEFAULT_PAGINATION_CLASS': 'label_music_manager.pagination.KeysetPagination',
+    'PAGE_SIZE': 50}
+
+# Upper bound for the ?page_size= parameter on paginated API endpoints
+API_MAX_PAGE_SIZE = 200
+# Upper bound for the number of albums in one batch write
+API_MAX_BATCH_SIZE = 500
+# Albums per page of the album list
+ALBUM_LIST_PAGE_SIZE = 50
+
+# Queries taking at least this many milliseconds are logged as warnings
+# with their SQL and the line of our code that ran them
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Bearer token the Prometheus scraper sends to read /metrics/; staff users
+# can read it without one
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Directory where each process keeps its metrics for /metrics/ to sum; set
+# to an empty value for metrics of the answering process only
+METRICS_DIR = os.environ.get('METRICS_DIR', BASE_DIR / 'metrics')
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -31,7 +52,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'label_music_manager.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'label_music_manager.middleware.ReadYourWritesMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -42,11 +65,13 @@ MIDDLEWARE = [
     'django.middleware.locale.LocaleMiddleware'
 ]
 
-ROOT_URLCONF = 'MyMusicMaestro.urls'
+# asgi.py switches to label_music_manager.async_urls, the async read views
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'MyMusicMaestro.urls')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing renders for the Server-Timing header
+        'BACKEND': 'label_music_manager.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -61,15 +86,89 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'MyMusicMaestro.wsgi.application'
+ASGI_APPLICATION = 'MyMusicMaestro.asgi.application'
+
+# SQLite pragmas run on every new connection. Each one can be overridden
+# with an SQLITE_<NAME> environment variable, e.g. SQLITE_SYNCHRONOUS=FULL.
+#   journal_mode WAL   readers keep reading while a writer commits
+#   synchronous NORMAL safe with WAL; a power cut may lose the last commits
+#                      but never corrupts the database
+#   busy_timeout       milliseconds a writer waits for the lock before
+#                      "database is locked"
+#   cache_size         negative values are KiB, here 64MB per connection
+#   mmap_size          bytes of the file read through memory mapping
+SQLITE_PRAGMAS = {
+    name: os.environ.get(f'SQLITE_{name.upper()}', default)
+    for name, default in [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', '5000'),
+        ('cache_size', '-64000'),
+        ('mmap_size', '268435456'),
+    ]
+}
 
-# Database for development
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3'
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        # Seconds a connection is kept open between requests (0 closes it
+        # after every request); health checks replace connections that broke
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {
+            'init_command': '; '.join(f'PRAGMA {name} = {value}' for name, value in SQLITE_PRAGMAS.items()),
+            # Transactions take the write lock when they begin. A deferred
+            # transaction that reads and then writes cannot wait for the lock
+            # and fails with "database is locked" whatever busy_timeout is.
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Read-only copies of the database kept up to date outside Django (e.g. by
+# LiteFS or Litestream), as a comma separated list of files in
+# SQLITE_REPLICAS. Reads are spread over them, see
+# label_music_manager.routers.PrimaryReplicaRouter.
+DATABASE_REPLICAS = []
+for number, path in enumerate(filter(None, os.environ.get('SQLITE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': path, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['label_music_manager.routers.PrimaryReplicaRouter']
+
+# Rendered album pages and API documents are cached until a write
+# invalidates them, so every process serving requests, and the run_worker
+# processes, must share one cache: a per-process cache would keep serving
+# what another process invalidated. Files under CACHE_LOCATION are shared
+# by the processes of one host; with several hosts set CACHE_BACKEND to
+# django.core.cache.backends.redis.RedisCache and CACHE_LOCATION to the
+# redis:// URL.
+#
+# The album cache keeps each album's generation (see
+# label_music_manager.album_cache) in a cache of its own, one entry per
+# album that is never culled, so that filling the page cache to
+# CACHE_MAX_ENTRIES does not evict them.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'label_music_manager.caching.FileCache')
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION', BASE_DIR / 'cache')
+if CACHE_BACKEND == 'label_music_manager.caching.FileCache':
+    CACHES = {
+        'default': {
+            'BACKEND': CACHE_BACKEND,
+            'LOCATION': CACHE_LOCATION,
+            'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))},
+        },
+        'album-generations': {
+            'BACKEND': CACHE_BACKEND,
+            'LOCATION': os.path.join(CACHE_LOCATION, 'generations'),
+            'OPTIONS': {'MAX_ENTRIES': sys.maxsize},
+        },
+    }
+else:
+    CACHES = {
+        alias: {'BACKEND': CACHE_BACKEND, 'LOCATION': CACHE_LOCATION, 'KEY_PREFIX': alias}
+        for alias in ('default', 'album-generations')
+    }
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Internationalisation
@@ -90,6 +189,22 @@ STATIC_URL = 'static/'
 # Media for uploaded files
 MEDIA_ROOT = BASE_DIR / 'media/'
 MEDIA_URL = 'media/'
+# Uploads are stored under content-hashed names and served as immutable by
+# label_music_manager.media; other files there are cached for MEDIA_MAX_AGE
+STORAGES = {
+    'default': {'BACKEND': 'label_music_manager.storage.ContentHashedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Hash uploads as they arrive, for the storage to name them by
+FILE_UPLOAD_HANDLERS = [
+    'label_music_manager.uploads.HashingMemoryFileUploadHandler',
+    'label_music_manager.uploads.HashingTemporaryFileUploadHandler',
+]
+MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 3600))
+# sendfile, or x-accel-redirect / x-sendfile to hand media to nginx or Apache
+MEDIA_DELIVERY = os.environ.get('MEDIA_DELIVERY', 'sendfile')
+# nginx `internal` location aliased to MEDIA_ROOT, for x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/internal-media/')
 
 # Set up for simple Bootstrap theming
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import Album, Song, AlbumTracklistItem, MusicManagerUser
+from .models import Album, Artist, Job, Song, AlbumTracklistItem, MusicManagerUser
 
 admin.site.register(Album)
+admin.site.register(Artist)
 admin.site.register(Song)
 admin.site.register(AlbumTracklistItem)
-admin.site.register(MusicManagerUser)
\ No newline at end of file
+admin.site.register(MusicManagerUser)
+admin.site.register(Job)
@@ -0,0 +1,150 @@
+import uuid
+
+from django.core.cache import cache, caches
+from django.db import transaction
+
+from .instrumentation import ALBUM_CACHE_HITS, ALBUM_CACHE_MISSES
+
+# Everything cached for an album is keyed under a per-album generation.
+# Invalidating replaces the generation, which orphans every variant at once
+# (pages for each role, API documents per representation) without having to
+# know which ones were stored. Orphaned entries expire after TIMEOUT.
+# Generations live in their own cache (settings.CACHES['album-generations']),
+# which is never culled; losing one would only cost the album's entries.
+TIMEOUT = 60 * 60
+
+
+def _generation_cache():
+    return caches['album-generations']
+
+
+def _generation_key(album_id):
+    return f'album-cache:{album_id}:generation'
+
+
+def _generation(album_id):
+    key, generations = _generation_key(album_id), _generation_cache()
+    generation = generations.get(key)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not generations.add(key, generation, None):
+            generation = generations.get(key)
+    return generation
+
+
+def _entry_key(album_id, variant, generation=None):
+    return f'album-cache:{album_id}:{generation or _generation(album_id)}:{variant}'
+
+
+def _generations(album_ids):
+    keys = {album_id: _generation_key(album_id) for album_id in album_ids}
+    stored = _generation_cache().get_many(keys.values())
+    generations = {album_id: stored.get(key) for album_id, key in keys.items()}
+    missing = [album_id for album_id, generation in generations.items() if generation is None]
+    for album_id in missing:
+        generations[album_id] = _generation(album_id)
+    return generations
+
+
+def get_or_set(album_id, variant, build):
+    """
+    Returns the cached value of `variant` for the album, calling `build()`
+    and storing its result on a miss. `build` may return None to skip
+    caching, e.g. when the album does not exist.
+    """
+    key = _entry_key(album_id, variant)
+    value = cache.get(key)
+    if value is not None:
+        ALBUM_CACHE_HITS.increment()
+        return value
+    ALBUM_CACHE_MISSES.increment()
+    value = build()
+    if value is not None:
+        cache.set(key, value, TIMEOUT)
+    return value
+
+
+def get_many_or_set(album_ids, variant, build_many):
+    """
+    Like get_or_set for several albums with a constant number of cache
+    round trips. `build_many(missing_ids)` returns {album_id: value} for
+    the albums that were not cached; albums it leaves out are left out of
+    the result too.
+    """
+    generations = _generations(album_ids)
+    keys = {album_id: _entry_key(album_id, variant, generations[album_id]) for album_id in album_ids}
+    stored = cache.get_many(keys.values())
+    values = {album_id: stored[key] for album_id, key in keys.items() if key in stored}
+    missing = [album_id for album_id in album_ids if album_id not in values]
+    ALBUM_CACHE_HITS.increment(len(values))
+    ALBUM_CACHE_MISSES.increment(len(missing))
+    if missing:
+        built = {album_id: value for album_id, value in build_many(missing).items() if value is not None}
+        cache.set_many({keys[album_id]: value for album_id, value in built.items()}, TIMEOUT)
+        values.update(built)
+    return values
+
+
+# Async versions for async views. `build` and `build_many` are coroutine
+# functions.
+
+async def _agenerations(album_ids):
+    keys = {album_id: _generation_key(album_id) for album_id in album_ids}
+    generation_cache = _generation_cache()
+    stored = await generation_cache.aget_many(keys.values())
+    generations = {}
+    for album_id, key in keys.items():
+        generation = stored.get(key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not await generation_cache.aadd(key, generation, None):
+                generation = await generation_cache.aget(key)
+        generations[album_id] = generation
+    return generations
+
+
+async def aget_or_set(album_id, variant, build):
+    values = await aget_many_or_set([album_id], variant, lambda missing: _abuild_one(album_id, build))
+    return values.get(album_id)
+
+
+async def _abuild_one(album_id, build):
+    return {album_id: await build()}
+
+
+async def aget_many_or_set(album_ids, variant, build_many):
+    generations = await _agenerations(album_ids)
+    keys = {album_id: _entry_key(album_id, variant, generations[album_id]) for album_id in album_ids}
+    stored = await cache.aget_many(keys.values())
+    values = {album_id: stored[key] for album_id, key in keys.items() if key in stored}
+    missing = [album_id for album_id in album_ids if album_id not in values]
+    ALBUM_CACHE_HITS.increment(len(values))
+    ALBUM_CACHE_MISSES.increment(len(missing))
+    if missing:
+        built = {album_id: value for album_id, value in (await build_many(missing)).items() if value is not None}
+        await cache.aset_many({keys[album_id]: value for album_id, value in built.items()}, TIMEOUT)
+        values.update(built)
+    return values
+
+
+def invalidate(*album_ids):
+    keys = [_generation_key(album_id) for album_id in album_ids]
+    if not keys:
+        return
+    generations = _generation_cache()
+    generations.delete_many(keys)
+    # Readers inside other transactions may repopulate the cache with the
+    # old rows before this one commits, so drop the entries again after
+    transaction.on_commit(lambda: generations.delete_many(keys))
+
+
+def stats():
+    # Kept with the other metrics, summed over every process, rather than
+    # in the cache, where each hit would be a write
+    hits, misses = ALBUM_CACHE_HITS.total(), ALBUM_CACHE_MISSES.total()
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+    }
@@ -1,19 +1,217 @@
 # Use this file for your API viewsets only
 # E.g., from rest_framework import ...
-from rest_framework import viewsets
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+from rest_framework import status, viewsets
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from . import album_cache, documents, exports, instrumentation, search
+from .conditional import ConditionalGetMixin
+from .filters import AllowListFilter, choice, decimal, iso_date, whole_number
 from .models import Album, AlbumTracklistItem, Song
-from .serializers import AlbumSerializer, AlbumTracklistItemSerializer, SongSerializer
+from .pagination import AlbumPagination, SongPagination
+from .serializers import (AlbumBatchItemSerializer, AlbumSerializer, AlbumSummarySerializer,
+                          AlbumTracklistItemSerializer, SongSerializer, TrackMoveSerializer)
 
-class AlbumViewSet(viewsets.ModelViewSet):
-    queryset = Album.objects.all()
+class AlbumViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Album.objects.with_tracklist().select_related('artist')
     serializer_class = AlbumSerializer
+    pagination_class = AlbumPagination
+    filter_backends = [AllowListFilter]
+    # ?format= is taken by DRF for choosing the response format. Range
+    # filters are served by an index when ordering on the same column.
+    filter_fields = {
+        'artist': ('artist__name', str),
+        'release_format': ('format__in', choice(Album.FORMAT_CHOICES)),
+        'released_after': ('release_date__gte', iso_date),
+        'released_before': ('release_date__lte', iso_date),
+        'min_price': ('price__gte', decimal),
+        'max_price': ('price__lte', decimal),
+    }
+
+    # ?view=summary returns compact album cards (playtime, track count,
+    # release year and a shortened description) without nested tracks
+    def is_summary(self):
+        return self.request.method == 'GET' and self.request.query_params.get('view') == 'summary'
+
+    def get_queryset(self):
+        if self.is_summary():
+            return Album.objects.with_summary()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.is_summary():
+            return AlbumSummarySerializer
+        return super().get_serializer_class()
+
+    # The full representation is read from the stored album documents, see
+    # label_music_manager.documents
+    def serves_documents(self):
+        return not self.is_summary()
+
+    def document_queryset(self):
+        # Only what pagination orders on, and the documents
+        return Album.objects.select_related('document').only('id', 'title', 'price', 'release_date', 'document__body')
+
+    def document_response(self, body):
+        if isinstance(self.request.accepted_renderer, JSONRenderer):
+            return HttpResponse(body, content_type='application/json')
+        # e.g. the browsable API
+        return Response(json.loads(body))
+
+    def list(self, request, *args, **kwargs):
+        if not self.serves_documents():
+            return super().list(request, *args, **kwargs)
+        return self.conditional(request, self.collection_validators(request), self.list_documents)
+
+    def list_documents(self, request):
+        page = self.paginate_queryset(self.filter_queryset(self.document_queryset()))
+        return self.document_response(documents.absolute(documents.page(self.paginator, page), request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.item_validators(request), self.cached_retrieve, *args, **kwargs)
+
+    def cached_retrieve(self, request, *args, **kwargs):
+        album_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        if not self.serves_documents():
+            data = album_cache.get_or_set(album_id, self.retrieve_cache_variant(request),
+                                          lambda: self.get_serializer(self.get_object()).data)
+            return Response(data)
 
-class SongViewSet(viewsets.ModelViewSet):
+        def build():
+            body = documents.get(album_id)
+            return None if body is None else documents.absolute(body, request)
+        body = album_cache.get_or_set(album_id, self.retrieve_cache_variant(request), build)
+        if body is None:
+            raise Http404("No Album matches the given query.")
+        return self.document_response(body)
+
+    def retrieve_cache_variant(self, request):
+        # Albums are cached per representation; cover URLs are absolute, so
+        # the host they were built for is part of the key
+        representation = 'summary' if self.is_summary() else 'document'
+        return f"api:{representation}:{request.scheme}://{request.get_host()}"
+
+    @action(detail=True, methods=['post'], url_path='move-track')
+    def move_track(self, request, pk=None):
+        """
+        Moves a song of the album to another place in its tracklist:
+        {"song": <song id>, "index": <new place, from 0>}. Usually only the
+        moved track's row is written. Returns the new order.
+        """
+        serializer = TrackMoveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        album = self.get_object()
+        try:
+            album.move_track(serializer.validated_data['song'], serializer.validated_data['index'])
+        except DjangoValidationError as error:
+            raise ValidationError({'song': error.messages})
+        return Response({'tracks': list(album.albumtracklistitem_set.order_by('position', 'id')
+                                        .values('song', 'position'))})
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Creates or replaces up to API_MAX_BATCH_SIZE albums with their
+        tracklists: {"albums": [{...album fields, "tracks": [...]}, ...]}.
+        Either every album is written, in one transaction, or none is and
+        the results list the errors of each item.
+        """
+        items = request.data.get('albums') if isinstance(request.data, dict) else None
+        serializer = AlbumBatchItemSerializer(data=items, many=True, allow_empty=False,
+                                              max_length=settings.API_MAX_BATCH_SIZE)
+        if not serializer.is_valid():
+            if not isinstance(serializer.errors, list):
+                return Response({'albums': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'results': [{'status': 'invalid', 'errors': errors} if errors else {'status': 'valid'}
+                                         for errors in serializer.errors]}, status=status.HTTP_400_BAD_REQUEST)
+        albums = serializer.save()
+        return Response({'results': [
+            {'status': 'updated' if 'id' in item else 'created', 'id': album.id, 'slug': album.slug}
+            for item, album in zip(serializer.validated_data, albums)
+        ]})
+
+class SongViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Song.objects.all()
     serializer_class = SongSerializer
+    pagination_class = SongPagination
+    filter_backends = [AllowListFilter]
+    filter_fields = {
+        'title': ('title', str),
+        'min_length': ('length__gte', whole_number),
+        'max_length': ('length__lte', whole_number),
+        'album': ('albums', whole_number),
+    }
 
 class AlbumTracklistItemViewSet(viewsets.ModelViewSet):
     queryset = AlbumTracklistItem.objects.all()
     serializer_class = AlbumTracklistItemSerializer
 
-    
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    return Response(album_cache.stats())
+
+@api_view(['GET'])
+def search_catalog(request):
+    """
+    Ranked full-text search over album titles, artists and descriptions and
+    song titles. Every word is matched as a prefix. ?type=album or
+    ?type=song restricts the results, ?limit= caps them.
+    """
+    kinds = request.query_params.getlist('type') or [search.ALBUM, search.SONG]
+    if not set(kinds) <= {search.ALBUM, search.SONG}:
+        raise ValidationError({'type': "Choose from: album, song."})
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), settings.API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValidationError({'limit': "A whole number is required."})
+
+    hits = search.search(request.query_params.get('q', ''), kinds, max(limit, 1))
+    albums = Album.objects.with_summary().in_bulk([pk for kind, pk, score in hits if kind == search.ALBUM])
+    songs = Song.objects.in_bulk([pk for kind, pk, score in hits if kind == search.SONG])
+    context = {'request': request}
+    results = []
+    for kind, pk, score in hits:
+        if kind == search.ALBUM and pk in albums:
+            results.append({'type': kind, 'score': score, 'album': AlbumSummarySerializer(albums[pk], context=context).data})
+        elif kind == search.SONG and pk in songs:
+            results.append({'type': kind, 'score': score, 'song': SongSerializer(songs[pk], context=context).data})
+    return Response({'results': results})
+
+
+# A plain Django view rather than a DRF one: the response is streamed as it
+# is produced, and DRF reserves the format suffix for its own renderers
+@require_GET
+def export_catalog(request, kind, fmt):
+    """
+    Streams every album (with its tracks), song or tracklist item as NDJSON
+    or CSV. The database is read in fixed size chunks, so memory use stays
+    flat however large the catalog is.
+    """
+    response = StreamingHttpResponse(exports.export_lines(kind, fmt), content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+@require_GET
+def metrics(request):
+    """
+    Per-route request latency and database time histograms, the slow query
+    count and album cache hits of every process serving the site (see
+    label_music_manager.instrumentation), in Prometheus' text format. Readable by
+    staff, or with "Authorization: Bearer <METRICS_TOKEN>" for the scraper.
+    """
+    token = settings.METRICS_TOKEN
+    authorized = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(instrumentation.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
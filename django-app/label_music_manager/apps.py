@@ -5,3 +5,7 @@ from django.apps import AppConfig
 class LabelMusicManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'label_music_manager'
+
+    def ready(self):
+        # Connects the model signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.urls import include, path, re_path
+
+from . import async_views
+
+# URLconf of the ASGI entry point (MyMusicMaestro/asgi.py): the async read
+# paths and the streamed responses, then every URL of the project for the
+# rest
+urlpatterns = [
+    path('api/albums/', async_views.album_collection),
+    path('api/albums/<int:pk>/', async_views.album_item),
+    path('api/songs/', async_views.song_collection),
+    path('api/songs/<int:pk>/', async_views.song_item),
+    path('', async_views.album_list, name='album-list'),
+    path('albums/', async_views.album_list, name='album-list'),
+    path('albums/<int:id>/', async_views.album_detail, name='album-detail'),
+    re_path(r'^api/export/(?P<kind>albums|songs|tracklist)\.(?P<fmt>ndjson|csv)$', async_views.export_catalog),
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", async_views.serve_media),
+    path('', include('MyMusicMaestro.urls')),
+]
@@ -0,0 +1,224 @@
+# Async versions of the read paths, served by the ASGI entry point through
+# async_urls. They query with the async ORM, so a request waiting on the
+# database or a slow client holds no worker thread, and they render the same
+# pages and JSON as the sync views and viewsets.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+
+from . import album_cache, api_views, documents, media, views
+from .api_views import AlbumViewSet, SongViewSet
+from .conditional import aalbum_page_state, album_page_etag, album_page_last_modified, album_page_state
+from .models import Album, MusicManagerUser
+
+
+async def load_profile(request):
+    # Resolves request.user for the templates and returns the user's
+    # profile, or None
+    request.user = await request.auser()
+    return await MusicManagerUser.objects.filter(user_id=request.user.pk).afirst()
+
+
+@login_required
+async def album_list(request):
+    profile = await load_profile(request)
+    after, before = views.list_cursor(request.GET.get('after')), views.list_cursor(request.GET.get('before'))
+    rows = [row async for row in views.list_page_query(views.listed_albums(profile), after, before)]
+    rows, previous_page, next_page = views.list_page(rows, after, before)
+
+    items = {}
+    for variant, album_ids in views.list_variants(profile, rows).items():
+        async def build(missing, variant=variant):
+            return {album.id: views.render_list_item(album, variant)
+                    async for album in Album.objects.filter(id__in=missing).select_related('artist')}
+        items.update(await album_cache.aget_many_or_set(album_ids, f'list:{variant}', build))
+    return render(request, 'label_music_manager/album_list.html', {
+        'album_items': [items[album_id] for album_id, _ in rows if album_id in items],
+        'previous_page': previous_page,
+        'next_page': next_page,
+    })
+
+
+@login_required
+async def album_detail(request, id):
+    profile = await load_profile(request)
+    # Loaded with the async ORM here, the state is what the sync view's
+    # validators and checks read in album_page below
+    await aalbum_page_state(request, id)
+    return await album_page(request, id, profile=profile)
+
+
+@condition(etag_func=album_page_etag, last_modified_func=album_page_last_modified)
+async def album_page(request, id, profile):
+    state = album_page_state(request, id)
+    refusal = views.album_page_refusal(request, state, profile)
+    if refusal is not None:
+        return refusal
+    variant = views.page_variant(profile, state['artist'])
+
+    async def build():
+        album = await views.album_body_query(id).afirst()
+        return None if album is None else views.render_album_body(album, variant)
+
+    return views.album_page_response(request, await album_cache.aget_or_set(id, f'page:{variant}', build))
+
+
+# The API endpoints answer JSON GETs themselves, with the viewsets' filters,
+# pagination, serializers and validators. Writes, OPTIONS and other renderers
+# (e.g. the browsable API) are passed on to the viewset.
+
+LIST_ACTIONS = {'get': 'list', 'post': 'create'}
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+
+
+def wants_json(request):
+    fmt = request.GET.get('format')
+    return request.method == 'GET' and fmt in (None, 'json') and 'text/html' not in request.headers.get('Accept', '')
+
+
+def json_response(data, status=200, view=None):
+    return encoded_json_response(JSONRenderer().render(data), status, view)
+
+
+def encoded_json_response(content, status=200, view=None):
+    response = HttpResponse(content, status=status, content_type='application/json')
+    patch_vary_headers(response, ['Accept'])
+    if view is not None:
+        response['Allow'] = ', '.join(view.allowed_methods)
+    return response
+
+
+def viewset_for(viewset_class, actions, request, action, kwargs):
+    # A viewset set up as DRF's dispatch would for a JSON GET, up to the
+    # checks of initial()
+    view = viewset_class(action=action, action_map=actions, format_kwarg=None, args=(), kwargs=kwargs)
+    for method, name in actions.items():
+        setattr(view, method, getattr(view, name))
+    view.args, view.kwargs = (), kwargs
+    view.request = view.initialize_request(request)
+    view.headers = view.default_response_headers
+    return view
+
+
+def read_endpoint(viewset_class, detail):
+    actions = DETAIL_ACTIONS if detail else LIST_ACTIONS
+    viewset_view = viewset_class.as_view(actions)
+
+    @csrf_exempt
+    async def endpoint(request, **kwargs):
+        if not wants_json(request):
+            return await sync_to_async(viewset_view)(request, **kwargs)
+        view = viewset_for(viewset_class, actions, request, 'retrieve' if detail else 'list', kwargs)
+        try:
+            # Content negotiation, authentication, permissions and
+            # throttling, as for the sync viewsets; they may query
+            await sync_to_async(view.initial)(view.request)
+            return await (retrieve(view, kwargs['pk']) if detail else list_page(view))
+        except APIException as error:
+            return await sync_to_async(error_response)(view, error)
+    return endpoint
+
+
+def error_response(view, error):
+    # The response DRF's dispatch gives for `error`, e.g. a 403 from a
+    # permission check with its headers
+    response = view.finalize_response(view.request, view.handle_exception(error))
+    return response.render()
+
+
+async def list_page(view):
+    validators = await view.acollection_validators(view.request)
+    not_modified = view.not_modified(view.request, validators)
+    if not_modified is not None:
+        return not_modified
+    if serves_documents(view):
+        page = await view.paginator.apaginate_queryset(view.filter_queryset(view.document_queryset()),
+                                                       view.request, view)
+        body = documents.absolute(await documents.apage(view.paginator, page), view.request)
+        return view.add_validators(encoded_json_response(body, view=view), validators)
+    page = await view.paginator.apaginate_queryset(view.filter_queryset(view.get_queryset()), view.request, view)
+    data = view.paginator.get_paginated_response(view.get_serializer(page, many=True).data).data
+    return view.add_validators(json_response(data, view=view), validators)
+
+
+async def retrieve(view, pk):
+    validators = await view.aitem_validators(view.request)
+    not_modified = view.not_modified(view.request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    async def build():
+        instance = await view.get_queryset().filter(pk=pk).afirst()
+        return None if instance is None else view.get_serializer(instance).data
+
+    async def build_document():
+        body = await documents.aget(pk)
+        return None if body is None else documents.absolute(body, view.request)
+
+    if serves_documents(view):
+        data = await album_cache.aget_or_set(pk, view.retrieve_cache_variant(view.request), build_document)
+    elif hasattr(view, 'retrieve_cache_variant'):
+        data = await album_cache.aget_or_set(pk, view.retrieve_cache_variant(view.request), build)
+    else:
+        data = await build()
+    if data is None:
+        model = view.queryset.model._meta.object_name
+        return json_response({'detail': f"No {model} matches the given query."}, status=404, view=view)
+    if serves_documents(view):
+        return view.add_validators(encoded_json_response(data, view=view), validators)
+    return view.add_validators(json_response(data, view=view), validators)
+
+
+def serves_documents(view):
+    return hasattr(view, 'serves_documents') and view.serves_documents()
+
+
+album_collection = read_endpoint(AlbumViewSet, detail=False)
+album_item = read_endpoint(AlbumViewSet, detail=True)
+song_collection = read_endpoint(SongViewSet, detail=False)
+song_item = read_endpoint(SongViewSet, detail=True)
+
+
+# Django's ASGI handler reads a streaming response with a sync iterator
+# whole, into memory, before sending any of it; an export or a large media
+# file would be held entirely. These views stream the iterator instead,
+# read in the sync thread up to STREAM_BATCH_BYTES at a time. Under ASGI
+# media never goes out with sendfile(): hand it to the web server with
+# MEDIA_DELIVERY = 'x-accel-redirect' or 'x-sendfile'.
+STREAM_BATCH_BYTES = 64 * 1024
+
+
+def next_batch(parts):
+    batch, size = [], 0
+    for part in parts:
+        batch.append(part)
+        size += len(part)
+        if size >= STREAM_BATCH_BYTES:
+            break
+    return b''.join(batch)
+
+
+async def in_batches(parts):
+    parts = iter(parts)
+    while batch := await sync_to_async(next_batch)(parts):
+        yield batch
+
+
+def streamed(view):
+    # `view`, with a streaming response it returns sent as it is read
+    async def wrapped(request, *args, **kwargs):
+        response = await sync_to_async(view)(request, *args, **kwargs)
+        if response.streaming and not response.is_async:
+            response.streaming_content = in_batches(response.streaming_content)
+        return response
+    return wrapped
+
+
+export_catalog = streamed(api_views.export_catalog)
+serve_media = streamed(media.serve)
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, reset_queries, transaction
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .forms import AlbumForm
+from .management.commands.seed import USERNAME_PREFIX
+from .models import Album, Song
+
+
+class Rollback(Exception):
+    pass
+
+
+class BenchmarkContext:
+    """
+    Clients logged in as the seeded accounts and the rows the benchmarks
+    work on. Expects a catalog created by the seed command.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        for role, username in [('editor', f'{USERNAME_PREFIX}editor'),
+                               ('viewer', f'{USERNAME_PREFIX}viewer'),
+                               ('artist', f'{USERNAME_PREFIX}artist-1')]:
+            client = Client()
+            client.force_login(User.objects.get(username=username))
+            self.clients[role] = client
+        self.anonymous = Client()
+        self.request = RequestFactory().get('/')
+        # The most recent album, so every catalog size benchmarks a similar row
+        self.album = Album.objects.with_tracklist().latest('id')
+        self.songs = list(Song.objects.order_by('id').values_list('id', flat=True)[:40])
+
+
+@contextmanager
+def isolated():
+    """
+    Settings for a benchmark run against a test database. Every cache is
+    swapped for an empty one in a temporary directory, as measure() clears
+    the cache and the run fills it with the test database's albums, and
+    reads go to the test database rather than the real replicas.
+    """
+    location = tempfile.mkdtemp()
+    caches = {alias: {'BACKEND': 'label_music_manager.caching.FileCache', 'LOCATION': os.path.join(location, alias)}
+              for alias in settings.CACHES}
+    try:
+        with override_settings(CACHES=caches, DATABASE_REPLICAS=[]):
+            yield
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+
+
+def get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, f"{url} returned {response.status_code}"
+    return response
+
+
+def save_tracklist(context):
+    # Swaps the album's tracklist for another one and back, rolling back
+    # so every repeat starts from the same rows
+    try:
+        with transaction.atomic():
+            context.album.set_tracklist(context.songs[:20])
+            context.album.set_tracklist(context.songs[20:])
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def render_album_form(context):
+    form = AlbumForm(instance=context.album)
+    render_to_string('label_music_manager/album_form.html', {'form': form}, request=context.request)
+
+
+BENCHMARKS = {
+    'album_list[editor]': lambda context: get(context.clients['editor'], reverse('album-list')),
+    'album_list[viewer]': lambda context: get(context.clients['viewer'], reverse('album-list')),
+    'album_list[artist]': lambda context: get(context.clients['artist'], reverse('album-list')),
+    # Keyset pages cost the same as the first one
+    'album_list[middle page]': lambda context: get(
+        context.clients['editor'], f"{reverse('album-list')}?after={context.album.id // 2}"),
+    'album_detail': lambda context: get(context.clients['editor'], reverse('album-detail', args=[context.album.id])),
+    'api_album_list': lambda context: get(context.anonymous, '/api/albums/'),
+    'api_album_list[summary]': lambda context: get(context.anonymous, '/api/albums/?view=summary'),
+    'api_album_retrieve': lambda context: get(context.anonymous, f'/api/albums/{context.album.id}/'),
+    'album_form_render': render_album_form,
+    'tracklist_save': save_tracklist,
+}
+
+
+def measure(function, context, repeat):
+    """
+    Runs `function` once to warm up, then `repeat` times with caches
+    cleared so the uncached path is measured. Returns the median wall time,
+    the query count of one run and the peak memory allocated during one run.
+    """
+    cache.clear()
+    function(context)
+    timings = []
+    for _ in range(repeat):
+        cache.clear()
+        started = time.perf_counter()
+        function(context)
+        timings.append(time.perf_counter() - started)
+
+    cache.clear()
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        function(context)
+    # Read now: the captured queries are a slice of the connection's log,
+    # which the next request clears
+    query_count = len(queries)
+
+    cache.clear()
+    tracemalloc.start()
+    try:
+        function(context)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'time_ms': round(statistics.median(timings) * 1000, 3),
+        'queries': query_count,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(repeat=5, names=None):
+    context = BenchmarkContext()
+    return {name: measure(function, context, repeat)
+            for name, function in BENCHMARKS.items() if names is None or name in names}
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Lists the benchmarks that got slower than the baseline by more than
+    `threshold` (a fraction) or started running more queries, as
+    (size, name, metric, baseline value, new value) tuples. Benchmarks
+    missing from either side are skipped.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, current in benchmarks.items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                continue
+            if current['time_ms'] > previous['time_ms'] * (1 + threshold):
+                regressions.append((size, name, 'time_ms', previous['time_ms'], current['time_ms']))
+            if current['queries'] > previous['queries']:
+                regressions.append((size, name, 'queries', previous['queries'], current['queries']))
+    return regressions
+
+
+# Server throughput: many concurrent keep-alive connections against a
+# running server, to compare deployments (e.g. WSGI against ASGI) rather
+# than code paths
+
+def load_test(url, connections, duration, headers=None):
+    """
+    Keeps `connections` HTTP/1.1 connections requesting `url` back to back
+    for `duration` seconds. Returns the request count and rate, latency
+    percentiles and the number of failed requests (errors or 4xx/5xx).
+    Plain asyncio, so thousands of connections fit in one process.
+    """
+    return asyncio.run(_load(url, connections, duration, headers or {}))
+
+
+async def _load(url, connections, duration, headers):
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError('Only http:// URLs can be load tested')
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    lines = [f'GET {path} HTTP/1.1', f'Host: {parts.netloc}', *(f'{name}: {value}' for name, value in headers.items())]
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode()
+    latencies, failures = [], []
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_client(parts.hostname, parts.port or 80, request, deadline, latencies, failures)
+                           for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'connections': connections,
+        'requests': len(latencies),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentiles[49] * 1000, 2) if percentiles else None,
+        'p99_ms': round(percentiles[98] * 1000, 2) if percentiles else None,
+        'failures': len(failures),
+    }
+
+
+async def _client(host, port, request, deadline, latencies, failures):
+    writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, keep_alive = await asyncio.wait_for(_read_response(reader), timeout=30)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ValueError) as error:
+            failures.append(error)
+            writer = _close(writer)
+            # A refused or reset connection is retried after a pause
+            await asyncio.sleep(0.05)
+            continue
+        latencies.append(time.perf_counter() - started)
+        if status >= 400:
+            failures.append(status)
+        if not keep_alive:
+            writer = _close(writer)
+    _close(writer)
+
+
+async def _read_response(reader):
+    # Reads one response and returns (status, whether the connection stays open)
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    status = int(head[0].split()[1])
+    headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(':') for line in head[1:] if line)}
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while size := int((await reader.readuntil(b'\r\n')).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readuntil(b'\r\n')
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+def _close(writer):
+    if writer is not None:
+        writer.close()
+    return None
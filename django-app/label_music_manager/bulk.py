@@ -0,0 +1,27 @@
+from django.db import connection
+
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_rows(model, fields, rows, batch_size=5000):
+    """
+    Inserts `rows` (tuples of database values for `fields`) in batches
+    with executemany. For the large loads of the seed and import commands,
+    where building model instances for bulk_create takes several times
+    longer than the inserts themselves. Sends no signals and returns no ids.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        for batch in batches(rows, batch_size):
+            cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', batch)
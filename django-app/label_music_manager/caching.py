@@ -0,0 +1,26 @@
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class FileCache(FileBasedCache):
+    """
+    Django's file-based cache, shared by the processes of one host, except
+    that a write checks whether the cache has outgrown MAX_ENTRIES at most
+    every CULL_INTERVAL seconds (an OPTIONS key, 60 by default) in each
+    process. FileBasedCache checks on every write, and the check lists the
+    whole directory, which costs more than the write itself once the cache
+    holds a few thousand entries.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get('OPTIONS', {}).get('CULL_INTERVAL', 60)
+        self._next_cull = 0
+
+    def _cull(self):
+        now = time.monotonic()
+        if now < self._next_cull:
+            return
+        self._next_cull = now + self._cull_interval
+        super()._cull()
@@ -0,0 +1,122 @@
+import hashlib
+
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .models import Album, CollectionVersion
+
+
+def make_etag(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def album_page_state(request, id):
+    """
+    The few album columns an album page needs before rendering (modified
+    time, artist id and slug), or None if there is no such album. Looked up
+    once per request and shared by the ETag and Last-Modified functions
+    given to django.views.decorators.http.condition and the view itself.
+    """
+    if not hasattr(request, '_album_page_state'):
+        request._album_page_state = album_page_query(id).first()
+    return request._album_page_state
+
+
+async def aalbum_page_state(request, id):
+    if not hasattr(request, '_album_page_state'):
+        request._album_page_state = await album_page_query(id).afirst()
+    return request._album_page_state
+
+
+def album_page_query(id):
+    return Album.objects.filter(pk=id).values('updated_at', 'artist', 'slug')
+
+
+def album_page_etag(request, id, **kwargs):
+    # Pages show different action links per user, so the user is part of
+    # the tag, and their forms carry a token made from the CSRF secret,
+    # which login rotates, so that is too. get_token() creates the secret
+    # the page will use if the client has none yet.
+    state = album_page_state(request, id)
+    if state is None:
+        return None
+    get_token(request)
+    return make_etag('album-page', id, state['updated_at'].isoformat(), request.user.pk,
+                     request.META['CSRF_COOKIE'])
+
+
+def album_page_last_modified(request, id, **kwargs):
+    state = album_page_state(request, id)
+    return state and state['updated_at']
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified to list and retrieve on viewsets whose model
+    has an `updated_at` column, answering If-None-Match and
+    If-Modified-Since with 304 before anything is serialized.
+    """
+
+    def representation_key(self, request):
+        # The same rows render differently per query string and renderer
+        return (request.get_full_path(), request.accepted_renderer.format)
+
+    def item_query(self):
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        return self.queryset.model.objects.filter(**lookup).values_list('updated_at', flat=True)
+
+    def item_validators(self, request):
+        return self.item_tags(request, self.item_query().first())
+
+    async def aitem_validators(self, request):
+        return self.item_tags(request, await self.item_query().afirst())
+
+    def item_tags(self, request, updated_at):
+        if updated_at is None:
+            return None, None
+        return make_etag(updated_at.isoformat(), *self.representation_key(request)), updated_at
+
+    # A list is validated by its model's CollectionVersion, one row read by
+    # primary key whatever the size of the collection or the filters; the
+    # filters and page are part of the representation key
+    def collection_query(self):
+        return CollectionVersion.objects.for_model(self.queryset.model)
+
+    def collection_validators(self, request):
+        return self.collection_tags(request, self.collection_query().first())
+
+    async def acollection_validators(self, request):
+        return self.collection_tags(request, await self.collection_query().afirst())
+
+    def collection_tags(self, request, state):
+        version, latest = (state['version'], state['updated_at']) if state else (0, None)
+        return make_etag('collection', version, *self.representation_key(request)), latest
+
+    def not_modified(self, request, validators):
+        # The 304 response when the client's copy is current, else None
+        etag, last_modified = validators
+        if etag is None:
+            return None
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        return get_conditional_response(request, etag=quote_etag(etag), last_modified=timestamp)
+
+    def add_validators(self, response, validators):
+        etag, last_modified = validators
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = quote_etag(etag)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+        return response
+
+    def conditional(self, request, validators, view, *args, **kwargs):
+        not_modified = self.not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+        return self.add_validators(view(request, *args, **kwargs), validators)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, self.collection_validators(request), super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, self.item_validators(request), super().retrieve, *args, **kwargs)
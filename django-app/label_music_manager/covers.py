@@ -0,0 +1,117 @@
+import os
+import shutil
+from pathlib import Path
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+# Fixed cover sizes used across the site. 'fit' crops to exactly the given
+# size, 'contain' keeps the aspect ratio within it.
+COVER_SIZES = {
+    'thumb': ((100, 100), 'fit'),
+    'card': ((400, 400), 'fit'),
+    'detail': ((800, 800), 'contain'),
+}
+COVER_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+DERIVATIVES_DIR = 'covers/derived'
+# Shown for albums without a cover of their own; never deleted
+DEFAULT_COVER = 'covers/default.jpg'
+
+
+def derivative_name(name, size, fmt):
+    # covers/abc.png -> covers/derived/covers/abc/thumb.webp
+    return f"{derivatives_dir(name)}/{size}.{COVER_FORMATS[fmt][1]}"
+
+
+def derivatives_dir(name):
+    return f"{DERIVATIVES_DIR}/{os.path.splitext(name)[0]}"
+
+
+def render_derivatives(source_path, media_root, name, force=False):
+    """
+    Writes every size and format of the cover at `source_path` below
+    `media_root` and returns how many files were written. Only uses Pillow,
+    so it can run in worker processes without Django being set up.
+    """
+    written = 0
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+        for size, (dimensions, mode) in COVER_SIZES.items():
+            if mode == 'fit':
+                resized = ImageOps.fit(image, dimensions, Image.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail(dimensions, Image.LANCZOS)
+            for fmt, (pillow_format, _) in COVER_FORMATS.items():
+                target = Path(media_root) / derivative_name(name, size, fmt)
+                if target.exists() and not force:
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                resized.save(target, pillow_format, quality=85, optimize=True)
+                written += 1
+    return written
+
+
+def cover_source(album):
+    # Returns the stored cover name if the file is actually there
+    name = album.cover_image.name if album.cover_image else None
+    if name and default_storage.exists(name):
+        return name
+    return None
+
+
+def has_derivatives(album):
+    name = album.cover_image.name if album.cover_image else None
+    return bool(name) and default_storage.exists(derivative_name(name, 'thumb', 'jpeg'))
+
+
+def cover_url(album, size, fmt='jpeg'):
+    """
+    URL of the `size` derivative of the album's cover, falling back to the
+    original upload when no derivative has been generated yet.
+    """
+    if not album.cover_image:
+        return None
+    return name_url(album.cover_image.name, size, fmt)
+
+
+def name_url(name, size, fmt='jpeg'):
+    # cover_url() for the stored cover name
+    derivative = derivative_name(name, size, fmt)
+    if default_storage.exists(derivative):
+        return default_storage.url(derivative)
+    return default_storage.url(name)
+
+
+def release(names):
+    """
+    Deletes the covers among `names` that no album uses any more, with their
+    derivatives, once the current transaction commits. Albums with the same
+    artwork share one stored file (see ContentHashedStorage), so the albums
+    referring to a file are its reference count.
+    """
+    names = {name for name in names if name and name != DEFAULT_COVER}
+    if names:
+        transaction.on_commit(lambda: remove_unused(names))
+
+
+def remove_unused(names):
+    from .models import Album  # models imports this module
+    # The check and the delete hold the database's write lock (transactions
+    # begin IMMEDIATE). An upload finds or stores its file inside the write
+    # transaction of Album.save(), so it cannot take up a name between the
+    # two: it either stores the file again after it was deleted, or its
+    # album is seen using the file here.
+    with transaction.atomic():
+        used = set(Album.objects.filter(cover_image__in=names).values_list('cover_image', flat=True))
+        for name in names - used:
+            remove(name)
+
+
+def remove(name):
+    default_storage.delete(name)
+    shutil.rmtree(os.path.join(default_storage.location, derivatives_dir(name)), ignore_errors=True)
@@ -0,0 +1,144 @@
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from . import jobs, serializers
+from .models import Album, AlbumDocument
+
+# Every album's full API representation (AlbumSerializer) is stored as JSON
+# in AlbumDocument, so album list and retrieve requests only read and join
+# strings. Documents are rewritten in the transaction that changes the
+# album: Album.save() and AlbumQuerySet.touch(), which every change to a
+# tracklist, artist or song goes through, and the bulk writers call
+# refresh() or schedule() themselves. Albums without a document yet are
+# rendered when read; `manage.py check_album_documents --repair` stores them.
+BATCH_SIZE = 500
+
+# Cover URLs are stored relative to the site and made absolute per request.
+# These keys followed by an unescaped quote can only be keys, never text
+# inside a string value, where every quote is escaped.
+URL_FIELDS = re.compile(r'("(?:cover_image|jpeg|webp)":")/')
+
+
+def render(album):
+    # Expects the artist and tracklist loaded. Without a request in the
+    # serializer context, URLs stay relative.
+    return JSONRenderer().render(serializers.AlbumSerializer(album).data).decode()
+
+
+def build(album_ids):
+    """
+    The documents of the albums, rendered by AlbumSerializer as render()
+    does, from albums loaded in two queries. The serializer's fields are set
+    up once for all of them, and cover URLs looked up once per cover file.
+    """
+    if not album_ids:
+        return []
+    albums = list(Album.objects.filter(pk__in=album_ids).with_tracklist().select_related('artist'))
+    data = serializers.AlbumSerializer(albums, many=True, context={'cover_urls': {}}).data
+    renderer = JSONRenderer()
+    return [AlbumDocument(album_id=album.pk, body=renderer.render(representation).decode(),
+                          album_updated_at=album.updated_at)
+            for album, representation in zip(albums, data)]
+
+
+def save(documents):
+    AlbumDocument.objects.bulk_create(documents, update_conflicts=True, unique_fields=['album'],
+                                      update_fields=['body', 'album_updated_at'])
+
+
+def refresh(album_ids):
+    """Rewrites the documents of the albums, BATCH_SIZE albums at a time."""
+    album_ids = list(album_ids)
+    for start in range(0, len(album_ids), BATCH_SIZE):
+        save(build(album_ids[start:start + BATCH_SIZE]))
+
+
+def schedule(album_ids):
+    """
+    Drops the stored documents of the albums and queues refresh_documents
+    jobs rewriting them, BATCH_SIZE albums per job, for bulk writers whose
+    throughput rendering would halve. Until a job has run, the albums are
+    rendered when read, as albums without a document always are.
+    """
+    album_ids = list(album_ids)
+    for start in range(0, len(album_ids), BATCH_SIZE):
+        batch = album_ids[start:start + BATCH_SIZE]
+        AlbumDocument.objects.filter(album_id__in=batch).delete()
+        jobs.enqueue('refresh_documents', album_ids=batch)
+
+
+def check(repair=False):
+    """
+    Compares every stored document with a fresh rendering of its album and
+    returns the number of albums checked and the ids of those whose document
+    is missing or differs. With `repair`, those documents are rewritten in
+    the same transaction as the comparison.
+    """
+    checked, stale, last_id = 0, [], 0
+    while True:
+        with transaction.atomic():
+            album_ids = list(Album.objects.filter(pk__gt=last_id).order_by('pk')
+                             .values_list('pk', flat=True)[:BATCH_SIZE])
+            if not album_ids:
+                return checked, stale
+            stored = dict(AlbumDocument.objects.filter(album_id__in=album_ids).values_list('album_id', 'body'))
+            changed = [document for document in build(album_ids) if stored.get(document.album_id) != document.body]
+            if repair:
+                save(changed)
+        checked += len(album_ids)
+        stale += [document.album_id for document in changed]
+        last_id = album_ids[-1]
+
+
+def absolute(body, request):
+    # Makes the stored cover URLs absolute, as the serializers would
+    origin = request.build_absolute_uri('/')[:-1]
+    return URL_FIELDS.sub(lambda match: match.group(1) + origin + '/', body)
+
+
+def get(album_id):
+    # The album's document, rendered if none is stored yet, or None if there
+    # is no such album
+    body = AlbumDocument.objects.filter(album_id=album_id).values_list('body', flat=True).first()
+    if body is None:
+        body = next((document.body for document in build([album_id])), None)
+    return body
+
+
+async def aget(album_id):
+    body = await AlbumDocument.objects.filter(album_id=album_id).values_list('body', flat=True).afirst()
+    if body is None:
+        body = await sync_to_async(get)(album_id)
+    return body
+
+
+def undocumented(albums):
+    return [album.pk for album in albums if not hasattr(album, 'document')]
+
+
+def join(albums, built=()):
+    # The JSON array of the documents of albums loaded with
+    # select_related('document'); `built` renders those without one
+    built = {document.album_id: document.body for document in built}
+    return '[' + ','.join(built[album.pk] if album.pk in built else album.document.body
+                          for album in albums if album.pk in built or hasattr(album, 'document')) + ']'
+
+
+def page(paginator, albums):
+    return envelope(paginator, join(albums, build(undocumented(albums))))
+
+
+async def apage(paginator, albums):
+    missing = undocumented(albums)
+    return envelope(paginator, join(albums, await sync_to_async(build)(missing) if missing else ()))
+
+
+def envelope(paginator, results):
+    # KeysetPagination's response envelope around a JSON array
+    next_link, previous_link = (json.dumps(link, ensure_ascii=False)
+                                for link in (paginator.get_next_link(), paginator.get_previous_link()))
+    return '{"next":%s,"previous":%s,"results":%s}' % (next_link, previous_link, results)
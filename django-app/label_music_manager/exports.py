@@ -0,0 +1,121 @@
+import csv
+import json
+
+from .models import Album, AlbumTracklistItem, Song
+
+# Rows are read in primary key order, CHUNK_SIZE at a time, so memory use
+# does not depend on the size of the catalog
+CHUNK_SIZE = 500
+
+KINDS = ('albums', 'songs', 'tracklist')
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+ALBUM_FIELDS = ['id', 'title', 'description', 'artist', 'price', 'format', 'release_date', 'slug', 'cover_image']
+TRACK_FIELDS = ['position', 'song_id', 'title', 'length']
+# Album CSV rows hold one track each; albums are repeated per track
+ALBUM_CSV_FIELDS = ALBUM_FIELDS + [f'track_{field}' for field in TRACK_FIELDS]
+SONG_FIELDS = ['id', 'title', 'length']
+TRACKLIST_FIELDS = ['id', 'album_id', 'song_id', 'position']
+
+
+def chunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yields lists of rows from `queryset` using keyset pagination on the
+    primary key, so late chunks cost the same as early ones.
+    """
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+        last_pk = last['id'] if isinstance(last, dict) else last.pk
+        if len(rows) < chunk_size:
+            return
+
+
+def album_record(album):
+    return {
+        'id': album.id,
+        'title': album.title,
+        'description': album.description,
+        'artist': album.artist.name,
+        'price': str(album.price),
+        'format': album.format,
+        'release_date': album.release_date.isoformat(),
+        'slug': album.slug,
+        'cover_image': album.cover_image.name if album.cover_image else '',
+        'tracks': [
+            {'position': item.position, 'song_id': item.song_id, 'title': item.song.title, 'length': item.song.length}
+            for item in album.ordered_tracklist_items
+        ],
+    }
+
+
+def album_records(chunk_size=CHUNK_SIZE):
+    for albums in chunks(Album.objects.with_tracklist().select_related('artist'), chunk_size):
+        for album in albums:
+            yield album_record(album)
+
+
+def album_csv_rows(records):
+    for record in records:
+        album = [record[field] for field in ALBUM_FIELDS]
+        if not record['tracks']:
+            yield album + [''] * len(TRACK_FIELDS)
+        for track in record['tracks']:
+            yield album + [track[field] for field in TRACK_FIELDS]
+
+
+def value_records(model, fields, chunk_size=CHUNK_SIZE):
+    for rows in chunks(model.objects.values(*fields), chunk_size):
+        yield from rows
+
+
+def records(kind, chunk_size=CHUNK_SIZE):
+    if kind == 'albums':
+        return album_records(chunk_size)
+    if kind == 'songs':
+        return value_records(Song, SONG_FIELDS, chunk_size)
+    return value_records(AlbumTracklistItem, TRACKLIST_FIELDS, chunk_size)
+
+
+class _Line:
+    # File-like object for csv.writer that hands back each written line
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(kind, chunk_size=CHUNK_SIZE):
+    for record in records(kind, chunk_size):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def csv_lines(kind, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Line())
+    if kind == 'albums':
+        yield writer.writerow(ALBUM_CSV_FIELDS)
+        for row in album_csv_rows(records(kind, chunk_size)):
+            yield writer.writerow(row)
+        return
+    fields = SONG_FIELDS if kind == 'songs' else TRACKLIST_FIELDS
+    yield writer.writerow(fields)
+    for record in records(kind, chunk_size):
+        yield writer.writerow([record[field] for field in fields])
+
+
+def export_lines(kind, fmt, chunk_size=CHUNK_SIZE):
+    """
+    Lines of text making up an export of `kind` (one of KINDS) in `fmt`
+    (one of FORMATS), produced lazily as the database is read.
+    """
+    if fmt == 'ndjson':
+        return ndjson_lines(kind, chunk_size)
+    return csv_lines(kind, chunk_size)
@@ -0,0 +1,76 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+# Parsers for filter parameters. Each raises ValueError with the message
+# returned to the client.
+
+def iso_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError("A YYYY-MM-DD date is required.")
+
+
+def decimal(value):
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError("A number is required.")
+    # NaN and Infinity parse, but the database fields refuse them
+    if not number.is_finite():
+        raise ValueError("A number is required.")
+    return number
+
+
+# Integers the database stores, signed 64-bit; SQLite overflows past them
+MIN_INTEGER, MAX_INTEGER = -2**63, 2**63 - 1
+
+
+def whole_number(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError("A whole number is required.")
+    if not MIN_INTEGER <= number <= MAX_INTEGER:
+        raise ValueError(f"A whole number between {MIN_INTEGER} and {MAX_INTEGER} is required.")
+    return number
+
+
+def choice(choices):
+    # Accepts only the stored values of a field's choices
+    allowed = [value for value, _ in choices]
+
+    def parse(value):
+        if value not in allowed:
+            raise ValueError(f"Choose from: {', '.join(allowed)}.")
+        return value
+    return parse
+
+
+class AllowListFilter(BaseFilterBackend):
+    """
+    Filters a view's queryset in the database on the query parameters the
+    view lists in `filter_fields`, a dict of
+    {parameter: (ORM lookup, parser)}. Other parameters are ignored.
+    Lookups ending in __in take the parameter repeated, e.g.
+    ?release_format=CD&release_format=VL; the others use its last value.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        errors, lookups = {}, {}
+        for param, (lookup, parse) in getattr(view, 'filter_fields', {}).items():
+            values = request.query_params.getlist(param)
+            if not values:
+                continue
+            try:
+                values = [parse(value) for value in values]
+            except ValueError as error:
+                errors[param] = str(error)
+                continue
+            lookups[lookup] = values if lookup.endswith('__in') else values[-1]
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**lookups)
@@ -1,19 +1,50 @@
 from django import forms
-from .models import Album, Song
+from .models import Album, Artist, Song
 from django.contrib.auth.models import User
 
 
 class AlbumForm(forms.ModelForm):
     tracklist = forms.ModelMultipleChoiceField(queryset=Song.objects.all(), required=False, widget=forms.CheckboxSelectMultiple)
+    # Typed in by name; saving with a new name creates the artist. Artist
+    # accounts do not get the field, their albums are always their own.
+    artist = forms.CharField(max_length=64)
     
     class Meta:
         model = Album
-        fields = ['title', 'description', 'artist', 'price', 'format', 'release_date', 'cover_image', 'tracklist']
+        # The artist is set by save(), not from the form data
+        fields = ['title', 'description', 'price', 'format', 'release_date', 'cover_image', 'tracklist']
         
     release_date = forms.DateField(
         widget=forms.DateInput(attrs={'type': 'date'}, format='%Y-%m-%d')
     )
 
+    def __init__(self, *args, account=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.account = account
+        if account is not None and account.user_type == 'artist':
+            del self.fields['artist']
+        elif self.instance.pk:
+            self.initial['artist'] = self.instance.artist.name
+        # Tick the album's current songs so saving the form keeps them
+        if self.instance.pk:
+            self.fields['tracklist'].initial = [song.pk for song in self.instance.tracklist]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if 'artist' not in self.fields and not self.instance.pk and self.account.artist_id is None:
+            raise forms.ValidationError("Your account is not linked to an artist, so it cannot create albums.")
+        return cleaned_data
+
+    def save(self, commit=True):
+        # The artist is only looked up, or created, once the form is valid,
+        # so that a rejected form leaves no artist behind
+        if 'artist' in self.fields:
+            name = self.cleaned_data['artist']
+            self.instance.artist = Artist.objects.for_names([name])[name]
+        elif not self.instance.pk:
+            self.instance.artist_id = self.account.artist_id
+        return super().save(commit)
+
 class RegistrationForm(forms.ModelForm):
     password = forms.CharField(widget=forms.PasswordInput)
 
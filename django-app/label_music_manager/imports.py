@@ -0,0 +1,278 @@
+import csv
+import json
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import album_cache, bulk, covers, documents, exports, jobs, search
+from .models import TRACKLIST_MODELS, Album, AlbumTracklistItem, Artist, CollectionVersion, Song
+
+# Albums written per transaction. Each chunk costs a fixed number of queries
+# however many tracks its albums have.
+CHUNK_SIZE = 500
+BATCH_SIZE = 1000
+
+FORMATS = {code for code, _ in Album.FORMAT_CHOICES}
+ALBUM_UPDATE_FIELDS = ['title', 'description', 'artist', 'price', 'format', 'release_date', 'cover_image', 'updated_at']
+
+
+def read_ndjson(lines):
+    """
+    Yields (line number, album record, error) for each line of an NDJSON
+    album export: one JSON object per album with its tracks nested.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield line_number, None, f"Invalid JSON: {error}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'Expected a JSON object'
+            continue
+        yield line_number, record, None
+
+
+def read_csv(lines):
+    """
+    Yields (line number, album record, error) from a CSV album export, which
+    has one row per track with the album columns repeated. Consecutive rows
+    of the same album are gathered into one record.
+    """
+    reader = csv.DictReader(lines)
+    missing = {'title', 'format'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+    record = key = line_number = None
+    for row in reader:
+        row_key = row.get('slug') or (row.get('title'), row.get('format'))
+        if record is None or row_key != key:
+            if record is not None:
+                yield line_number, record, None
+            key, line_number = row_key, reader.line_num
+            record = {field: row.get(field) for field in exports.ALBUM_FIELDS if field != 'id'}
+            record['tracks'] = []
+        if row.get('track_title'):
+            record['tracks'].append({'position': row.get('track_position'), 'title': row['track_title'],
+                                     'length': row.get('track_length')})
+    if record is not None:
+        yield line_number, record, None
+
+
+def read_records(lines, fmt):
+    return read_ndjson(lines) if fmt == 'ndjson' else read_csv(lines)
+
+
+def clean_record(record):
+    """
+    Checks an album record against the model's rules and returns
+    (slug, album field values, [(position, title, length), ...]). Raises
+    ValueError listing every problem found.
+    """
+    errors = []
+    title = str(record.get('title') or '').strip()
+    if not title or len(title) > 512:
+        errors.append('title must be 1 to 512 characters')
+    artist = str(record.get('artist') or '').strip()
+    if not artist or len(artist) > 64:
+        errors.append('artist must be 1 to 64 characters')
+    album_format = record.get('format')
+    if album_format not in FORMATS:
+        errors.append(f"format must be one of {', '.join(sorted(FORMATS))}")
+    try:
+        price = Decimal(str(record.get('price'))).quantize(Decimal('0.01'))
+        if not 0 <= price <= Decimal('999.99'):
+            raise InvalidOperation
+    except InvalidOperation:
+        price = None
+        errors.append('price must be a number from 0 to 999.99')
+    try:
+        release_date = date.fromisoformat(str(record.get('release_date')))
+        if release_date > date.today() + timedelta(days=3 * 365):
+            errors.append('release_date cannot be more than 3 years in the future')
+    except ValueError:
+        errors.append('release_date must be a YYYY-MM-DD date')
+
+    slug = slugify(f"{title}-{album_format}")
+    if record.get('slug') and record['slug'] != slug:
+        errors.append(f"slug {record['slug']!r} does not match the title and format ({slug!r})")
+
+    tracks = []
+    for number, track in enumerate(record.get('tracks') or [], 1):
+        track_title = str(track.get('title') or '').strip()
+        try:
+            length = int(track.get('length'))
+        except (TypeError, ValueError):
+            length = None
+        try:
+            position = int(track['position']) if track.get('position') not in (None, '') else number
+        except (TypeError, ValueError):
+            position = None
+        if not track_title or len(track_title) > 512 or length is None or length < 10 or position is None or position < 0:
+            errors.append(f"track {number} needs a title, a length of at least 10 seconds and a whole number position")
+            continue
+        tracks.append((position, track_title, length))
+
+    if errors:
+        raise ValueError('; '.join(errors))
+    values = {
+        'title': title,
+        'description': str(record.get('description') or ''),
+        'artist': artist,
+        'price': price,
+        'format': album_format,
+        'release_date': release_date,
+    }
+    # Without a cover of its own, a new album gets the default one and an
+    # existing album keeps the one it has
+    if record.get('cover_image'):
+        values['cover_image'] = record['cover_image']
+    return slug, values, tracks
+
+
+class CatalogImporter:
+    """
+    Upserts album records by slug in chunks. Songs are matched on
+    (title, length) and only created when no such song exists; an album's
+    tracklist is replaced by the tracks in its record.
+    """
+
+    def __init__(self):
+        self.albums_created = self.albums_updated = self.songs_created = self.tracks = 0
+
+    def import_chunk(self, records):
+        """
+        Writes a chunk of (line number, record) pairs in one transaction and
+        returns [(line number, slug or title, error), ...] for the records
+        that were skipped.
+        """
+        errors, albums = [], {}
+        for line_number, record in records:
+            try:
+                slug, values, tracks = clean_record(record)
+            except ValueError as error:
+                errors.append((line_number, record.get('slug') or record.get('title') or '', str(error)))
+                continue
+            # A later record for the same album wins
+            albums.pop(slug, None)
+            albums[slug] = (line_number, values, tracks)
+        errors += self.check_titles(albums)
+        if not albums:
+            return errors
+
+        with transaction.atomic():
+            song_ids, songs_created = resolve_songs({(title, length) for _, _, tracks in albums.values()
+                                                     for _, title, length in tracks})
+            # The id and stored cover of each album already there
+            existing = {slug: (pk, cover) for slug, pk, cover in
+                        Album.objects.filter(slug__in=albums).values_list('slug', 'id', 'cover_image')}
+            now = timezone.now()
+            artists = Artist.objects.for_names(values['artist'] for _, values, _ in albums.values())
+            instances = [Album(slug=slug, updated_at=now, **dict(values, artist=artists[values['artist']]))
+                         for slug, (_, values, _) in albums.items()]
+            # One INSERT ... ON CONFLICT (slug) DO UPDATE for new and existing
+            # albums alike, which also returns every album's id; a second
+            # one for the records without a cover, which leaves it as it is
+            given_cover = {slug for slug, (_, values, _) in albums.items() if 'cover_image' in values}
+            for group, fields in [
+                    ([album for album in instances if album.slug in given_cover], ALBUM_UPDATE_FIELDS),
+                    ([album for album in instances if album.slug not in given_cover],
+                     [field for field in ALBUM_UPDATE_FIELDS if field != 'cover_image'])]:
+                if group:
+                    Album.objects.bulk_create(group, batch_size=BATCH_SIZE, update_conflicts=True,
+                                              unique_fields=['slug'], update_fields=fields)
+            updated = [pk for pk, _ in existing.values()]
+            if updated:
+                # The albums are touched below, not once per replaced row
+                AlbumTracklistItem.objects.filter(album_id__in=updated).delete(touch_albums=False)
+
+            items = []
+            for album in instances:
+                seen = set()
+                for position, title, length in albums[album.slug][2]:
+                    song_id = song_ids[(title, length)]
+                    if song_id not in seen:
+                        seen.add(song_id)
+                        items.append((album.id, song_id, position))
+            bulk.insert_rows(AlbumTracklistItem, ['album', 'song', 'position'], items, BATCH_SIZE)
+
+            # Bulk writes skip the signals that keep these up to date
+            CollectionVersion.objects.bump(*TRACKLIST_MODELS)
+            search.index_albums(instances)
+            documents.schedule(album.pk for album in instances)
+            album_cache.invalidate(*updated)
+            self.covers_changed([album for album in instances if album.slug in given_cover or album.slug not in existing],
+                                {slug: cover for slug, (_, cover) in existing.items()})
+
+        self.songs_created += songs_created
+        self.albums_created += len(instances) - len(updated)
+        self.albums_updated += len(updated)
+        self.tracks += len(items)
+        return errors
+
+    def covers_changed(self, instances, stored_covers):
+        # What Album.save() does for a new cover, which the upsert skips:
+        # the replaced covers are released and resized copies of the new
+        # ones queued. `instances` are the albums whose cover was written.
+        changed = [album for album in instances if album.cover_image.name != stored_covers.get(album.slug)]
+        covers.release(stored_covers[album.slug] for album in changed if album.slug in stored_covers)
+        names = {covers.cover_source(album) for album in changed if not covers.has_derivatives(album)}
+        for name in sorted(names - {None}):
+            jobs.enqueue('generate_cover_derivatives', name=name)
+
+    def check_titles(self, albums):
+        # Titles are unique, so a record must not take the title of a
+        # different album (one with another format, and so another slug)
+        errors = []
+        taken = dict(Album.objects.filter(title__in=[values['title'] for _, values, _ in albums.values()])
+                     .values_list('title', 'slug'))
+        for slug, (line_number, values, _) in list(albums.items()):
+            owner = taken.setdefault(values['title'], slug)
+            if owner != slug:
+                del albums[slug]
+                errors.append((line_number, slug, f"title {values['title']!r} is already used by {owner}"))
+        return errors
+
+
+def resolve_songs(keys):
+    """
+    Maps each (title, length) in `keys` to a song id, creating (and
+    indexing) the songs that do not exist yet. Returns the mapping and the
+    number of songs created.
+    """
+    song_ids = find_songs(keys)
+    missing = [key for key in keys if key not in song_ids]
+    if missing:
+        updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        bulk.insert_rows(Song, ['title', 'length', 'updated_at'],
+                         [(title, length, updated_at) for title, length in missing], BATCH_SIZE)
+        song_ids = find_songs(keys)
+        CollectionVersion.objects.bump(Song)
+        search.add_songs((song_ids[key], key[0]) for key in missing)
+    return song_ids, len(missing)
+
+
+def find_songs(keys):
+    # Exact (title, length) matches in batches. Joining a VALUES list lets
+    # the (title, length) index answer each lookup, where an IN (row values)
+    # filter would scan the table.
+    song_ids = {}
+    table = connection.ops.quote_name(Song._meta.db_table)
+    with connection.cursor() as cursor:
+        for batch in bulk.batches(keys, BATCH_SIZE):
+            pairs = ', '.join(['(%s, %s)'] * len(batch))
+            cursor.execute(
+                f'WITH wanted (title, length) AS (VALUES {pairs}) '
+                f'SELECT song.id, song.title, song.length FROM wanted '
+                f'JOIN {table} song ON song.title = wanted.title AND song.length = wanted.length',
+                [value for key in batch for value in key])
+            # Where duplicates already exist, the oldest song is used
+            for song_id, title, length in cursor.fetchall():
+                if song_id < song_ids.get((title, length), song_id + 1):
+                    song_ids[(title, length)] = song_id
+    return song_ids
@@ -0,0 +1,369 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+# Timings of the request being handled, or None outside requests. Async
+# views run their queries in other threads, which get a copy of the context
+# and so the same RequestStats.
+_current = ContextVar('request_stats', default=None)
+
+KINDS = ('db', 'serializer', 'template')
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = dict.fromkeys(KINDS, 0.0)
+        # Nested timings (a serializer inside a serializer, a template
+        # rendering another) are only counted at the outermost level
+        self.depth = dict.fromkeys(KINDS, 0)
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.seconds["db"] * 1000:.1f};desc="{self.queries} queries"']
+        metrics += [f'{kind};dur={self.seconds[kind] * 1000:.1f}' for kind in ('serializer', 'template')]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(kind):
+    # Adds the time spent in the block to the current request's `kind`
+    stats = _current.get()
+    if stats is None or stats.depth[kind]:
+        yield
+        return
+    stats.depth[kind] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.depth[kind] -= 1
+        stats.seconds[kind] += time.perf_counter() - started
+
+
+def record_query(execute, sql, params, many, context):
+    # Execute wrapper installed on every connection, see install()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds['db'] += elapsed
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            SLOW_QUERIES.increment()
+            logger.warning("Slow query (%.1f ms) from %s: %s", elapsed * 1000, call_site(), sql)
+
+
+def install(sender, connection, **kwargs):
+    # connection_created handler. The wrapper list outlives reconnections,
+    # so it is only added once per connection object.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def call_site():
+    # The innermost frame in the project's own code that led to the query
+    root = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if (frame.filename.startswith(root) and 'site-packages' not in frame.filename
+                and frame.filename != __file__):
+            return f'{os.path.relpath(frame.filename, root)}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+class TimedSerializerMixin:
+    """
+    Counts the time spent turning instances into data towards the request's
+    serializer timing, including any queries that triggers.
+    """
+
+    def to_representation(self, instance):
+        with timed('serializer'):
+            return super().to_representation(instance)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every render for the request."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+# Metrics are shared by the processes of a multi-process server (gunicorn
+# or uvicorn workers, run_worker): each process adds to its own file in
+# settings.METRICS_DIR and /metrics/ reports the sum over every file, so a
+# scrape answered by any worker sees the totals of all of them. Files of
+# processes that exited keep counting towards the totals, as their counts
+# happened; the directory can be emptied when the server is restarted.
+# Without METRICS_DIR each process reports only its own metrics.
+
+class LocalValues:
+    """Metric values of this process alone, in memory."""
+
+    def __init__(self):
+        self.values = {}
+
+    def add(self, key, amount):
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def items(self):
+        return list(self.values.items())
+
+
+class FileValues:
+    """
+    Metric values of this process in a memory-mapped file that other
+    processes read, laid out like prometheus_client's multiprocess files:
+    the number of bytes used, then entries of a key (length, UTF-8 bytes,
+    padding to 8 bytes) followed by its value as a double. Adding to a key
+    writes its value in place; a new key is written before the used count
+    that makes it visible.
+    """
+    HEADER = 8
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path):
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < self.INITIAL_SIZE:
+            self.file.truncate(self.INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.positions = {}
+        self.used = struct.unpack_from('<i', self.map, 0)[0] or self.HEADER
+        for key, _, position in self.entries(self.map, self.used):
+            self.positions[key] = position
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        used = struct.unpack_from('<i', data, 0)[0] if len(data) >= cls.HEADER else 0
+        return [(key, value) for key, value, _ in cls.entries(data, used)]
+
+    @classmethod
+    def entries(cls, data, used):
+        # (key, value, position of the value) of every entry
+        offset = cls.HEADER
+        while offset < used:
+            length = struct.unpack_from('<i', data, offset)[0]
+            key = bytes(data[offset + 4:offset + 4 + length]).decode()
+            offset += 4 + length + (-(4 + length) % 8)
+            yield key, struct.unpack_from('<d', data, offset)[0], offset
+            offset += 8
+
+    def add(self, key, amount):
+        position = self.positions.get(key)
+        if position is None:
+            position = self.append(key)
+        struct.pack_into('<d', self.map, position, struct.unpack_from('<d', self.map, position)[0] + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        padding = -(4 + len(encoded)) % 8
+        size = 4 + len(encoded) + padding + 8
+        if self.used + size > len(self.map):
+            self.map.close()
+            self.file.truncate(max(2 * os.fstat(self.file.fileno()).st_size, self.used + size))
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        struct.pack_into(f'<i{len(encoded)}s{padding}xd', self.map, self.used, len(encoded), encoded, 0.0)
+        position = self.used + size - 8
+        self.used += size
+        struct.pack_into('<i', self.map, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def items(self):
+        return [(key, struct.unpack_from('<d', self.map, position)[0]) for key, position in self.positions.items()]
+
+
+_lock = threading.Lock()
+_values, _values_owner = None, None
+
+
+def _own_values():
+    # Opened on first use in each process, as a server forks its workers
+    # after importing this module
+    global _values, _values_owner
+    owner = (os.getpid(), settings.METRICS_DIR)
+    if _values_owner != owner:
+        pid, directory = owner
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            _values = FileValues(os.path.join(directory, f'{pid}.metrics'))
+        else:
+            _values = LocalValues()
+        _values_owner = owner
+    return _values
+
+
+def add(key, amount):
+    with _lock:
+        _own_values().add(key, amount)
+
+
+def collect():
+    """The value of every metric key, summed over all processes."""
+    directory = settings.METRICS_DIR
+    with _lock:
+        own = _own_values().items()
+    if not directory:
+        return dict(own)
+    totals = {}
+    for path in glob.glob(os.path.join(directory, '*.metrics')):
+        for key, value in FileValues.read(path):
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def sample_key(name, labels=()):
+    return json.dumps([name, list(labels)])
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help_text = name, help_text
+        self.key = sample_key(name)
+
+    def increment(self, amount=1):
+        add(self.key, amount)
+
+    def total(self, values=None):
+        return (collect() if values is None else values).get(self.key, 0)
+
+    def exposition(self, values=None):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter',
+                f'{self.name} {format_value(self.total(values))}']
+
+
+class Histogram:
+    """Cumulative histograms of seconds, one per set of label values."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help_text, self.labels, self.buckets = name, help_text, labels, buckets
+
+    def observe(self, value, *label_values):
+        label_values = [str(label_value) for label_value in label_values]
+        with _lock:
+            values = _own_values()
+            for bound in self.buckets:
+                if value <= bound:
+                    values.add(sample_key(f'{self.name}_bucket', [*label_values, bound]), 1)
+            values.add(sample_key(f'{self.name}_count', label_values), 1)
+            values.add(sample_key(f'{self.name}_sum', label_values), value)
+
+    def exposition(self, values=None):
+        values = collect() if values is None else values
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        series = sorted(tuple(labels) for name, labels in map(json.loads, values) if name == f'{self.name}_count')
+        for label_values in series:
+            labels = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            count = values[sample_key(f'{self.name}_count', label_values)]
+            for bound in self.buckets:
+                bucket_count = values.get(sample_key(f'{self.name}_bucket', [*label_values, bound]), 0)
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {format_value(bucket_count)}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {format_value(count)}')
+            lines.append(f'{self.name}_sum{{{labels}}} {format_value(values[sample_key(f"{self.name}_sum", label_values)])}')
+            lines.append(f'{self.name}_count{{{labels}}} {format_value(count)}')
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to produce a response, by route.',
+                            ('method', 'route', 'status'), BUCKETS)
+DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in database queries per request, by route.',
+                       ('method', 'route'), BUCKETS)
+SLOW_QUERIES = Counter('db_slow_queries_total', 'Queries slower than SLOW_QUERY_MS.')
+ALBUM_CACHE_HITS = Counter('album_cache_hits_total', 'Album pages and documents served from the cache.')
+ALBUM_CACHE_MISSES = Counter('album_cache_misses_total', 'Album pages and documents built on a cache miss.')
+METRICS = [REQUEST_SECONDS, DB_SECONDS, SLOW_QUERIES, ALBUM_CACHE_HITS, ALBUM_CACHE_MISSES]
+
+
+def exposition():
+    values = collect()
+    return '\n'.join(line for metric in METRICS for line in metric.exposition(values)) + '\n'
+
+
+class InstrumentationMiddleware:
+    """
+    Times each request and reports where the time went in a Server-Timing
+    header (database time and query count, serializers, templates and the
+    total) and in the latency histograms served by the metrics view. Goes
+    first in MIDDLEWARE so that the total covers the other middleware.
+    Streamed responses are timed until their headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        total = time.perf_counter() - stats.started
+        response['Server-Timing'] = stats.server_timing(total)
+        # Routes, not paths, so that ids do not make a series each
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        REQUEST_SECONDS.observe(total, request.method, route, response.status_code)
+        DB_SECONDS.observe(stats.seconds['db'], request.method, route)
+        return response
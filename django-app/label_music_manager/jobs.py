@@ -0,0 +1,165 @@
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.db import models
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Background jobs are rows of the Job table, so they need no broker and are
+# written in the same transaction as the change they follow: a job for a
+# change that is rolled back never runs. `manage.py run_worker` runs them.
+# Tasks are functions registered with @task in a `tasks` module of an app,
+# called with the JSON keyword arguments they were enqueued with.
+TASKS = {}
+
+# A failed job is tried again after BACKOFF_SECONDS, doubling with each
+# attempt up to MAX_BACKOFF_SECONDS
+BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 60 * 60
+# A job running for longer is taken to have lost its worker and is queued
+# again
+TIMEOUT_SECONDS = 15 * 60
+# Due jobs one claim considers, should other workers take the first ones
+CLAIM_CANDIDATES = 10
+
+
+def task(name=None, max_attempts=5):
+    def register(function):
+        TASKS[name or function.__name__] = (function, max_attempts)
+        return function
+    return register
+
+
+def tasks():
+    # Imports the tasks modules once, registering their tasks
+    if not TASKS:
+        autodiscover_modules('tasks')
+    return TASKS
+
+
+def enqueue(name, /, delay=0, **kwargs):
+    """
+    Adds a job running the task `name` with `kwargs`, which must be JSON
+    serializable, after `delay` seconds. Workers see it once the current
+    transaction commits.
+    """
+    try:
+        _, max_attempts = tasks()[name]
+    except KeyError:
+        raise ValueError(f"Unknown task: {name}")
+    return Job.objects.create(task=name, kwargs=kwargs, max_attempts=max_attempts,
+                              run_at=timezone.now() + timedelta(seconds=delay))
+
+
+def claim(worker):
+    """
+    Takes the oldest due job for `worker` and returns it, or None if there
+    is none. The job is marked running with a compare-and-set UPDATE that
+    only succeeds while it is still queued, so each job is claimed by one
+    worker however many compete for it.
+    """
+    now = timezone.now()
+    candidates = (Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+                  .order_by('run_at', 'id').values_list('pk', flat=True)[:CLAIM_CANDIDATES])
+    for pk in candidates:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, claimed_by=worker, claimed_at=now, attempts=models.F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def backoff(attempts):
+    # Jittered, so that jobs failing together are not retried together
+    delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+    return delay * random.uniform(0.5, 1)
+
+
+def run(job):
+    """
+    Runs a claimed job. A job that raises is queued again after a backoff,
+    or marked failed once it has used up its attempts. Returns whether it
+    succeeded.
+
+    The task is not wrapped in a transaction: with IMMEDIATE transactions
+    that would hold SQLite's write lock for the whole task, e.g. while a
+    cover is resized, and web requests writing meanwhile would time out.
+    Tasks make their own writes atomic, keeping those transactions short.
+    """
+    try:
+        function, _ = tasks()[job.task]
+    except KeyError:
+        function = None
+    try:
+        if function is None:
+            raise LookupError(f"Unknown task: {job.task}")
+        function(**job.kwargs)
+    except Exception as error:
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.task, job.attempts)
+        retry = function is not None and job.attempts < job.max_attempts
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.QUEUED if retry else Job.FAILED,
+            run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)) if retry else job.run_at,
+            finished_at=None if retry else timezone.now(),
+            last_error=f"{type(error).__name__}: {error}",
+        )
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def recover(timeout=TIMEOUT_SECONDS):
+    """
+    Queues again the jobs left running for over `timeout` seconds by a
+    worker that died, or marks them failed if that was their last attempt.
+    Returns how many were found.
+    """
+    stuck = Job.objects.filter(status=Job.RUNNING, claimed_at__lt=timezone.now() - timedelta(seconds=timeout))
+    failed = stuck.filter(attempts__gte=models.F('max_attempts')).update(
+        status=Job.FAILED, finished_at=timezone.now(), last_error='Timed out')
+    return failed + stuck.update(status=Job.QUEUED, claimed_by='', claimed_at=None)
+
+
+def work(worker, burst=False, poll_interval=1.0, stopping=lambda: False, tick=lambda: None):
+    """
+    Claims and runs jobs until `stopping()` returns true or, with `burst`,
+    until no job is due. Waits `poll_interval` seconds when the queue is
+    empty, and calls `tick()` after every job or wait. Returns the number of
+    jobs run.
+    """
+    count = 0
+    while not stopping():
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+        else:
+            run(job)
+            count += 1
+        tick()
+    return count
+
+
+def stats(since):
+    """
+    Queue depth and lag: jobs due but not yet claimed, how many seconds the
+    oldest of them has waited, and the jobs running, failed, and finished
+    since `since`.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+    oldest = due.order_by('run_at', 'id').values_list('run_at', flat=True).first()
+    return {
+        'due': due.count(),
+        'lag': (now - oldest).total_seconds() if oldest else 0.0,
+        'running': Job.objects.filter(status=Job.RUNNING).count(),
+        'failed': Job.objects.filter(status=Job.FAILED, finished_at__gte=since).count(),
+        'done': Job.objects.filter(status=Job.DONE, finished_at__gte=since).count(),
+    }
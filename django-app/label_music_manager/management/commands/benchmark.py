@@ -0,0 +1,87 @@
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from label_music_manager import jobs
+from label_music_manager.benchmarks import BENCHMARKS, compare, isolated, run_benchmarks
+from label_music_manager.management.commands.seed import PRESETS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark views, serializers and ORM hot paths against seeded catalogs of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='small,medium',
+                            help=f"Comma separated seed presets to benchmark ({', '.join(PRESETS)})")
+        parser.add_argument('--only', help='Comma separated benchmark names to run')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', metavar='BASELINE',
+                            help='JSON results of an earlier run to check for regressions')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed slowdown against the baseline as a fraction (default 0.25)')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'].split(',')
+        unknown = set(sizes) - set(PRESETS)
+        if unknown:
+            raise CommandError(f"Unknown sizes: {', '.join(sorted(unknown))}")
+        names = options['only'].split(',') if options['only'] else None
+        if names and set(names) - set(BENCHMARKS):
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(set(names) - set(BENCHMARKS)))}")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+
+        # Benchmarks run against a throwaway test database and caches, never
+        # the real ones, and with DEBUG off as in production
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with isolated():
+                results = {}
+                for size in sizes:
+                    self.stdout.write(f"Seeding {size} catalog")
+                    call_command('seed', preset=size, flush=True, stdout=self.stdout)
+                    # The album documents, as a running worker would have stored them
+                    jobs.work('benchmark', burst=True)
+                    results[size] = run_benchmarks(options['repeat'], names)
+                    self.report(size, results[size])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'meta': self.meta(options), 'results': results}, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['threshold'])
+            for size, name, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f"REGRESSION {size} {name} {metric}: {before} -> {after}"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def report(self, size, results):
+        self.stdout.write(f"{'benchmark':<28}{'time ms':>12}{'queries':>10}{'peak KB':>12}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<28}{result['time_ms']:>12.2f}{result['queries']:>10}{result['peak_kb']:>12.1f}")
+
+    def meta(self, options):
+        return {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'repeat': options['repeat'],
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'platform': platform.platform(),
+        }
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from label_music_manager.benchmarks import load_test
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of running servers at increasing connection counts. Start each deployment '
+            'against the same database first, e.g. '
+            '"gunicorn MyMusicMaestro.wsgi -w 4 --threads 8 -b 127.0.0.1:8000" and '
+            '"uvicorn MyMusicMaestro.asgi:application --workers 4 --port 8001", then pass '
+            '--target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                            help='Server to load, repeat for each deployment')
+        parser.add_argument('--path', action='append',
+                            help='Path to request, repeatable (default: /api/albums/ and /api/songs/)')
+        parser.add_argument('--connections', default='10,100,500,1000',
+                            help='Comma separated numbers of concurrent connections')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per run')
+        parser.add_argument('--header', action='append', default=[], metavar='NAME:VALUE',
+                            help='Extra request header, e.g. "Cookie: sessionid=..." for the HTML pages')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            targets = dict(target.split('=', 1) for target in options['target'])
+            headers = dict((part.strip() for part in header.split(':', 1)) for header in options['header'])
+            counts = [int(count) for count in options['connections'].split(',')]
+        except ValueError:
+            raise CommandError('Expected --target NAME=URL, --header NAME:VALUE and whole numbers in --connections')
+        paths = options['path'] or ['/api/albums/', '/api/songs/']
+        self.raise_file_limit(max(counts))
+
+        results = []
+        self.stdout.write(f"{'target':<10}{'path':<24}{'connections':>12}{'req/s':>10}"
+                          f"{'p50 ms':>10}{'p99 ms':>10}{'failures':>10}")
+        for path in paths:
+            for count in counts:
+                for name, url in targets.items():
+                    try:
+                        result = load_test(url.rstrip('/') + path, count, options['duration'], headers)
+                    except ValueError as error:
+                        raise CommandError(str(error))
+                    results.append({'target': name, 'path': path, **result})
+                    self.stdout.write(f"{name:<10}{path:<24}{count:>12}{result['requests_per_s']:>10.1f}"
+                                      f"{result['p50_ms'] or 0:>10.1f}{result['p99_ms'] or 0:>10.1f}"
+                                      f"{result['failures']:>10}")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'duration': options['duration'], 'results': results}, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def raise_file_limit(self, connections):
+        # Every connection is a file descriptor; the default soft limit is
+        # often 1024
+        if resource is None:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = connections + 100
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            limit = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            if limit < wanted:
+                self.stderr.write(f"Only {limit} open files are allowed, runs with more connections will fail")
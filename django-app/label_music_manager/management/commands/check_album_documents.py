@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from label_music_manager import documents
+
+
+class Command(BaseCommand):
+    help = ('Compare the stored album documents served by the API with a fresh rendering of every album, '
+            'listing the albums whose document is missing or stale')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='Rewrite the missing and stale documents')
+
+    def handle(self, *args, **options):
+        checked, stale = documents.check(repair=options['repair'])
+        if not stale:
+            self.stdout.write(self.style.SUCCESS(f"All {checked} album documents are current"))
+            return
+        listed = ', '.join(map(str, stale[:20])) + (', ...' if len(stale) > 20 else '')
+        if options['repair']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {len(stale)} of {checked} album documents: {listed}"))
+        else:
+            raise CommandError(f"{len(stale)} of {checked} album documents are missing or stale: {listed}. "
+                               f"Run with --repair to rewrite them")
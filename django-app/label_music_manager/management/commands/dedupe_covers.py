@@ -0,0 +1,68 @@
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from label_music_manager import covers
+from label_music_manager.models import Album
+from label_music_manager.storage import content_hash, hashed_name
+
+
+class Command(BaseCommand):
+    help = ('Move album covers stored before content-addressed storage to their content-hashed names, '
+            'storing identical artwork once, and delete the files no album uses any more')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without changing it')
+
+    def handle(self, *args, **options):
+        names = list(Album.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+                     .exclude(cover_image=covers.DEFAULT_COVER)
+                     .order_by('cover_image').values_list('cover_image', flat=True).distinct())
+        renamed = merged = missing = freed = 0
+        moved_to = set()
+        for name in names:
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            with default_storage.open(name) as file:
+                target = hashed_name(name, content_hash(file))
+            if target == name:
+                continue
+            if target in moved_to or default_storage.exists(target):
+                merged += 1
+                freed += default_storage.size(name)
+            else:
+                renamed += 1
+            moved_to.add(target)
+            if not options['dry_run']:
+                self.move(name, target)
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {renamed} covers to hashed names and merged {merged} duplicates, "
+            f"freeing {freed / 1024 / 1024:.1f} MB; {missing} covers are missing"))
+
+    def move(self, name, target):
+        # The target is written first and the old file deleted last, so the
+        # albums always point at an existing file
+        source_path, target_path = default_storage.path(name), default_storage.path(target)
+        if not default_storage.exists(target):
+            try:
+                os.link(source_path, target_path)
+            except OSError:
+                shutil.copyfile(source_path, target_path)
+        with transaction.atomic():
+            albums = Album.objects.filter(cover_image=name)
+            album_ids = list(albums.values_list('pk', flat=True))
+            albums.update(cover_image=target)
+            # Rewrites the stored documents, which link to the cover
+            Album.objects.filter(pk__in=album_ids).touch()
+        source_dir, target_dir = (os.path.join(default_storage.location, covers.derivatives_dir(cover))
+                                  for cover in (name, target))
+        if os.path.isdir(source_dir) and not os.path.exists(target_dir):
+            os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+            os.replace(source_dir, target_dir)
+        covers.remove(name)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from label_music_manager import exports
+
+
+class Command(BaseCommand):
+    help = 'Export albums with their tracks, songs or tracklist items as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=exports.KINDS)
+        parser.add_argument('--format', choices=exports.FORMATS, default='ndjson')
+        parser.add_argument('--output', help='File to write to (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                            help='Rows read from the database at a time')
+
+    def handle(self, *args, **options):
+        lines = exports.export_lines(options['kind'], options['format'], options['chunk_size'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for line in lines:
+                output.write(line)
+                count += 1
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} lines to {options['output']}"))
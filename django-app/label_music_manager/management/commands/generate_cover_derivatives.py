@@ -0,0 +1,58 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from label_music_manager.covers import render_derivatives
+from label_music_manager.models import Album
+
+
+class Command(BaseCommand):
+    help = 'Generate resized JPEG and WebP copies of existing album covers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes to resize covers with (default: one per CPU)')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that already exist')
+
+    def handle(self, *args, **options):
+        names = (Album.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+                 .order_by().values_list('cover_image', flat=True).distinct())
+        jobs = [(default_storage.path(name), default_storage.location, name, options['force'])
+                for name in names if default_storage.exists(name)]
+        self.stdout.write(f"Processing {len(jobs)} covers with {options['workers']} workers")
+
+        written = failed = 0
+        changed = set()
+        if options['workers'] <= 1:
+            for job in jobs:
+                try:
+                    count = render_derivatives(*job)
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(f"{job[2]}: {error}")
+                    continue
+                written += count
+                if count:
+                    changed.add(job[2])
+        else:
+            with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+                futures = {pool.submit(render_derivatives, *job): job[2] for job in jobs}
+                for future in as_completed(futures):
+                    try:
+                        count = future.result()
+                    except OSError as error:
+                        failed += 1
+                        self.stderr.write(f"{futures[future]}: {error}")
+                        continue
+                    written += count
+                    if count:
+                        changed.add(futures[future])
+
+        # The albums' documents, cached pages and ETags link to the
+        # derivatives once they exist
+        Album.objects.filter(cover_image__in=changed).touch()
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} derivatives, {failed} covers failed"))
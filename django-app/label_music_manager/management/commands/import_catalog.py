@@ -0,0 +1,109 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from label_music_manager import exports, imports
+
+
+class Command(BaseCommand):
+    help = ('Import albums with their tracks from an NDJSON or CSV album export, updating albums with the same slug. '
+            'Cover derivatives are not generated; run generate_cover_derivatives afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=exports.FORMATS,
+                            help='File format (default: taken from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=imports.CHUNK_SIZE,
+                            help='Albums written per transaction')
+        parser.add_argument('--state', help='Progress file (default: PATH.import-state.json)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the albums recorded as imported in the progress file')
+        parser.add_argument('--errors', help='Write rejected records to this CSV file (default: standard error)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in exports.FORMATS:
+            raise CommandError('Pass --format, the file extension is neither .ndjson nor .csv')
+        self.state_path = options['state'] or f'{path}.import-state.json'
+        self.state = {'size': os.path.getsize(path), 'records': 0, 'rejected': 0}
+        if options['resume']:
+            self.load_state(path)
+
+        report = None
+        if options['errors']:
+            # A resumed run adds to the report of the interrupted one
+            append = bool(self.state['records']) and os.path.exists(options['errors'])
+            report = open(options['errors'], 'a' if append else 'w', newline='')
+            self.report_writer = csv.writer(report)
+            if not append:
+                self.report_writer.writerow(['line', 'album', 'error'])
+        try:
+            with open(path, encoding='utf-8', newline='') as source:
+                self.import_file(source, fmt, options['chunk_size'], report)
+        except ValueError as error:
+            raise CommandError(str(error))
+        finally:
+            if report:
+                report.close()
+
+        # Finished, so a later run starts from the top again
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def import_file(self, source, fmt, chunk_size, report):
+        importer = imports.CatalogImporter()
+        started = time.perf_counter()
+        rows = 0
+        records = islice(imports.read_records(source, fmt), self.state['records'], None)
+        while chunk := list(islice(records, chunk_size)):
+            valid, rejected = [], []
+            for line_number, record, error in chunk:
+                if error:
+                    rejected.append((line_number, '', error))
+                else:
+                    valid.append((line_number, record))
+                    rows += max(len(record.get('tracks') or []), 1)
+            try:
+                rejected += importer.import_chunk(valid)
+            except DatabaseError as error:
+                raise CommandError(f"Import stopped after {self.state['records']} records: {error}. "
+                                   f"Fix the problem and run again with --resume.")
+            for line_number, album, error in sorted(rejected):
+                if report:
+                    self.report_writer.writerow([line_number, album, error])
+                else:
+                    self.stderr.write(f"line {line_number} {album}: {error}")
+            self.state['records'] += len(chunk)
+            self.state['rejected'] += len(rejected)
+            self.save_state()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 0.001):.0f} rows/s): "
+            f"{importer.albums_created} albums created, {importer.albums_updated} updated, "
+            f"{importer.songs_created} songs created"))
+        if self.state['rejected']:
+            self.stdout.write(self.style.WARNING(f"{self.state['rejected']} records rejected"))
+
+    def load_state(self, path):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as state_file:
+            state = json.load(state_file)
+        if state['size'] != self.state['size']:
+            raise CommandError(f"{path} has changed since {self.state_path} was written, it cannot be resumed")
+        self.state = state
+        self.stdout.write(f"Resuming after {state['records']} records")
+
+    def save_state(self):
+        # Saved after every committed chunk, through a rename so that an
+        # interrupted write never leaves half a file
+        with open(f'{self.state_path}.tmp', 'w') as state_file:
+            json.dump(self.state, state_file)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from label_music_manager import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of albums and songs'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The search index needs SQLite with FTS5')
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} albums and songs"))
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from label_music_manager import jobs
+
+
+def work(worker, poll_interval, stop):
+    # Runs in a forked process, which must not share the parent's database
+    # connections; Django opens its own on first use. Signal handlers only
+    # set a flag, as setting the Event could deadlock on its lock.
+    terminated = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: terminated.append(True))
+    jobs.work(worker, poll_interval=poll_interval, stopping=lambda: bool(terminated) or stop.is_set())
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Run background jobs from the job queue in a pool of processes, '
+            'reporting throughput and queue lag')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='Number of processes running jobs (default: one per CPU); '
+                                 'with 1, jobs run in this process')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no job is due (default: 1)')
+        parser.add_argument('--report-interval', type=float, default=10.0,
+                            help='Seconds between throughput and lag reports (default: 10)')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is due, running in this process')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.interval = options['report_interval']
+        self.reported_at, self.since = time.monotonic(), timezone.now()
+        if options['burst'] or options['processes'] == 1:
+            self.run_inline(options)
+        else:
+            self.run_pool(options)
+
+    def run_inline(self, options):
+        stop = []
+        handler = signal.signal(signal.SIGTERM, lambda *args: stop.append(True))
+        self.stdout.write(f"Worker {self.name} running jobs in this process")
+        jobs.recover()
+        try:
+            count = jobs.work(self.name, burst=options['burst'], poll_interval=options['poll_interval'],
+                              stopping=lambda: bool(stop), tick=self.maybe_report)
+        except KeyboardInterrupt:
+            count = None
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        self.report()
+        if count is not None:
+            self.stdout.write(self.style.SUCCESS(f"Ran {count} jobs"))
+
+    def run_pool(self, options):
+        # Forked processes inherit the loaded project; connections are closed
+        # first so that none is shared with them
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop, terminated = context.Event(), []
+        signal.signal(signal.SIGTERM, lambda *args: terminated.append(True))
+        processes = [context.Process(target=work, args=(f"{self.name}-{number}", options['poll_interval'], stop))
+                     for number in range(1, options['processes'] + 1)]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Worker {self.name} running jobs in {len(processes)} processes")
+        try:
+            while not terminated and any(process.is_alive() for process in processes):
+                time.sleep(min(self.interval, 1.0))
+                if self.maybe_report():
+                    # Also where jobs of workers that died are queued again
+                    jobs.recover()
+        except KeyboardInterrupt:
+            pass
+        # Each process finishes its current job first
+        stop.set()
+        for process in processes:
+            process.join()
+        self.report()
+
+    def maybe_report(self):
+        if time.monotonic() - self.reported_at < self.interval:
+            return False
+        self.report()
+        return True
+
+    def report(self):
+        now, elapsed = timezone.now(), max(time.monotonic() - self.reported_at, 1e-9)
+        stats = jobs.stats(self.since)
+        self.stdout.write(
+            f"{stats['done'] / elapsed:.1f} jobs/s ({stats['done']} done, {stats['failed']} failed), "
+            f"{stats['due']} due, {stats['running']} running, lag {stats['lag']:.1f} s")
+        self.reported_at, self.since = time.monotonic(), now
@@ -1,9 +1,195 @@
 # Seeding carries no marks but may help you write your tests
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+
+from label_music_manager import album_cache, bulk, documents, search
+from label_music_manager.models import (Album, AlbumDocument, AlbumTracklistItem, Artist, CollectionVersion,
+                                        MusicManagerUser, Song)
+
+# Catalog sizes: (artists, albums, songs)
+PRESETS = {
+    'small': (10, 100, 1_000),
+    'medium': (100, 1_000, 10_000),
+    'large': (1_000, 10_000, 100_000),
+    'xl': (5_000, 100_000, 1_000_000),
+}
+# Seeded accounts can log in with this password
+PASSWORD = 'password'
+USERNAME_PREFIX = 'seed-'
+
+FIRST_NAMES = ['Ada', 'Billie', 'Cass', 'Dev', 'Edie', 'Finn', 'Gia', 'Hal', 'Iris', 'Jude',
+               'Kit', 'Lou', 'Mae', 'Nico', 'Otis', 'Pia', 'Quinn', 'Ray', 'Sol', 'Tove']
+LAST_NAMES = ['Archer', 'Bloom', 'Crane', 'Dune', 'Ember', 'Frost', 'Grove', 'Haze', 'Ives', 'Jett',
+              'Knox', 'Lark', 'Moss', 'North', 'Oak', 'Pike', 'Reed', 'Stone', 'Vale', 'Wren']
+WORDS = ['midnight', 'harbour', 'neon', 'echo', 'velvet', 'static', 'golden', 'river', 'paper', 'signal',
+         'winter', 'ghost', 'satellite', 'ember', 'glass', 'summer', 'wild', 'silver', 'quiet', 'storm',
+         'orbit', 'canyon', 'lantern', 'mirror', 'fever', 'coast', 'shadow', 'hollow', 'bright', 'drift']
 
 
 class Command(BaseCommand):
     help = 'Insert sample data into database for tests'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=PRESETS, default='small',
+                            help='Catalog size: ' + ', '.join(f'{name} ({albums} albums, {songs} songs)'
+                                                              for name, (_, albums, songs) in PRESETS.items()))
+        parser.add_argument('--artists', type=int, help='Number of artist accounts (overrides the preset)')
+        parser.add_argument('--albums', type=int, help='Number of albums (overrides the preset)')
+        parser.add_argument('--songs', type=int, help='Number of songs (overrides the preset)')
+        parser.add_argument('--min-tracks', type=int, default=6)
+        parser.add_argument('--max-tracks', type=int, default=16)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, the same seed gives the same catalog')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--cache-mb', type=int, default=512,
+                            help='SQLite page cache to use while loading, in MB')
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete all albums, songs and seeded accounts first')
+
     def handle(self, *args, **options):
-        print('No seeding command provided for testing')
+        artists, albums, songs = PRESETS[options['preset']]
+        self.artist_count = options['artists'] or artists
+        self.album_count = options['albums'] or albums
+        self.song_count = options['songs'] or songs
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        if not 0 < options['min_tracks'] <= options['max_tracks'] <= self.song_count:
+            raise CommandError('Track counts must satisfy 0 < --min-tracks <= --max-tracks <= --songs')
+        self.track_range = (options['min_tracks'], options['max_tracks'])
+
+        if options['flush']:
+            self.flush()
+        elif Album.objects.exists() or Song.objects.exists():
+            raise CommandError('The catalog is not empty, pass --flush to replace it')
+
+        started = time.perf_counter()
+        if connection.vendor == 'sqlite':
+            # Index inserts for a million rows thrash SQLite's default 2MB
+            # page cache; this only lasts for this connection
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA cache_size = -{options['cache_mb'] * 1024}")
+        with transaction.atomic():
+            artist_ids = self.step('artists', self.create_artists)
+            song_ids = self.step('songs', self.create_songs)
+            album_ids = self.step('albums', self.create_albums, artist_ids)
+            self.step('tracklists', self.create_tracklists, album_ids, song_ids)
+            self.reset_sequences()
+            # The raw writes send no signals to mark the collections changed
+            CollectionVersion.objects.bump(Album, Song)
+        self.step('search index', search.rebuild)
+        # Written by run_worker, which would take as long as the rest here
+        self.step('album documents queued', documents.schedule, album_ids)
+        for start in range(0, len(album_ids), self.batch_size):
+            album_cache.invalidate(*album_ids[start:start + self.batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {self.artist_count} artists, {self.album_count} albums and {self.song_count} songs "
+            f"in {time.perf_counter() - started:.1f}s"))
+
+    def step(self, name, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(f"  {name}: {time.perf_counter() - started:.1f}s")
+        return result
+
+    def flush(self):
+        # Raw deletes: the ORM would load every row to send delete signals.
+        # The search index, documents and caches are refreshed once seeding
+        # finishes.
+        with connection.cursor() as cursor:
+            for model in (AlbumDocument, AlbumTracklistItem, Album, Song):
+                cursor.execute(f'DELETE FROM {model._meta.db_table}')
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        Artist.objects.filter(albums__isnull=True, account__isnull=True).delete()
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def reset_sequences(self):
+        # Ids were assigned here, so databases with sequences need them moved on
+        statements = connection.ops.sequence_reset_sql(no_style(), [Album, Song, AlbumTracklistItem])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def create_artists(self):
+        password = make_password(PASSWORD)  # hashed once, hashing is slow on purpose
+        names = [f"{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)} {i}"
+                 for i in range(1, self.artist_count + 1)]
+        accounts = [(f'{USERNAME_PREFIX}artist-{i}', name, 'artist') for i, name in enumerate(names, 1)]
+        accounts += [(f'{USERNAME_PREFIX}editor', 'Seed Editor', 'editor'),
+                     (f'{USERNAME_PREFIX}viewer', 'Seed Viewer', 'viewer')]
+        artists = Artist.objects.for_names(names)
+        users = User.objects.bulk_create(
+            [User(username=username, password=password) for username, _, _ in accounts], batch_size=self.batch_size)
+        MusicManagerUser.objects.bulk_create(
+            [MusicManagerUser(user=user, display_name=display_name, user_type=user_type,
+                              artist=artists.get(display_name) if user_type == 'artist' else None)
+             for user, (_, display_name, user_type) in zip(users, accounts)],
+            batch_size=self.batch_size)
+        return [artists[name].id for name in names]
+
+    def create_songs(self):
+        first_id = self.next_id(Song)
+        song_ids = range(first_id, first_id + self.song_count)
+        updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        bulk.insert_rows(Song, ['id', 'title', 'length', 'updated_at'], (
+            (song_id, self.title(1, 4), self.random.randint(60, 600), updated_at) for song_id in song_ids), self.batch_size)
+        return song_ids
+
+    def create_albums(self, artist_ids):
+        first_id = self.next_id(Album)
+        album_ids = range(first_id, first_id + self.album_count)
+        formats = [code for code, _ in Album.FORMAT_CHOICES]
+        oldest = date.today() - timedelta(days=60 * 365)
+        ops = connection.ops
+        updated_at = ops.adapt_datetimefield_value(timezone.now())
+        cover_image = Album._meta.get_field('cover_image').get_default()
+
+        def albums():
+            for i, album_id in enumerate(album_ids, 1):
+                # The index keeps the unique titles unique
+                title = f"{self.title(1, 3)} {i}"
+                album_format = self.random.choice(formats)
+                yield (
+                    album_id,
+                    title,
+                    ' '.join(self.random.choices(WORDS, k=self.random.randint(0, 30))).capitalize(),
+                    self.random.choice(artist_ids),
+                    ops.adapt_decimalfield_value(Decimal(self.random.randint(99, 4999)) / 100, 5, 2),
+                    album_format,
+                    ops.adapt_datefield_value(oldest + timedelta(days=self.random.randint(0, 61 * 365))),
+                    cover_image,
+                    # Album.save normally sets this
+                    slugify(f"{title}-{album_format}"),
+                    updated_at,
+                )
+
+        bulk.insert_rows(Album, ['id', 'title', 'description', 'artist', 'price', 'format', 'release_date',
+                                 'cover_image', 'slug', 'updated_at'], albums(), self.batch_size)
+        return album_ids
+
+    def create_tracklists(self, album_ids, song_ids):
+        next_id = self.next_id(AlbumTracklistItem)
+
+        def items():
+            item_id = next_id
+            for album_id in album_ids:
+                tracks = self.random.sample(song_ids, self.random.randint(*self.track_range))
+                for number, song_id in enumerate(tracks, 1):
+                    yield item_id, album_id, song_id, number * AlbumTracklistItem.GAP
+                    item_id += 1
+
+        bulk.insert_rows(AlbumTracklistItem, ['id', 'album', 'song', 'position'], items(), self.batch_size)
+
+    def title(self, shortest, longest):
+        return ' '.join(self.random.choices(WORDS, k=self.random.randint(shortest, longest))).title()
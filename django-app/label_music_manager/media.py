@@ -0,0 +1,152 @@
+import mimetypes
+import os
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from .storage import is_content_hashed
+
+# How uploaded files leave the server, set with MEDIA_DELIVERY:
+#   sendfile          the application server sends the file. WSGI servers
+#                     with wsgi.file_wrapper (gunicorn, uWSGI) use the
+#                     sendfile() system call, so the bytes never pass
+#                     through Python. Under ASGI the file is read and
+#                     sent in chunks instead, see async_views.streamed.
+#   x-accel-redirect  nginx sends it: the response names the file under
+#                     MEDIA_ACCEL_REDIRECT_PREFIX, an `internal` location
+#                     aliased to MEDIA_ROOT
+#   x-sendfile        Apache (mod_xsendfile) or lighttpd send the file
+#                     named by its absolute path
+# With either handoff the web server also answers Range requests.
+DELIVERIES = ('sendfile', 'x-accel-redirect', 'x-sendfile')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class FileRange:
+    """
+    Reads `length` bytes of `file` from `start`. Exposes the file's
+    descriptor, positioned at `start`, so that servers using sendfile()
+    send the range without copying it.
+    """
+
+    def __init__(self, file, start, length):
+        self.file, self.remaining = file, length
+        self.name = file.name
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def byte_range(header, size):
+    """
+    The (start, end) bytes, inclusive, asked for by a Range header, or None
+    to send the whole file: without the header, for several ranges (which
+    may be answered with the whole file) or when the header is malformed.
+    Raises ValueError if the range is past the end of the file.
+    """
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # The last `last` bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError
+        return max(size - int(last), 0), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if start >= size:
+        raise ValueError
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def range_applies(request, etag, last_modified):
+    # If-Range asks for the range only if the file is still the one given
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def add_headers(response, name, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = IMMUTABLE if is_content_hashed(name) else f'public, max-age={settings.MEDIA_MAX_AGE}'
+    return response
+
+
+@require_safe
+def serve(request, path):
+    """
+    Serves a file from MEDIA_ROOT, replacing django.views.static.serve.
+    Content-hashed files are cached by clients for a year, anything else
+    for MEDIA_MAX_AGE seconds. Conditional requests are answered with 304,
+    single byte ranges with 206, and the file itself is sent the way
+    MEDIA_DELIVERY says.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        info = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("No such file")
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404("No such file")
+
+    etag = quote_etag(f'{info.st_mtime_ns:x}-{info.st_size:x}')
+    last_modified = int(info.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return add_headers(not_modified, path, etag, last_modified)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    delivery = settings.MEDIA_DELIVERY
+    if delivery == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + path)
+        return add_headers(response, path, etag, last_modified)
+    if delivery == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return add_headers(response, path, etag, last_modified)
+    if delivery != 'sendfile':
+        raise ImproperlyConfigured(f"MEDIA_DELIVERY must be one of: {', '.join(DELIVERIES)}")
+
+    try:
+        requested = byte_range(request.headers.get('Range'), info.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{info.st_size}'
+        return response
+    if requested is None or not range_applies(request, etag, last_modified):
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = requested
+        response = FileResponse(FileRange(open(full_path, 'rb'), start, end - start + 1),
+                                status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{info.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return add_headers(response, path, etag, last_modified)
@@ -0,0 +1,40 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import routers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReadYourWritesMiddleware:
+    """
+    Scopes routers.PrimaryReplicaRouter's pinning to one request. Requests
+    that may write (anything but GET, HEAD and OPTIONS) read from the
+    primary from the start, as do views marked with routers.use_primary and
+    viewsets with `use_primary = True`. Other requests read from replicas
+    until they first write.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with routers.scope(pinned=request.method not in SAFE_METHODS):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with routers.scope(pinned=request.method not in SAFE_METHODS):
+            return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # DRF's as_view() keeps the viewset class on the view function
+        viewset = getattr(view_func, 'cls', None)
+        if getattr(view_func, 'use_primary', False) or getattr(viewset, 'use_primary', False):
+            routers.pin_to_primary()
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='release_date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='song',
+            name='title',
+            field=models.CharField(db_index=True, max_length=512),
+        ),
+    ]
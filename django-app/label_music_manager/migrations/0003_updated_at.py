@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0002_indexed_ordering_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
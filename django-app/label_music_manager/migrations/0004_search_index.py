@@ -0,0 +1,40 @@
+from django.db import migrations
+
+TABLE = 'label_music_manager_search'
+
+
+def create_index(apps, schema_editor):
+    # Full-text search relies on SQLite's FTS5 extension; other databases
+    # fall back to substring matching in label_music_manager.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        f"kind UNINDEXED, object_id UNINDEXED, title, artist, description, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (kind, object_id, title, artist, description) "
+        f"SELECT 'album', id, title, artist, description FROM label_music_manager_album"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (kind, object_id, title, artist, description) "
+        f"SELECT 'song', id, title, '', '' FROM label_music_manager_song"
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['title', 'length'], name='song_title_length_idx'),
+        ),
+    ]
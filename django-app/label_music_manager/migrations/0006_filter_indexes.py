@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0005_song_title_length_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist', 'id'], name='album_artist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['format', 'release_date', 'id'], name='album_format_release_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['price', 'id'], name='album_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['length', 'id'], name='song_length_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def create_artists(apps, schema_editor):
+    # One Artist per distinct Album.artist name and per artist account,
+    # then albums and accounts point at them
+    Album = apps.get_model('label_music_manager', 'Album')
+    Artist = apps.get_model('label_music_manager', 'Artist')
+    MusicManagerUser = apps.get_model('label_music_manager', 'MusicManagerUser')
+    accounts = list(MusicManagerUser.objects.filter(user_type='artist').order_by('id'))
+    names = set(Album.objects.values_list('artist', flat=True).distinct())
+    names |= {account.display_name[:64] for account in accounts}
+    Artist.objects.bulk_create([Artist(name=name) for name in names])
+    Album.objects.update(artist_ref=Subquery(Artist.objects.filter(name=OuterRef('artist')).values('pk')[:1]))
+    artist_ids = dict(Artist.objects.values_list('name', 'id'))
+    linked = set()
+    for account in accounts:
+        # Accounts sharing a display name: the oldest one gets the artist
+        artist_id = artist_ids[account.display_name[:64]]
+        if artist_id not in linked:
+            linked.add(artist_id)
+            MusicManagerUser.objects.filter(pk=account.pk).update(artist=artist_id)
+
+
+def restore_artist_names(apps, schema_editor):
+    Album = apps.get_model('label_music_manager', 'Album')
+    Artist = apps.get_model('label_music_manager', 'Artist')
+    Album.objects.update(artist=Subquery(Artist.objects.filter(pk=OuterRef('artist_ref')).values('name')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0006_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='musicmanageruser',
+            name='artist',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='account', to='label_music_manager.artist'),
+        ),
+        migrations.RemoveIndex(
+            model_name='album',
+            name='album_artist_idx',
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='artist_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='label_music_manager.artist'),
+        ),
+        migrations.RunPython(create_artists, restore_artist_names),
+        # A default only so that migrating backwards can add the column again
+        migrations.AlterField(
+            model_name='album',
+            name='artist',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.RemoveField(
+            model_name='album',
+            name='artist',
+        ),
+        migrations.RenameField(
+            model_name='album',
+            old_name='artist_ref',
+            new_name='artist',
+        ),
+        migrations.AlterField(
+            model_name='album',
+            name='artist',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='albums', to='label_music_manager.artist'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist', 'id'], name='album_artist_idx'),
+        ),
+    ]
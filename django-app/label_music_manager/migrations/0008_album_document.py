@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0007_artist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlbumDocument',
+            fields=[
+                ('album', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='label_music_manager.album')),
+                ('body', models.TextField()),
+                ('album_updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
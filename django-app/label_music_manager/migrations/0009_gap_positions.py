@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+GAP = 1024
+BATCH_SIZE = 500
+
+
+def space_positions(apps, schema_editor):
+    # Renumbers every tracklist GAP apart in its current order, tracks
+    # without a position last, a batch of albums at a time
+    Album = apps.get_model('label_music_manager', 'Album')
+    AlbumTracklistItem = apps.get_model('label_music_manager', 'AlbumTracklistItem')
+    album_ids = list(Album.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(album_ids), BATCH_SIZE):
+        items = list(AlbumTracklistItem.objects.filter(album_id__in=album_ids[start:start + BATCH_SIZE])
+                     .order_by('album', models.F('position').asc(nulls_last=True), 'id').only('album_id'))
+        number, album_id = 0, None
+        for item in items:
+            number = number + 1 if item.album_id == album_id else 1
+            album_id = item.album_id
+            item.position = GAP * number
+        AlbumTracklistItem.objects.bulk_update(items, ['position'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0008_album_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(space_positions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='albumtracklistitem',
+            name='position',
+            field=models.PositiveIntegerField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name='albumtracklistitem',
+            index=models.Index(fields=['album', 'position'], name='tracklist_position_idx'),
+        ),
+    ]
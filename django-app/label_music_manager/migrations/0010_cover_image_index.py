@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0009_gap_positions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='album',
+            name='cover_image',
+            field=models.ImageField(blank=True, db_index=True, default='covers/default.jpg', null=True, upload_to=''),
+        ),
+    ]
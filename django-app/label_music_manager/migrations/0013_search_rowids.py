@@ -0,0 +1,39 @@
+from django.db import migrations
+
+TABLE = 'label_music_manager_search'
+
+
+def key_by_rowid(apps, schema_editor):
+    # Renumbers the index rows to rowid = object id * 2 + kind (0 for
+    # albums, 1 for songs), which label_music_manager.search updates and
+    # deletes them by
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        f"kind UNINDEXED, object_id UNINDEXED, title, artist, description, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (rowid, kind, object_id, title, artist, description) "
+        f"SELECT album.id * 2, 'album', album.id, album.title, artist.name, album.description "
+        f"FROM label_music_manager_album album "
+        f"JOIN label_music_manager_artist artist ON artist.id = album.artist_id"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (rowid, kind, object_id, title, artist, description) "
+        f"SELECT id * 2 + 1, 'song', id, title, '', '' FROM label_music_manager_song"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('label_music_manager', '0012_collection_version'),
+    ]
+
+    operations = [
+        # Rows keyed by rowid are still found by kind and object id
+        migrations.RunPython(key_by_rowid, migrations.RunPython.noop),
+    ]
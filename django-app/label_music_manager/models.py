@@ -1,14 +1,104 @@
 # Write your models here
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, ExtractYear, Substr
+from django.utils import timezone
 from django.forms import ValidationError
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
 from datetime import date, timedelta
+from . import album_cache, covers
+
+class AlbumQuerySet(models.QuerySet):
+    def with_tracklist(self):
+        # Loads every album's tracklist, ordered by position, in one extra
+        # query however many albums are selected. Ordering by album first
+        # lets the (album, position) index return the rows in order.
+        return self.prefetch_related(models.Prefetch(
+            'albumtracklistitem_set',
+            queryset=AlbumTracklistItem.objects.select_related('song').order_by('album', 'position', 'id'),
+            to_attr='ordered_tracklist_items',
+        ))
+
+    def with_summary(self, description_length=100):
+        # Computes the figures shown on album cards in the same SQL query
+        # that selects the albums, instead of loading every track. The
+        # totals are correlated subqueries rather than a join with GROUP BY,
+        # which would aggregate and sort the whole table before the LIMIT
+        # of a page applied; these only run for the albums on the page.
+        tracks = AlbumTracklistItem.objects.filter(album=models.OuterRef('pk')).order_by().values('album')
+        return self.select_related('artist').annotate(
+            total_playtime=Coalesce(models.Subquery(tracks.annotate(total=models.Sum('song__length')).values('total')), 0),
+            track_count=Coalesce(models.Subquery(tracks.annotate(count=models.Count('pk')).values('count')), 0),
+            release_year=ExtractYear('release_date'),
+            description_excerpt=Substr('description', 1, description_length),
+        )
+
+    def touch(self, tracklist=False):
+        # Marks the albums as modified, e.g. after their tracklist changed,
+        # and drops everything cached for them. Songs are listed by album,
+        # so a changed `tracklist` changes the song collection too.
+        from .documents import refresh  # documents imports the models
+        album_ids = list(self.values_list('pk', flat=True))
+        if album_ids:
+            with transaction.atomic(savepoint=False):
+                Album.objects.filter(pk__in=album_ids).update(updated_at=timezone.now())
+                CollectionVersion.objects.bump(*TRACKLIST_MODELS if tracklist else [Album])
+                refresh(album_ids)
+            album_cache.invalidate(*album_ids)
+        return len(album_ids)
+
+class CollectionVersionQuerySet(models.QuerySet):
+    def bump(self, *models_):
+        # Marks every row of the models as possibly changed, usually in one
+        # UPDATE; the row is created by the first change
+        now = timezone.now()
+        labels = {model._meta.label_lower for model in models_}
+        if self.filter(model__in=labels).update(version=models.F('version') + 1, updated_at=now) < len(labels):
+            for label in labels - set(self.filter(model__in=labels).values_list('model', flat=True)):
+                self.get_or_create(model=label, defaults={'version': 1, 'updated_at': now})
+
+    def for_model(self, model):
+        return self.filter(model=model._meta.label_lower).values('version', 'updated_at')
+
+class CollectionVersion(models.Model):
+    # A counter per model, bumped whenever one of its rows is created,
+    # changed or deleted, so that API list validators read one row instead
+    # of aggregating the whole collection. Model signals, AlbumQuerySet.touch
+    # and the bulk writers bump it; a tracklist change bumps both albums and
+    # songs (TRACKLIST_MODELS), as songs are filtered by album.
+    model = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    objects = CollectionVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.model} version {self.version}"
+
+class ArtistQuerySet(models.QuerySet):
+    def for_names(self, names):
+        # Maps each name to its Artist, creating the artists that do not
+        # exist yet, in at most three queries
+        names = set(names)
+        artists = {artist.name: artist for artist in self.filter(name__in=names)}
+        if names - artists.keys():
+            self.bulk_create([Artist(name=name) for name in names - artists.keys()], ignore_conflicts=True)
+            artists = {artist.name: artist for artist in self.filter(name__in=names)}
+        return artists
+
+class Artist(models.Model):
+    name = models.CharField(max_length=64, unique=True)
+
+    objects = ArtistQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
 
 class Album(models.Model):
     title=models.CharField(max_length=512, unique=True)
     description=models.TextField(blank=True)
-    artist=models.CharField(max_length=64)
+    # Indexed together with id below
+    artist = models.ForeignKey(Artist, on_delete=models.PROTECT, related_name='albums', db_index=False)
     price = models.DecimalField(max_digits=5, decimal_places=2, validators=[
         MinValueValidator(0),
         MaxValueValidator(999.99)
@@ -19,44 +109,238 @@ class Album(models.Model):
         ('VL' ,'Vinyl'),
     ]
     format = models.CharField(max_length=2, choices=FORMAT_CHOICES)
-    release_date=models.DateField()
+    release_date=models.DateField(db_index=True)
+    # Counted by covers.release(), which deletes files no album refers to
     cover_image = models.ImageField(
-        default='covers/default.jpg',
+        default=covers.DEFAULT_COVER,
         blank = True,
-        null = True
+        null = True,
+        db_index = True,
     )
     slug = models.SlugField(
         unique = True, 
         editable = False,
     )
+    # Bumped whenever the album, its tracklist or one of its songs changes
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = AlbumQuerySet.as_manager()
+
+    class Meta:
+        # Match the API filters and the artist lookup of the album list, each
+        # followed by the column the results are paginated on
+        indexes = [
+            models.Index(fields=['artist', 'id'], name='album_artist_idx'),
+            models.Index(fields=['format', 'release_date', 'id'], name='album_format_release_idx'),
+            models.Index(fields=['price', 'id'], name='album_price_idx'),
+        ]
+
+    @property
+    def tracklist(self):
+        # Songs in tracklist order, using the prefetched items if available
+        items = getattr(self, 'ordered_tracklist_items', None)
+        if items is None:
+            items = self.albumtracklistitem_set.select_related('song').order_by('position', 'id')
+        return [item.song for item in items]
+
+    def set_tracklist(self, songs):
+        """
+        Makes the album's tracklist contain exactly `songs` (Song instances
+        or ids). Songs already on the album keep their row and position, new
+        songs are appended in the order given, GAP apart, and missing ones
+        are removed, all in one transaction with a fixed number of queries.
+        """
+        song_ids, unchecked = [], set()
+        for song in songs:
+            if isinstance(song, Song):
+                song_ids.append(song.pk)
+                continue
+            try:
+                song_ids.append(int(song))
+            except (TypeError, ValueError):
+                raise ValidationError(f"Invalid song id: {song}")
+            unchecked.add(song_ids[-1])
+        song_ids = list(dict.fromkeys(song_ids))
+        if unchecked:
+            missing = unchecked - set(Song.objects.filter(id__in=unchecked).values_list('id', flat=True))
+            if missing:
+                raise ValidationError(f"Unknown song ids: {', '.join(map(str, sorted(missing)))}")
+
+        with transaction.atomic():
+            current = dict(self.albumtracklistitem_set.values_list('song_id', 'position'))
+            removed = current.keys() - set(song_ids)
+            added = [song_id for song_id in song_ids if song_id not in current]
+            if not removed and not added:
+                return
+            if removed:
+                # The album is touched once below rather than once per row
+                self.albumtracklistitem_set.filter(song_id__in=removed).delete(touch_albums=False)
+            last_position = max((position for song_id, position in current.items() if song_id not in removed), default=0)
+            AlbumTracklistItem.objects.bulk_create([
+                AlbumTracklistItem(album=self, song_id=song_id, position=last_position + AlbumTracklistItem.GAP * number)
+                for number, song_id in enumerate(added, 1)
+            ])
+            # Bulk writes skip the model signals, so mark the album here
+            Album.objects.filter(pk=self.pk).touch(tracklist=True)
+
+    def move_track(self, song, index):
+        """
+        Moves `song` (a Song or id) to `index`, counted from 0, in the
+        album's tracklist; indexes past the end move it to the end. The row
+        takes a position between its new neighbours', so only it is written.
+        A move that leaves less than MIN_GAP there queues a
+        rebalance_tracklist job to spread the album's positions out again;
+        only if the neighbours leave no room at all before the job has run
+        are they spread out here first.
+        """
+        from .jobs import enqueue  # jobs imports the models
+        song_id = song.pk if isinstance(song, Song) else song
+        with transaction.atomic():
+            item_id = self.albumtracklistitem_set.filter(song_id=song_id).values_list('pk', flat=True).first()
+            if item_id is None:
+                raise ValidationError(f"Song {song_id} is not on this album")
+            position, room = self.free_position(item_id, max(index, 0))
+            if position is None:
+                self.rebalance_tracklist()
+                position, room = self.free_position(item_id, max(index, 0))
+            AlbumTracklistItem.objects.filter(pk=item_id).update(position=position)
+            Album.objects.filter(pk=self.pk).touch()
+            if room < AlbumTracklistItem.MIN_GAP and not Job.objects.filter(
+                    task='rebalance_tracklist', status=Job.QUEUED, kwargs__album_id=self.pk).exists():
+                enqueue('rebalance_tracklist', album_id=self.pk)
+
+    def free_position(self, item_id, index):
+        # A position for the tracklist row `item_id` at `index` among the
+        # album's other rows and the room it leaves to its nearest
+        # neighbour, or (None, 0) if there is no room left there
+        others = (self.albumtracklistitem_set.exclude(pk=item_id)
+                  .order_by('position', 'id').values_list('position', flat=True))
+        if index == 0:
+            lower, upper = 0, next(iter(others[:1]), None)
+        else:
+            neighbours = list(others[index - 1:index + 1]) or list(others.reverse()[:1]) or [0]
+            lower, upper = neighbours[0], neighbours[1] if len(neighbours) > 1 else None
+        if upper is None:
+            position = lower + AlbumTracklistItem.GAP
+            if position > AlbumTracklistItem.MAX_POSITION:
+                return None, 0
+            return position, min(AlbumTracklistItem.GAP, AlbumTracklistItem.MAX_POSITION - position)
+        position = (lower + upper) // 2
+        if not lower < position < upper:
+            return None, 0
+        return position, min(position - lower, upper - position)
+
+    def rebalance_tracklist(self):
+        # Spreads the positions GAP apart again, keeping the order
+        items = list(self.albumtracklistitem_set.order_by('position', 'id').only('pk'))
+        for number, item in enumerate(items, 1):
+            item.position = AlbumTracklistItem.GAP * number
+        AlbumTracklistItem.objects.bulk_update(items, ['position'])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        album = super().from_db(db, field_names, values)
+        # The cover as loaded, released by save() if it is replaced
+        album.stored_cover = album.__dict__.get('cover_image')
+        return album
+
     def save(self, *args, **kwargs):
+        from .documents import refresh  # documents imports the models
+        from .jobs import enqueue  # as do jobs
         self.slug = slugify(f"{self.title}-{self.format}")
-        super().save(*args, **kwargs)
+        # The stored API document changes in the same transaction as the row
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            refresh([self.pk])
+            if 'cover_image' not in self.get_deferred_fields():
+                stored_cover, self.stored_cover = getattr(self, 'stored_cover', None), self.cover_image.name
+                if stored_cover != self.stored_cover:
+                    covers.release([stored_cover])
+                    # Resized copies of a new cover for lists and detail pages
+                    # are made by a worker, so an upload returns right away
+                    name = covers.cover_source(self)
+                    if name is not None and not covers.has_derivatives(self):
+                        enqueue('generate_cover_derivatives', name=name)
     def clean(self): 
         if self.release_date>date.today() + timedelta(days = 3*365):
             raise ValidationError("Release date cannot be more than 3 years in the future")
     def __str__(self):
         return f"{self.title} by {self.artist}"
     
+class AlbumDocument(models.Model):
+    # The album's full API representation as JSON, with cover URLs relative
+    # to the site, so the API can serve it without serializing anything.
+    # Kept current by label_music_manager.documents.
+    album = models.OneToOneField(Album, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    body = models.TextField()
+    # The album's updated_at when the document was built
+    album_updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Document of album {self.album_id}"
+
 class Song(models.Model):
-    title = models.CharField(max_length=512)
+    title = models.CharField(max_length=512, db_index=True)
     length = models.PositiveBigIntegerField(validators =  [MinValueValidator(10)])
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     albums = models.ManyToManyField(
         'Album', through = 'AlbumTracklistItem',
         related_name='songs'
     )
+    class Meta:
+        # Catalog imports match songs on title and length; the API filters
+        # and orders them by length
+        indexes = [
+            models.Index(fields=['title', 'length'], name='song_title_length_idx'),
+            models.Index(fields=['length', 'id'], name='song_length_idx'),
+        ]
+
     def __str__(self):
         return self.title
     
+class AlbumTracklistItemQuerySet(models.QuerySet):
+    def delete(self, touch_albums=True):
+        # With touch_albums=False the rows' albums are left for the caller
+        # to touch once, rather than by the post_delete handler for each row
+        self.touch_albums = touch_albums
+        return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class AlbumTracklistItem(models.Model):
+    # Positions are spaced GAP apart so that moving a track only rewrites
+    # its own row, see Album.move_track
+    GAP = 1024
+    MAX_POSITION = 2**31 - 1
+    # A move leaving less room than this to a neighbour queues a rebalance
+    MIN_GAP = GAP // 32
+
     song = models.ForeignKey(Song, on_delete = models.CASCADE)
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
-    position = models.PositiveIntegerField(null = True, blank = True)
+    # Left blank, a new row goes to the end of the tracklist
+    position = models.PositiveIntegerField(blank=True)
+
+    objects = AlbumTracklistItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('album', 'song')
+        # Tracklists are read in this order without sorting
+        indexes = [models.Index(fields=['album', 'position'], name='tracklist_position_idx')]
+
+    def save(self, *args, **kwargs):
+        if self.position is None:
+            last = AlbumTracklistItem.objects.filter(album_id=self.album_id).aggregate(last=models.Max('position'))
+            self.position = (last['last'] or 0) + self.GAP
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.song.title} in {self.album.title} (Track {self.position})"
+
+# The collections whose lists change with a tracklist, see
+# AlbumQuerySet.touch
+TRACKLIST_MODELS = (Album, Song)
     
 class MusicManagerUser(models.Model):
     USER_TYPE_CHOICES = [
@@ -68,6 +352,57 @@ class MusicManagerUser(models.Model):
     user = models.OneToOneField('auth.User', on_delete = models.CASCADE)
     display_name = models.CharField(max_length = 512)
     user_type = models.CharField(max_length = 10, choices=USER_TYPE_CHOICES)
-    
+    # The artist whose albums an artist account owns; ownership checks
+    # compare this id with Album.artist_id
+    artist = models.OneToOneField(Artist, null=True, blank=True, on_delete=models.SET_NULL, related_name='account')
+
+    def save(self, *args, **kwargs):
+        # Artist accounts start out as the artist named like the account,
+        # unless another account already has that artist
+        if self.user_type == 'artist' and self.artist_id is None:
+            name = self.display_name[:64]
+            artist = Artist.objects.for_names([name])[name]
+            if not MusicManagerUser.objects.filter(artist=artist).exists():
+                self.artist = artist
+        super().save(*args, **kwargs)
+
+    def owns(self, album_artist_id):
+        return self.user_type == 'artist' and self.artist_id is not None and self.artist_id == album_artist_id
+
     def __str__(self):
         return self.display_name
+
+class Job(models.Model):
+    # A unit of background work, run by `manage.py run_worker`; see
+    # label_music_manager.jobs
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=QUEUED)
+    # Not run before then; pushed back after each failed attempt
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        # Workers claim the queued jobs that are due, oldest first; the
+        # worker's report counts recently finished ones
+        indexes = [
+            models.Index(fields=['status', 'run_at', 'id'], name='job_due_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
@@ -0,0 +1,188 @@
+import json
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+from rest_framework.utils.urls import replace_query_param
+
+# Response envelope returned by every paginated API list endpoint:
+#
+#   {
+#       "next": "<url of the next page, or null>",
+#       "previous": "<url of the previous page, or null>",
+#       "results": [ ... ]
+#   }
+#
+# The cursor inside the next/previous URLs is opaque; clients should follow
+# the links as given rather than building cursors themselves.
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over an indexed column, so fetching page 1000 costs
+    the same as page 1. Clients may pick one of the allowed orderings with
+    ?ordering= and a page size up to API_MAX_PAGE_SIZE with ?page_size=.
+    """
+    page_size_query_param = 'page_size'
+    ordering_param = 'ordering'
+    # Maps the public ?ordering= values to the ORM ordering used. Every
+    # ordering ends in the primary key; the cursor holds the values of all
+    # its columns, so rows sharing a value are told apart by id rather
+    # than by an offset.
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+    }
+    default_ordering = 'id'
+
+    def __init__(self):
+        self.page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param, self.default_ordering)
+        if ordering not in self.orderings:
+            raise ValidationError({
+                self.ordering_param: f"Unsupported ordering. Choose from: {', '.join(self.orderings)}."
+            })
+        return self.orderings[ordering]
+
+    # DRF's paginate_queryset split around its one query, so that async
+    # views can run that query with the async ORM: page_query() returns
+    # the query for the page and set_page() takes its results.
+
+    def paginate_queryset(self, queryset, request, view=None):
+        query = self.page_query(queryset, request, view)
+        return None if query is None else self.set_page(list(query))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        query = self.page_query(queryset, request, view)
+        return None if query is None else self.set_page([row async for row in query])
+
+    def page_query(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.ordering_fields = [queryset.model._meta.get_field(order.lstrip('-')) for order in self.ordering]
+        self.cursor = self.decode_cursor(request)
+        _, reverse, current_position = self.cursor or (0, False, None)
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            queryset = queryset.filter(self.after_position(current_position, reverse))
+        # One row more than the page tells whether another page follows
+        return queryset[:self.page_size + 1]
+
+    def after_position(self, position, reverse):
+        """
+        Rows past `position` in the direction being read, as the row-value
+        comparison (a, b, id) > (x, y, z) spelled out:
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z).
+        The bound on the first column alone lets the index seek to it.
+        """
+        lookups = []
+        for order in self.ordering:
+            # (cursor reversed) XOR (column descending)
+            lookups.append((order.lstrip('-'), 'lt' if reverse != order.startswith('-') else 'gt'))
+        condition, equal = Q(), {}
+        for (field, direction), value in zip(lookups, position):
+            condition |= Q(**equal, **{f'{field}__{direction}': value})
+            equal[field] = value
+        field, direction = lookups[0]
+        return Q(**{f'{field}__{direction}e': position[0]}) & condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [order.lstrip('-') for order in ordering]
+        if isinstance(instance, dict):
+            return tuple(str(instance[field]) for field in fields)
+        return tuple(str(getattr(instance, field)) for field in fields)
+
+    # Positions are unique, so cursors never carry an offset
+
+    def encode_cursor(self, cursor):
+        tokens = {}
+        if cursor.reverse:
+            tokens['r'] = '1'
+        if cursor.position is not None:
+            tokens['p'] = json.dumps(cursor.position)
+        encoded = b64encode(parse.urlencode(tokens).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens.get('p', [None])[0]
+            if position is not None:
+                position = tuple(json.loads(position))
+                if len(position) != len(self.ordering) or not all(isinstance(value, str) for value in position):
+                    raise ValueError(position)
+                # Values the columns could hold, so the query cannot fail
+                position = tuple(self.column_value(field, value) for field, value in zip(self.ordering_fields, position))
+        except (TypeError, ValueError, UnicodeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    @staticmethod
+    def column_value(field, value):
+        value = field.to_python(value)
+        field.run_validators(value)
+        return value
+
+    def set_page(self, results):
+        _, reverse, current_position = self.cursor or (0, False, None)
+        self.page = results[:self.page_size]
+        has_following_position = len(results) > len(self.page)
+        following_position = (self._get_position_from_instance(results[-1], self.ordering)
+                              if has_following_position else None)
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class AlbumPagination(KeysetPagination):
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'release_date': ('release_date', 'id'),
+        '-release_date': ('-release_date', '-id'),
+        'title': ('title', 'id'),
+        '-title': ('-title', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+
+
+class SongPagination(KeysetPagination):
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'title': ('title', 'id'),
+        '-title': ('-title', '-id'),
+        'length': ('length', 'id'),
+        '-length': ('-length', '-id'),
+    }
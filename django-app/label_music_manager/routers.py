@@ -0,0 +1,103 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Set once something in the current request (or task) has to read from the
+# primary: it has written, or its view was pinned. Reads then stay on the
+# primary so they see the writes that the replicas may not have yet.
+_pinned = ContextVar('use_primary', default=False)
+# The replica the current request (or task) reads from, picked on its first
+# read. Every read of a request sees the same replica, so rows loaded by
+# different queries (an album and its prefetched tracklist) agree with each
+# other however far the replicas lag.
+_replica = ContextVar('replica', default=None)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+@contextmanager
+def scope(pinned=False):
+    # Pinning and the replica picked inside the block end with it
+    token, replica_token = _pinned.set(pinned), _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(replica_token)
+        _pinned.reset(token)
+
+
+def primary():
+    # Reads inside the block go to the primary
+    return scope(pinned=True)
+
+
+def use_primary(view):
+    """
+    Marks a view as reading from the primary, e.g. a form that is about to
+    be saved over the row it shows. For viewsets, set `use_primary = True`
+    on the class instead; ReadYourWritesMiddleware checks both.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        with primary():
+            return view(*args, **kwargs)
+    wrapped.use_primary = True
+    return wrapped
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary (the default database) and reads to one of
+    the read-only aliases in settings.DATABASE_REPLICAS, the same one for
+    the whole request, or to the database a related instance was read
+    from, except when:
+
+    - the current request has written or is pinned, see is_pinned()
+    - the primary is inside a transaction, whose reads must see its writes
+    - the model belongs to one of `primary_apps`
+
+    Without replicas every query goes to the primary.
+    """
+    # Sessions are read on the request after the login that wrote them
+    primary_apps = {'sessions'}
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or is_pinned() or model._meta.app_label in self.primary_apps
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in (DEFAULT_DB_ALIAS, *replicas):
+            return instance._state.db
+        replica = _replica.get()
+        if replica not in replicas:
+            replica = random.choice(replicas)
+            _replica.set(replica)
+        return replica
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
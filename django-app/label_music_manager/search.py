@@ -0,0 +1,149 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Album, Artist, Song
+
+# FTS5 table holding one row per album and per song. The object id and kind
+# are stored unindexed; title, artist and description are searchable (songs
+# only fill in title). Created by migration 0004 on SQLite.
+#
+# A row's rowid is derived from its object, see rowid(), so that changing or
+# removing an object finds its row by rowid instead of scanning the whole
+# index for the unindexed kind and object id.
+TABLE = 'label_music_manager_search'
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+    f"kind UNINDEXED, object_id UNINDEXED, title, artist, description, "
+    f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+ALBUM, SONG = 'album', 'song'
+KINDS = (ALBUM, SONG)
+# bm25() weights for kind, object_id, title, artist, description
+WEIGHTS = (0.0, 0.0, 10.0, 5.0, 1.0)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    Turns free text into an FTS5 query matching every word as a prefix,
+    e.g. 'dark sid' -> '"dark"* "sid"*'. Quoting each word keeps FTS5
+    operators and punctuation in user input from being interpreted.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def rowid(kind, object_id):
+    return object_id * len(KINDS) + KINDS.index(kind)
+
+
+def _rowid_sql(kind, column):
+    # rowid() as an SQL expression over `column`
+    return f'{column} * {len(KINDS)} + {KINDS.index(kind)}'
+
+
+def _delete(cursor, kind, ids):
+    if ids:
+        placeholders = ', '.join(['%s'] * len(ids))
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid IN ({placeholders})', [rowid(kind, pk) for pk in ids])
+
+
+def index_albums(albums):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'REPLACE INTO {TABLE} (rowid, kind, object_id, title, artist, description) '
+            f'VALUES (%s, %s, %s, %s, %s, %s)',
+            [(rowid(ALBUM, album.pk), ALBUM, album.pk, album.title, album.artist.name, album.description)
+             for album in albums])
+
+
+def index_songs(songs):
+    add_songs((song.pk, song.title) for song in songs)
+
+
+def add_songs(rows):
+    # Indexes (id, title) pairs of songs, replacing their rows if indexed
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"REPLACE INTO {TABLE} (rowid, kind, object_id, title, artist, description) "
+            f"VALUES (%s, %s, %s, %s, '', '')",
+            [(rowid(SONG, song_id), SONG, song_id, title) for song_id, title in rows])
+
+
+def remove(kind, ids):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        _delete(cursor, kind, list(ids))
+
+
+def rebuild():
+    """
+    Refills the index from the album and song tables in two INSERT ... SELECT
+    statements and returns the number of rows indexed. It runs in one
+    transaction, so searches keep using the old index until the new one is
+    complete, and a failure partway leaves the old one in place.
+    """
+    if not is_available():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Recreating the table is much faster than deleting every row
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        cursor.execute(CREATE_TABLE)
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, kind, object_id, title, artist, description) '
+            f'SELECT {_rowid_sql(ALBUM, "album.id")}, %s, album.id, album.title, artist.name, album.description '
+            f'FROM {Album._meta.db_table} album '
+            f'JOIN {Artist._meta.db_table} artist ON artist.id = album.artist_id', [ALBUM])
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, kind, object_id, title, artist, description) "
+            f"SELECT {_rowid_sql(SONG, 'id')}, %s, id, title, '', '' FROM {Song._meta.db_table}", [SONG])
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
+
+
+def search(query, kinds=(ALBUM, SONG), limit=20):
+    """
+    Returns [(kind, object_id, score), ...] best match first. Scores are
+    bm25 ranks, so lower is better.
+    """
+    expression = match_expression(query)
+    if not expression or not kinds:
+        return []
+    if not is_available():
+        return _search_without_index(query, kinds, limit)
+    kind_placeholders = ', '.join(['%s'] * len(kinds))
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT kind, object_id, bm25({TABLE}, {weights}) AS score FROM {TABLE} '
+            f'WHERE {TABLE} MATCH %s AND kind IN ({kind_placeholders}) ORDER BY score LIMIT %s',
+            [expression, *kinds, limit])
+        return [(kind, int(object_id), score) for kind, object_id, score in cursor.fetchall()]
+
+
+def _search_without_index(query, kinds, limit):
+    # Unranked substring search for databases without FTS5
+    results = []
+    words = re.findall(r'\w+', query)
+    if ALBUM in kinds:
+        albums = Album.objects.all()
+        for word in words:
+            albums = albums.filter(Q(title__icontains=word) | Q(artist__name__icontains=word) | Q(description__icontains=word))
+        results += [(ALBUM, pk, 0.0) for pk in albums.values_list('pk', flat=True)[:limit]]
+    if SONG in kinds:
+        songs = Song.objects.all()
+        for word in words:
+            songs = songs.filter(title__icontains=word)
+        results += [(SONG, pk, 0.0) for pk in songs.values_list('pk', flat=True)[:limit]]
+    return results[:limit]
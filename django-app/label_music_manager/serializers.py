@@ -1,19 +1,240 @@
+from datetime import date, timedelta
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
 from rest_framework import serializers
-from .models import Album, Song, AlbumTracklistItem
+from . import album_cache, covers, documents, imports, search
+from .instrumentation import TimedSerializerMixin
+from .models import TRACKLIST_MODELS, Album, Artist, CollectionVersion, Song, AlbumTracklistItem
 
-class SongSerializer(serializers.ModelSerializer):
+class CoverUrlsField(serializers.SerializerMethodField):
+    """
+    JPEG and WebP URLs of the cover derivative suited to where the
+    representation is shown, e.g. {"jpeg": "...", "webp": "..."}.
+    """
+    def __init__(self, size, **kwargs):
+        self.size = size
+        super().__init__(**kwargs)
+
+    def to_representation(self, album):
+        if not album.cover_image:
+            return None
+        request = self.context.get('request')
+        # A dict passed as context['cover_urls'] keeps the URLs looked up for
+        # each cover file, for the albums sharing it
+        looked_up = self.context.get('cover_urls', {})
+        key = (album.cover_image.name, self.size)
+        if key not in looked_up:
+            looked_up[key] = {fmt: covers.cover_url(album, self.size, fmt) for fmt in covers.COVER_FORMATS}
+        return {fmt: request.build_absolute_uri(url) if request else url for fmt, url in looked_up[key].items()}
+
+class ArtistNameField(serializers.CharField):
+    # Albums show and take their artist by name; saving a new name creates
+    # the artist (see AlbumSerializer.save)
+    def __init__(self, **kwargs):
+        super().__init__(max_length=64, **kwargs)
+
+    def to_representation(self, artist):
+        return artist.name
+
+class SongSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Song
         fields = ['id', 'title', 'length']
 
-class AlbumSerializer(serializers.ModelSerializer):
-    tracks = SongSerializer(source='songs', many=True, read_only=True) 
+class AlbumSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    artist = ArtistNameField()
+    tracks = SongSerializer(source='tracklist', many=True, read_only=True)
+    total_playtime = serializers.SerializerMethodField()
+    cover_urls = CoverUrlsField('detail')
 
     class Meta:
         model = Album
-        fields = ['id', 'title', 'description', 'artist', 'price', 'format', 'release_date', 'cover_image', 'slug', 'tracks']
+        fields = ['id', 'title', 'description', 'artist', 'price', 'format', 'release_date', 'cover_image', 'cover_urls', 'slug', 'tracks', 'total_playtime']
 
-class AlbumTracklistItemSerializer(serializers.ModelSerializer):
+    def get_total_playtime(self, album):
+        return sum(song.length for song in album.tracklist)
+
+    def save(self, **kwargs):
+        if 'artist' in self.validated_data:
+            name = self.validated_data['artist']
+            kwargs['artist'] = Artist.objects.for_names([name])[name]
+        return super().save(**kwargs)
+
+class AlbumSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Read-only card representation, expects Album.objects.with_summary()
+    description = serializers.CharField(source='description_excerpt', read_only=True)
+    artist = ArtistNameField(read_only=True)
+    release_year = serializers.IntegerField(read_only=True)
+    total_playtime = serializers.IntegerField(read_only=True)
+    track_count = serializers.IntegerField(read_only=True)
+    cover_urls = CoverUrlsField('card')
+
+    class Meta:
+        model = Album
+        fields = ['id', 'title', 'description', 'artist', 'price', 'format', 'release_date', 'release_year', 'cover_image', 'cover_urls', 'slug', 'total_playtime', 'track_count']
+        read_only_fields = fields
+
+class AlbumTracklistItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta: 
         model = AlbumTracklistItem
-        fields = ['id', 'position', 'song', 'album']
\ No newline at end of file
+        fields = ['id', 'position', 'song', 'album']
+
+
+class TrackMoveSerializer(serializers.Serializer):
+    # Body of POST /api/albums/<id>/move-track/
+    song = serializers.IntegerField()
+    index = serializers.IntegerField(min_value=0, help_text="New place in the tracklist, counted from 0")
+
+
+BATCH_ALBUM_FIELDS = ['title', 'description', 'artist', 'price', 'format', 'release_date']
+
+class BatchTrackSerializer(serializers.Serializer):
+    # A track refers to an existing song by id, or to a song by title and
+    # length, which is created if no such song exists
+    song = serializers.IntegerField(required=False)
+    title = serializers.CharField(max_length=512, required=False)
+    length = serializers.IntegerField(min_value=10, required=False)
+
+    def validate(self, attrs):
+        if 'song' not in attrs and not ('title' in attrs and 'length' in attrs):
+            raise serializers.ValidationError("Give either a song id or a title and length.")
+        return attrs
+
+class AlbumBatchSerializer(serializers.ListSerializer):
+    """
+    Creates and updates many albums with their tracklists at once. The
+    batch is checked against itself and the database with a fixed number
+    of queries, and written with bulk queries in one transaction.
+    Validation errors are reported as one dict per item.
+    """
+
+    def run_child_validation(self, data):
+        # Keeps each item's validated data, None for invalid items, so the
+        # batch checks can run on the valid items of a failed batch too
+        try:
+            item = super().run_child_validation(data)
+        except serializers.ValidationError:
+            self.checked.append(None)
+            raise
+        self.checked.append(item)
+        return item
+
+    def to_internal_value(self, data):
+        self.checked = []
+        try:
+            items = super().to_internal_value(data)
+            errors = [{} for _ in items]
+        except serializers.ValidationError as exc:
+            errors = self.item_errors(exc.detail, len(data))
+            if errors is None:
+                raise
+            items = None
+        for item_errors, batch_errors in zip(errors, self.batch_errors(self.checked)):
+            for field, messages in batch_errors.items():
+                item_errors[field] = item_errors.get(field, []) + messages
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def item_errors(self, detail, count):
+        # ListSerializer reports item errors as a list with one dict per
+        # item, or from DRF 3.18 (LIST_SERIALIZER_ERRORS_AS_DICT) as a dict
+        # keyed by the index of each invalid item. None for errors about
+        # the whole batch, e.g. its length.
+        if isinstance(detail, list):
+            return [dict(item_errors) for item_errors in detail]
+        if detail and all(isinstance(index, int) for index in detail):
+            return [dict(detail.get(index, {})) for index in range(count)]
+        return None
+
+    def batch_errors(self, checked):
+        # Uniqueness and references that single items cannot check alone
+        errors = [{} for _ in checked]
+        items = [(index, item) for index, item in enumerate(checked) if item is not None]
+        self.existing = Album.objects.in_bulk([item['id'] for _, item in items if 'id' in item])
+        titles = dict(Album.objects.filter(title__in=[item['title'] for _, item in items]).values_list('title', 'id'))
+        slugs = dict(Album.objects.filter(slug__in=[self.slug(item) for _, item in items]).values_list('slug', 'id'))
+        song_ids = {track['song'] for _, item in items for track in item.get('tracks', []) if 'song' in track}
+        unknown_songs = song_ids - set(Song.objects.filter(id__in=song_ids).values_list('id', flat=True))
+
+        seen = {'id': {}, 'title': {}, 'slug': {}}
+        for index, item in items:
+            error = errors[index]
+            if 'id' in item:
+                if item['id'] not in self.existing:
+                    error.setdefault('id', []).append(f"No album with id {item['id']}.")
+                elif seen['id'].setdefault(item['id'], index) != index:
+                    error.setdefault('id', []).append("The album appears more than once in the batch.")
+            for field, taken, value in [('title', titles, item['title']), ('slug', slugs, self.slug(item))]:
+                # Unique within the batch and against the albums outside it
+                if seen[field].setdefault(value, index) != index or taken.get(value, item.get('id')) != item.get('id'):
+                    error.setdefault('title', []).append(f"An album with this {field} already exists.")
+            missing = sorted({track['song'] for track in item.get('tracks', []) if track.get('song') in unknown_songs})
+            if missing:
+                error.setdefault('tracks', []).append(f"Unknown song ids: {', '.join(map(str, missing))}.")
+        return errors
+
+    def slug(self, item):
+        return slugify(f"{item['title']}-{item['format']}")
+
+    def create(self, validated_data):
+        # Returns the albums in item order
+        now = timezone.now()
+        albums, tracklists = [], {}
+        artists = Artist.objects.for_names(item['artist'] for item in validated_data)
+        for index, item in enumerate(validated_data):
+            item = dict(item, artist=artists[item['artist']])
+            tracks = item.pop('tracks', None)
+            album = self.existing[item.pop('id')] if 'id' in item else Album()
+            for field, value in item.items():
+                setattr(album, field, value)
+            album.slug, album.updated_at = self.slug(item), now
+            albums.append(album)
+            if tracks is not None:
+                tracklists[index] = tracks
+
+        with transaction.atomic():
+            song_ids, _ = imports.resolve_songs({(track['title'], track['length'])
+                                                 for tracks in tracklists.values()
+                                                 for track in tracks if 'song' not in track})
+            updated = [album for album in albums if album.pk is not None]
+            Album.objects.bulk_create([album for album in albums if album.pk is None])
+            Album.objects.bulk_update(updated, BATCH_ALBUM_FIELDS + ['slug', 'updated_at'])
+            replaced = [albums[index].pk for index in tracklists if albums[index] in updated]
+            if replaced:
+                # The album rows were already marked as changed
+                AlbumTracklistItem.objects.filter(album_id__in=replaced).delete(touch_albums=False)
+            items = []
+            for index, tracks in tracklists.items():
+                album_songs = [track['song'] if 'song' in track else song_ids[(track['title'], track['length'])]
+                               for track in tracks]
+                items += [AlbumTracklistItem(album=albums[index], song_id=song_id,
+                                             position=number * AlbumTracklistItem.GAP)
+                          for number, song_id in enumerate(dict.fromkeys(album_songs), 1)]
+            AlbumTracklistItem.objects.bulk_create(items)
+            # Bulk writes skip the signals that keep these up to date
+            CollectionVersion.objects.bump(*TRACKLIST_MODELS)
+            search.index_albums(albums)
+            documents.refresh(album.pk for album in albums)
+            album_cache.invalidate(*[album.pk for album in updated])
+        return albums
+
+class AlbumBatchItemSerializer(serializers.ModelSerializer):
+    # An item with an id replaces that album, one without creates an album.
+    # Leaving out tracks keeps an existing album's tracklist as it is.
+    id = serializers.IntegerField(required=False)
+    artist = serializers.CharField(max_length=64)
+    tracks = BatchTrackSerializer(many=True, required=False)
+
+    class Meta:
+        model = Album
+        fields = ['id'] + BATCH_ALBUM_FIELDS + ['tracks']
+        # Title uniqueness is checked once for the whole batch
+        extra_kwargs = {'title': {'validators': []}}
+        list_serializer_class = AlbumBatchSerializer
+
+    def validate_release_date(self, value):
+        if value > date.today() + timedelta(days=3 * 365):
+            raise serializers.ValidationError("Release date cannot be more than 3 years in the future")
+        return value
@@ -0,0 +1,83 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import album_cache, covers, documents, instrumentation, search
+from .models import Album, AlbumTracklistItem, Artist, CollectionVersion, Song
+
+# Times every query, see instrumentation.record_query
+connection_created.connect(instrumentation.install)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def album_changed(sender, instance, **kwargs):
+    album_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def collection_changed(sender, **kwargs):
+    CollectionVersion.objects.bump(sender)
+
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, **kwargs):
+    search.index_albums([instance])
+
+
+@receiver(post_delete, sender=Album)
+def album_deleted(sender, instance, **kwargs):
+    search.remove(search.ALBUM, [instance.pk])
+    # Other editions of the album may share the cover
+    covers.release([instance.cover_image.name])
+
+
+@receiver(post_save, sender=Artist)
+def artist_saved(sender, instance, created, **kwargs):
+    # Albums show their artist's name
+    if not created:
+        albums = Album.objects.filter(artist=instance).select_related('artist')
+        albums.touch()
+        search.index_albums(albums)
+
+
+@receiver(post_save, sender=AlbumTracklistItem)
+def tracklist_item_saved(sender, instance, **kwargs):
+    Album.objects.filter(pk=instance.album_id).touch(tracklist=True)
+
+
+@receiver(post_delete, sender=AlbumTracklistItem)
+def tracklist_item_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting an album or a song cascades to its tracklist rows; those are
+    # handled once by the album and song handlers rather than once per row,
+    # as are rows deleted by bulk writers that touch the albums themselves
+    if isinstance(origin, (Album, Song)) or getattr(origin, 'model', None) in (Album, Song):
+        return
+    if not getattr(origin, 'touch_albums', True):
+        return
+    Album.objects.filter(pk=instance.album_id).touch(tracklist=True)
+
+
+@receiver(post_save, sender=Song)
+def song_changed(sender, instance, created, **kwargs):
+    search.index_songs([instance])
+    # Albums embed their songs' titles and lengths
+    if not created:
+        Album.objects.filter(songs=instance).touch()
+
+
+@receiver(pre_delete, sender=Song)
+def song_deleting(sender, instance, **kwargs):
+    # Before the cascade removes the tracklist rows that link the albums
+    instance.album_ids = list(Album.objects.filter(songs=instance).values_list('pk', flat=True))
+    Album.objects.filter(pk__in=instance.album_ids).touch()
+
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    search.remove(search.SONG, [instance.pk])
+    # The documents written by touch() above still listed the song
+    documents.refresh(getattr(instance, 'album_ids', []))
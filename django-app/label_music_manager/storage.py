@@ -0,0 +1,54 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+
+# Hex digits of the content hash kept in file names
+HASH_LENGTH = 16
+# Matches the hash naming an original (covers/<hash>.jpg, or
+# covers/sleeve.<hash>.jpg as stored before de-duplication) and the
+# directory of its derivatives (covers/derived/covers/<hash>/...)
+HASHED_NAME = re.compile(rf'(?:^|[/.])[0-9a-f]{{{HASH_LENGTH}}}(?=[./]|$)')
+
+
+def content_hash(content):
+    # Uploads were hashed as they arrived, see label_music_manager.uploads
+    digest = getattr(content, 'content_hash', None)
+    if digest is None:
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+    return digest[:HASH_LENGTH]
+
+
+def hashed_name(name, digest):
+    # covers/sleeve.png -> covers/<hash>.png
+    return posixpath.join(posixpath.dirname(name), digest + os.path.splitext(name)[1].lower())
+
+
+def is_content_hashed(name):
+    # Files whose name holds their hash never change, so can be cached
+    # for good
+    return HASHED_NAME.search(name) is not None
+
+
+class ContentHashedStorage(FileSystemStorage):
+    """
+    Content-addressed media storage: each file is named after a hash of its
+    content in the directory it was uploaded to, e.g. covers/sleeve.png is
+    stored as covers/3f2a9c0d1e4b5a6f.png. A name therefore always refers to
+    the same bytes and is served as immutable (see label_music_manager.media),
+    and the same artwork uploaded for several albums is stored once: saving
+    content that is already stored returns the existing name.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,38 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import covers, documents
+from .jobs import task
+from .models import Album
+
+# Background tasks, run by `manage.py run_worker`; enqueue them with
+# jobs.enqueue('<function name>', **kwargs). Tasks run outside any
+# transaction: slow work such as image resizing must not hold the database's
+# write lock, so only the writes are made atomic.
+
+
+@task(max_attempts=3)
+def generate_cover_derivatives(name):
+    # Resized copies of a newly uploaded cover. The albums using it are then
+    # marked changed, so that their documents and cached pages link to them;
+    # touch() is atomic on its own.
+    if default_storage.exists(name) and covers.render_derivatives(
+            default_storage.path(name), default_storage.location, name):
+        Album.objects.filter(cover_image=name).touch()
+
+
+@task(max_attempts=3)
+def rebalance_tracklist(album_id):
+    # Spreads out the positions of an album whose track moves used up the
+    # gaps between them. The order is kept, so the album is not changed.
+    with transaction.atomic():
+        album = Album.objects.filter(pk=album_id).first()
+        if album is not None:
+            album.rebalance_tracklist()
+
+
+@task()
+def refresh_documents(album_ids):
+    # Rewrites the documents dropped by documents.schedule()
+    with transaction.atomic():
+        documents.refresh(Album.objects.filter(pk__in=album_ids).values_list('pk', flat=True))
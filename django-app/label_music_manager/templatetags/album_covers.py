@@ -0,0 +1,18 @@
+from django import template
+from .. import covers
+
+register = template.Library()
+
+
+@register.inclusion_tag('label_music_manager/cover_picture.html')
+def cover_picture(album, size, width=None):
+    # Renders the album cover from one of covers.COVER_SIZES, preferring
+    # WebP. `width` shrinks the displayed size, e.g. for high-DPI screens.
+    dimensions, mode = covers.COVER_SIZES[size]
+    return {
+        'album': album,
+        'jpeg_url': covers.cover_url(album, size, 'jpeg'),
+        'webp_url': covers.cover_url(album, size, 'webp'),
+        'width': width or dimensions[0],
+        'square': mode == 'fit',
+    }
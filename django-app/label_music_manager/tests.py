@@ -1,12 +1,67 @@
-from django.test import TestCase, Client
-from django.urls import reverse
+from django.test import Client, LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import resolve, reverse
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.exceptions import ValidationError  # Added import for ValidationError
 from datetime import date, timedelta
-from .models import Album, Song, AlbumTracklistItem, MusicManagerUser
+from .models import Album, AlbumDocument, Artist, CollectionVersion, Job, Song, AlbumTracklistItem, MusicManagerUser
 from .forms import AlbumForm
+from .caching import FileCache
+from . import album_cache, async_views, benchmarks, covers, documents, exports, imports, instrumentation, jobs, routers, search
+from .api_views import AlbumViewSet, SongViewSet
+from .serializers import AlbumBatchItemSerializer, AlbumSerializer
+from .storage import ContentHashedStorage
 from django.test import override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from PIL import Image
+from rest_framework.permissions import IsAuthenticated
+from asgiref.sync import async_to_sync, sync_to_async
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from base64 import b64encode
+from unittest import mock
+from urllib import parse
+
+
+def setUpModule():
+    # A cache and metrics of the tests' own, configured like the real ones
+    # but empty when they start
+    global cache_override
+    location = tempfile.mkdtemp()
+    cache_override = override_settings(CACHES={
+        'default': {**settings.CACHES['default'], 'LOCATION': location},
+        'album-generations': {**settings.CACHES['album-generations'], 'LOCATION': os.path.join(location, 'generations')},
+    }, METRICS_DIR=os.path.join(location, 'metrics'))
+    cache_override.enable()
+
+
+def tearDownModule():
+    shutil.rmtree(settings.CACHES['default']['LOCATION'], ignore_errors=True)
+    cache_override.disable()
+
+
+def artist(name):
+    return Artist.objects.for_names([name])[name]
+
 
 class ModelTests(TestCase):
     def setUp(self):
@@ -22,7 +77,7 @@ class ModelTests(TestCase):
         # Test creating a valid album
         album = Album.objects.create(
             title='Test Album',
-            artist='Test Artist',
+            artist=artist('Test Artist'),
             price=9.99,
             format='DD',
             release_date=date.today()
@@ -37,7 +92,7 @@ class ModelTests(TestCase):
         with self.assertRaises(ValidationError):
             album = Album(
                 title='Future Album',
-                artist='Test Artist',
+                artist=artist('Test Artist'),
                 price=9.99,
                 format='CD',
                 release_date=date.today() + timedelta(days=1100)
@@ -58,7 +113,7 @@ class ModelTests(TestCase):
         # Test creating an album tracklist 
         album = Album.objects.create(
             title='Test Album',
-            artist='Test Artist',
+            artist=artist('Test Artist'),
             price=9.99,
             format='DD',
             release_date=date.today()
@@ -103,7 +158,7 @@ class ViewTests(TestCase):
         # Test album creation
         self.test_album = Album.objects.create(
             title='Test Album',
-            artist='Artist Name',
+            artist=artist('Artist Name'),
             price=9.99,
             format='DD',
             release_date=date.today()
@@ -171,7 +226,7 @@ class APITests(TestCase):
         # Create an album
         self.album = Album.objects.create(
             title='API Test Album',
-            artist='Test Artist',
+            artist=artist('Test Artist'),
             price=9.99,
             format='DD',
             release_date=date.today()
@@ -232,6 +287,34 @@ class FormTests(TestCase):
         form = AlbumForm(data=form_data)
         self.assertFalse(form.is_valid())
 
+    def test_invalid_form_creates_no_artist(self):
+        form = AlbumForm(data={'title': '', 'price': 9.99, 'format': 'CD', 'release_date': date.today(),
+                               'artist': 'Brand New Artist'})
+        self.assertFalse(form.is_valid())
+        self.assertFalse(Artist.objects.filter(name='Brand New Artist').exists())
+
+    def test_artist_accounts_create_albums_of_their_own_artist(self):
+        user = User.objects.create_user(username='artist', password='12345')
+        account = MusicManagerUser.objects.create(user=user, display_name='Own Artist', user_type='artist')
+        self.client.login(username='artist', password='12345')
+        data = {'title': 'Own Album', 'price': 9.99, 'format': 'CD', 'release_date': date.today(),
+                'artist': 'Somebody Else'}
+        self.assertRedirects(self.client.post(reverse('album-create'), data=data), reverse('album-list'))
+        self.assertEqual(Album.objects.get(title='Own Album').artist_id, account.artist_id)
+        self.assertFalse(Artist.objects.filter(name='Somebody Else').exists())
+
+    def test_unlinked_artist_account_is_refused(self):
+        # The artist named like this account already belongs to another one
+        for username in ('first', 'second'):
+            user = User.objects.create_user(username=username, password='12345')
+            account = MusicManagerUser.objects.create(user=user, display_name='Same Name', user_type='artist')
+        self.assertIsNone(account.artist_id)
+        self.client.login(username='second', password='12345')
+        response = self.client.post(reverse('album-create'), data={
+            'title': 'Orphan Album', 'price': 9.99, 'format': 'CD', 'release_date': date.today()})
+        self.assertContains(response, 'not linked to an artist')
+        self.assertFalse(Album.objects.filter(title='Orphan Album').exists())
+
 
 class AdditionalTests(TestCase):
     def setUp(self):
@@ -257,7 +340,7 @@ class AdditionalTests(TestCase):
         # Test creating an album with multiple songs
         album = Album.objects.create(
             title='Multi-Song Album',
-            artist='Artist Name',
+            artist=artist('Artist Name'),
             price=12.99,
             format='VL',
             release_date=date.today()
@@ -280,7 +363,7 @@ class AdditionalTests(TestCase):
         for fmt in valid_formats:
             album = Album.objects.create(
                 title=f'Test {fmt} Album',
-                artist='Artist Name',
+                artist=artist('Artist Name'),
                 price=9.99,
                 format=fmt,
                 release_date=date.today()
@@ -291,7 +374,7 @@ class AdditionalTests(TestCase):
         # Tracklist's unique constraint testing
         album = Album.objects.create(
             title='Unique Tracks Album',
-            artist='Artist Name',
+            artist=artist('Artist Name'),
             price=9.99,
             format='CD',
             release_date=date.today()
@@ -320,7 +403,7 @@ class AdditionalTests(TestCase):
         # Test for slug
         album = Album.objects.create(
             title='Slug Test Album',
-            artist='Artist Name',
+            artist=artist('Artist Name'),
             price=9.99,
             format='DD',
             release_date=date.today()
@@ -333,7 +416,7 @@ class AdditionalTests(TestCase):
         # To create an album and add songs
         album = Album.objects.create(
             title='Song Display Album',
-            artist='Artist Name',
+            artist=artist('Artist Name'),
             price=9.99,
             format='CD',
             release_date=date.today()
@@ -346,4 +429,1818 @@ class AdditionalTests(TestCase):
         # Test to check if the songs are displayed correctly
         self.assertIn(self.song1, album.songs.all())
         self.assertIn(self.song2, album.songs.all())
-        self.assertEqual(album.songs.count(), 2)
\ No newline at end of file
+        self.assertEqual(album.songs.count(), 2)
+
+@override_settings(API_MAX_PAGE_SIZE=3)
+class PaginationTests(TestCase):
+    def setUp(self):
+        # Create enough albums and songs to span several pages
+        for i in range(5):
+            Album.objects.create(
+                title=f'Paged Album {i}',
+                artist=artist('Test Artist'),
+                price=9.99,
+                format='DD',
+                release_date=date.today() - timedelta(days=i)
+            )
+            Song.objects.create(title=f'Paged Song {i}', length=180)
+
+    def collect(self, url):
+        # Follow the next links and return every title seen
+        titles = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual(set(data), {'next', 'previous', 'results'})
+            titles += [item['title'] for item in data['results']]
+            url = data['next']
+        return titles
+
+    def test_album_pages_cover_catalog_once(self):
+        titles = self.collect('/api/albums/?page_size=2')
+        self.assertEqual(titles, [f'Paged Album {i}' for i in range(5)])
+
+    def test_album_ordering_by_release_date(self):
+        titles = self.collect('/api/albums/?page_size=2&ordering=release_date')
+        self.assertEqual(titles, [f'Paged Album {i}' for i in reversed(range(5))])
+
+    def test_previous_links_walk_back_through_ties(self):
+        # Every album shares one price, so only the id in the cursor
+        # separates the pages
+        url = '/api/albums/?page_size=2&ordering=-price'
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([item['title'] for item in data['results']])
+            url = data['next']
+        url = data['previous']
+        while url:
+            data = self.client.get(url).json()
+            self.assertEqual([item['title'] for item in data['results']], pages[-2])
+            pages.pop()
+            url = data['previous']
+        self.assertEqual(len(pages), 1)
+
+    def test_invalid_cursor_rejected(self):
+        response = self.client.get('/api/albums/?cursor=cD01')
+        self.assertEqual(response.status_code, 404)
+        # Positions that are no values of the ordering's columns
+        for ordering, position in [('price', ['x', 'y']), ('price', ['NaN', '1']), ('release_date', ['soon', '1']),
+                                   ('id', [str(2**64)])]:
+            cursor = b64encode(parse.urlencode({'p': json.dumps(position)}).encode()).decode()
+            response = self.client.get('/api/albums/', {'ordering': ordering, 'cursor': cursor})
+            self.assertEqual(response.status_code, 404, (ordering, position))
+
+    def test_page_size_is_capped(self):
+        response = self.client.get('/api/songs/?page_size=100')
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_unsupported_ordering_rejected(self):
+        response = self.client.get('/api/albums/?ordering=artist')
+        self.assertEqual(response.status_code, 400)
+
+
+class TracklistQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=self.user, display_name='Editor', user_type='editor')
+        self.songs = [Song.objects.create(title=f'Query Song {i}', length=180) for i in range(3)]
+
+    def create_albums(self, count):
+        # Each album gets the songs in reverse order so ordering is checked too
+        for i in range(count):
+            album = Album.objects.create(
+                title=f'Query Album {Album.objects.count()}',
+                artist=artist('Test Artist'),
+                price=9.99,
+                format='CD',
+                release_date=date.today()
+            )
+            for position, song in enumerate(reversed(self.songs), 1):
+                AlbumTracklistItem.objects.create(album=album, song=song, position=position)
+
+    def test_album_api_list_query_count_is_constant(self):
+        # Collection validator, and the albums with their stored documents
+        self.create_albums(2)
+        with self.assertNumQueries(2):
+            self.client.get('/api/albums/')
+        self.create_albums(8)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/albums/')
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_album_api_tracks_follow_position(self):
+        self.create_albums(1)
+        album = Album.objects.get()
+        response = self.client.get(f'/api/albums/{album.id}/')
+        titles = [track['title'] for track in response.json()['tracks']]
+        self.assertEqual(titles, ['Query Song 2', 'Query Song 1', 'Query Song 0'])
+
+    def test_album_detail_page_query_count(self):
+        self.create_albums(1)
+        album = Album.objects.get()
+        self.client.login(username='editor', password='54321')
+        # Session, user, validator, album, tracklist and the user's profile
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('album-detail', args=[album.id]))
+        self.assertContains(response, 'Query Song 2')
+
+
+class AlbumSummaryTests(TestCase):
+    def setUp(self):
+        self.album = Album.objects.create(
+            title='Summary Album',
+            description='x' * 150,
+            artist=artist('Test Artist'),
+            price=9.99,
+            format='VL',
+            release_date=date(2020, 5, 17)
+        )
+        for position, length in enumerate([120, 200, 30], 1):
+            song = Song.objects.create(title=f'Summary Song {position}', length=length)
+            AlbumTracklistItem.objects.create(album=self.album, song=song, position=position)
+        Album.objects.create(
+            title='Empty Album',
+            artist=artist('Test Artist'),
+            price=5,
+            format='DD',
+            release_date=date(2021, 1, 1)
+        )
+
+    def test_summary_list_is_single_query(self):
+        # The collection validator plus one annotated album query
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/albums/?view=summary')
+        summary, empty = response.json()['results']
+        self.assertEqual(summary['total_playtime'], 350)
+        self.assertEqual(summary['track_count'], 3)
+        self.assertEqual(summary['release_year'], 2020)
+        self.assertEqual(len(summary['description']), 100)
+        self.assertNotIn('tracks', summary)
+        self.assertEqual((empty['total_playtime'], empty['track_count']), (0, 0))
+
+    def test_summary_page_not_aggregated_over_whole_table(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite')
+        # Totals are correlated subqueries, so the page's LIMIT applies
+        # before they run instead of after grouping and sorting every album
+        sql, params = Album.objects.with_summary().order_by('id')[:20].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' | '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('CORRELATED SCALAR SUBQUERY', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_summary_detail(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/?view=summary')
+        self.assertEqual(response.json()['total_playtime'], 350)
+
+    def test_full_detail_includes_total_playtime(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/')
+        self.assertEqual(response.json()['total_playtime'], 350)
+        self.assertEqual(len(response.json()['tracks']), 3)
+
+
+class TracklistWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=self.user, display_name='Editor', user_type='editor')
+        self.songs = [Song.objects.create(title=f'Write Song {i}', length=180) for i in range(30)]
+        self.album = Album.objects.create(
+            title='Write Album',
+            artist=artist('Test Artist'),
+            price=9.99,
+            format='CD',
+            release_date=date.today()
+        )
+
+    def positions(self):
+        return list(self.album.albumtracklistitem_set.order_by('position').values_list('song_id', 'position'))
+
+    def test_query_count_does_not_grow_with_tracks(self):
+        # Id lookup, current items, the bulk insert, marking the album
+        # modified (two queries) and its collection changed, rewriting its
+        # document (three), plus the savepoint
+        with self.assertNumQueries(11):
+            self.album.set_tracklist([song.id for song in self.songs[:3]])
+        with self.assertNumQueries(11):
+            self.album.set_tracklist([song.id for song in self.songs])
+        self.assertEqual(self.album.albumtracklistitem_set.count(), 30)
+
+    def test_existing_positions_are_kept(self):
+        first, second, third, fourth = self.songs[:4]
+        self.album.set_tracklist([first, second, third])
+        item = self.album.albumtracklistitem_set.get(song=third)
+        self.album.set_tracklist([third, first, fourth])
+        gap = AlbumTracklistItem.GAP
+        self.assertEqual(self.positions(), [(first.id, gap), (third.id, 3 * gap), (fourth.id, 4 * gap)])
+        self.assertTrue(self.album.albumtracklistitem_set.filter(pk=item.pk).exists())
+
+    def test_unknown_song_rolls_back(self):
+        self.album.set_tracklist([self.songs[0]])
+        with self.assertRaises(ValidationError):
+            self.album.set_tracklist([self.songs[1].id, 999999])
+        self.assertEqual(self.positions(), [(self.songs[0].id, AlbumTracklistItem.GAP)])
+
+    def test_album_edit_keeps_positions(self):
+        self.album.set_tracklist(self.songs[:3])
+        self.client.login(username='editor', password='54321')
+        response = self.client.post(reverse('album-edit', args=[self.album.id]), data={
+            'title': 'Write Album',
+            'artist': 'Test Artist',
+            'price': 9.99,
+            'format': 'CD',
+            'release_date': date.today(),
+            'tracklist': [self.songs[0].id, self.songs[2].id, self.songs[5].id],
+        })
+        self.assertEqual(response.status_code, 302)
+        gap = AlbumTracklistItem.GAP
+        self.assertEqual(self.positions(), [(self.songs[0].id, gap), (self.songs[2].id, 3 * gap),
+                                            (self.songs[5].id, 4 * gap)])
+
+
+class TrackMoveTests(TestCase):
+    def setUp(self):
+        self.songs = [Song.objects.create(title=f'Move Song {i}', length=180) for i in range(6)]
+        self.album = Album.objects.create(title='Move Album', artist=artist('Test Artist'), price=9.99,
+                                          format='CD', release_date=date.today())
+        self.album.set_tracklist(self.songs)
+
+    def order(self):
+        return [song.id for song in Album.objects.get(pk=self.album.pk).tracklist]
+
+    def test_move_writes_one_tracklist_row(self):
+        last = self.songs[-1]
+        with CaptureQueriesContext(connection) as queries:
+            self.album.move_track(last, 0)
+        self.assertEqual(self.order(), [last.id] + [song.id for song in self.songs[:-1]])
+        writes = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "label_music_manager_albumtracklistitem"')]
+        self.assertEqual(len(writes), 1)
+        self.album.move_track(self.songs[0], 99)
+        self.assertEqual(self.order()[-1], self.songs[0].id)
+
+    def test_positions_are_rebalanced_when_the_gap_runs_out(self):
+        # Every move halves the gap between the first two tracks
+        expected = [song.id for song in self.songs]
+
+        def move(song):
+            self.album.move_track(song, 1)
+            expected.remove(song.id)
+            expected.insert(1, song.id)
+
+        for song in self.songs[2:]:
+            move(song)
+        self.assertFalse(Job.objects.exists())
+        for song in self.songs[2:]:
+            move(song)
+        # The narrowed gap queues one rebalance, run by the worker
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.kwargs), ('rebalance_tracklist', {'album_id': self.album.pk}))
+        jobs.work('test', burst=True)
+        gap = AlbumTracklistItem.GAP
+        self.assertEqual(list(self.album.albumtracklistitem_set.order_by('position').values_list('position', flat=True)),
+                         [gap * number for number in range(1, 7)])
+        self.assertEqual(self.order(), expected)
+        # Before the worker runs, a move with no room left spreads them out itself
+        for song in (self.songs[2:] * 3)[:14]:
+            move(song)
+        self.assertEqual(self.order(), expected)
+        positions = list(self.album.albumtracklistitem_set.order_by('position').values_list('position', flat=True))
+        self.assertEqual(len(set(positions)), len(positions))
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED).count(), 1)
+
+    def test_api_move(self):
+        response = self.client.post(f'/api/albums/{self.album.id}/move-track/',
+                                    {'song': self.songs[0].id, 'index': 2}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([track['song'] for track in response.json()['tracks']], self.order())
+        self.assertEqual(self.order()[2], self.songs[0].id)
+        other = Song.objects.create(title='Elsewhere', length=100)
+        response = self.client.post(f'/api/albums/{self.album.id}/move-track/', {'song': other.id, 'index': 0},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('song', response.json())
+
+    def test_edit_page_buttons(self):
+        user = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=user, display_name='Editor', user_type='editor')
+        self.client.login(username='editor', password='54321')
+        self.assertContains(self.client.get(reverse('album-edit', args=[self.album.id])), f'{self.songs[1].id}:up')
+        url = reverse('album-track-move', args=[self.album.id])
+        response = self.client.post(url, {'move': f'{self.songs[1].id}:up'})
+        self.assertRedirects(response, reverse('album-edit', args=[self.album.id]), fetch_redirect_response=False)
+        self.assertEqual(self.order()[:2], [self.songs[1].id, self.songs[0].id])
+        self.client.post(url, {'move': f'{self.songs[1].id}:down'})
+        self.assertEqual(self.order()[:2], [self.songs[0].id, self.songs[1].id])
+
+    def test_tracklists_are_read_without_sorting(self):
+        queryset = Album.objects.with_tracklist()._prefetch_related_lookups[0].queryset.filter(album_id__in=[1, 2])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queryset.query}')
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('tracklist_position_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class CoverDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_cover(self, name='cover.png', size=(1200, 900)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def create_album(self, **kwargs):
+        album = Album.objects.create(
+            title='Cover Album',
+            artist=artist('Test Artist'),
+            price=9.99,
+            format='CD',
+            release_date=date.today(),
+            **kwargs
+        )
+        # Derivatives are made by the job the upload queued
+        jobs.work('test', burst=True)
+        return album
+
+    def test_derivatives_generated_on_upload(self):
+        album = self.create_album(cover_image=self.make_cover())
+        for size, (dimensions, mode) in covers.COVER_SIZES.items():
+            for fmt in covers.COVER_FORMATS:
+                path = os.path.join(self.media_root, covers.derivative_name(album.cover_image.name, size, fmt))
+                with Image.open(path) as image:
+                    if mode == 'fit':
+                        self.assertEqual(image.size, dimensions)
+                    else:
+                        self.assertEqual(image.size, (800, 600))
+        self.assertTrue(covers.cover_url(album, 'thumb', 'webp').endswith('/thumb.webp'))
+
+    def test_cover_url_falls_back_to_original(self):
+        album = self.create_album()
+        self.assertEqual(covers.cover_url(album, 'card'), album.cover_image.url)
+
+    def test_serializers_return_context_specific_derivatives(self):
+        album = self.create_album(cover_image=self.make_cover())
+        detail = self.client.get(f'/api/albums/{album.id}/').json()
+        self.assertTrue(detail['cover_urls']['jpeg'].endswith('/detail.jpg'))
+        summary = self.client.get('/api/albums/?view=summary').json()['results'][0]
+        self.assertTrue(summary['cover_urls']['webp'].endswith('/card.webp'))
+
+    def test_backfill_command(self):
+        album = self.create_album(cover_image=self.make_cover())
+        shutil.rmtree(os.path.join(self.media_root, covers.DERIVATIVES_DIR))
+        self.assertFalse(covers.has_derivatives(album))
+        Album.objects.filter(pk=album.pk).touch()
+        url = f'/api/albums/{album.id}/'
+        before = self.client.get(url)
+        self.assertFalse(before.json()['cover_urls']['jpeg'].endswith('/detail.jpg'))
+        call_command('generate_cover_derivatives', workers=1, stdout=io.StringIO())
+        self.assertTrue(covers.has_derivatives(album))
+        after = self.client.get(url, headers={'If-None-Match': before['ETag']})
+        self.assertEqual(after.status_code, 200)
+        self.assertTrue(after.json()['cover_urls']['jpeg'].endswith('/detail.jpg'))
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = default_storage.save('covers/notes.txt', ContentFile(b'0123456789'))
+
+    def test_uploads_stored_under_content_hash(self):
+        self.assertRegex(self.name, r'^covers/[0-9a-f]{16}\.txt$')
+        # The same content is stored once, whatever it was called
+        self.assertEqual(default_storage.save('covers/other.txt', ContentFile(b'0123456789')), self.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'covers')), [os.path.basename(self.name)])
+
+    def test_hashed_files_served_as_immutable(self):
+        response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        with open(os.path.join(self.media_root, 'plain.txt'), 'wb') as file:
+            file.write(b'plain')
+        response = self.client.get('/media/plain.txt')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_MAX_AGE}')
+
+    def test_conditional_request(self):
+        etag = self.client.get(f'/media/{self.name}')['ETag']
+        response = self.client.get(f'/media/{self.name}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_range_requests(self):
+        response = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        response = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # A stale If-Range gets the whole file
+        response = self.client.get(f'/media/{self.name}', HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    async def test_streamed_under_asgi(self):
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            response = await self.async_client.get(f'/media/{self.name}', headers={'Range': 'bytes=2-5'})
+            self.assertTrue(response.is_async)
+            self.assertEqual(b''.join([part async for part in response.streaming_content]), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+    def test_web_server_handoff(self):
+        with self.settings(MEDIA_DELIVERY='x-accel-redirect'):
+            response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/internal-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_DELIVERY='x-sendfile'):
+            response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, self.name))
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get('/media/covers/missing.txt').status_code, 404)
+        self.assertEqual(self.client.get('/media/covers').status_code, 404)
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.post(f'/media/{self.name}').status_code, 405)
+
+
+class CoverDedupTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 200), 'blue').save(buffer, 'PNG')
+        self.artwork = buffer.getvalue()
+
+    def create_album(self, album_format, cover):
+        return Album.objects.create(title=f'Shared Artwork {album_format}', artist=artist('Test Artist'), price=9.99,
+                                    format=album_format, release_date=date.today(), cover_image=cover)
+
+    def upload(self, name):
+        return SimpleUploadedFile(name, self.artwork, content_type='image/png')
+
+    def test_uploads_hashed_while_streamed(self):
+        for max_memory_size in (settings.FILE_UPLOAD_MAX_MEMORY_SIZE, 10):
+            with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=max_memory_size):
+                request = RequestFactory().post('/', {'cover': self.upload('cd.png')})
+                self.assertEqual(request.FILES['cover'].content_hash, hashlib.sha256(self.artwork).hexdigest())
+
+    def test_identical_artwork_stored_once(self):
+        cd = self.create_album('CD', self.upload('cd.png'))
+        vinyl = self.create_album('VL', self.upload('vinyl.png'))
+        self.assertEqual(cd.cover_image.name, vinyl.cover_image.name)
+        self.assertEqual(os.listdir(self.media_root), [cd.cover_image.name])
+
+    def test_file_deleted_with_last_album(self):
+        cd = self.create_album('CD', self.upload('cd.png'))
+        vinyl = self.create_album('VL', self.upload('vinyl.png'))
+        name = cd.cover_image.name
+        jobs.work('test', burst=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            cd.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(covers.has_derivatives(vinyl))
+        # Replacing the last album's cover releases it too
+        vinyl = Album.objects.get(pk=vinyl.pk)
+        vinyl.cover_image = covers.DEFAULT_COVER
+        with self.captureOnCommitCallbacks(execute=True):
+            vinyl.save()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, covers.derivatives_dir(name))))
+
+    def test_import_releases_replaced_covers(self):
+        first = default_storage.save('covers/first.png', ContentFile(self.artwork))
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 200), 'red').save(buffer, 'PNG')
+        second = default_storage.save('covers/second.png', ContentFile(buffer.getvalue()))
+        record = {'title': 'Imported', 'artist': 'Importer', 'price': '9.99', 'format': 'CD',
+                  'release_date': '2020-01-01', 'tracks': []}
+        imports.CatalogImporter().import_chunk([(1, dict(record, cover_image=first))])
+        derivatives = Job.objects.filter(task='generate_cover_derivatives')
+        self.assertEqual([job.kwargs for job in derivatives], [{'name': first}])
+        jobs.work('test', burst=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            imports.CatalogImporter().import_chunk([(1, dict(record, cover_image=second))])
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, covers.derivatives_dir(first))))
+        self.assertEqual(derivatives.get(status=Job.QUEUED).kwargs, {'name': second})
+
+        # Records without a cover keep the stored one
+        for fields in ({}, {'cover_image': ''}):
+            with self.captureOnCommitCallbacks(execute=True):
+                imports.CatalogImporter().import_chunk([(1, dict(record, description='Again', **fields))])
+            self.assertEqual(Album.objects.get(slug='imported-cd').cover_image.name, second)
+            self.assertTrue(default_storage.exists(second))
+
+    def test_release_and_upload_hold_the_write_lock(self):
+        # Both check whether the file is stored inside a write transaction,
+        # so an upload cannot reuse a name between the release's check and
+        # its delete
+        outside = len(connection.atomic_blocks)
+        depths = []
+        exists = ContentHashedStorage.exists
+        with mock.patch.object(ContentHashedStorage, 'exists',
+                               lambda storage, name: depths.append(len(connection.atomic_blocks)) or exists(storage, name)):
+            cd = self.create_album('CD', self.upload('cd.png'))
+        self.assertGreater(min(depths), outside)
+        depths.clear()
+        with mock.patch.object(covers, 'remove', lambda name: depths.append(len(connection.atomic_blocks))), \
+                self.captureOnCommitCallbacks(execute=True):
+            cd.delete()
+        self.assertEqual(len(depths), 1)
+        self.assertGreater(depths[0], outside)
+
+    def test_dedupe_command(self):
+        # Covers stored under their upload names, as before
+        for name in ('cd.png', 'vinyl.png'):
+            with open(os.path.join(self.media_root, name), 'wb') as file:
+                file.write(self.artwork)
+        cd = self.create_album('CD', None)
+        vinyl = self.create_album('VL', None)
+        Album.objects.filter(pk=cd.pk).update(cover_image='cd.png')
+        Album.objects.filter(pk=vinyl.pk).update(cover_image='vinyl.png')
+        out = io.StringIO()
+        call_command('dedupe_covers', dry_run=True, stdout=out)
+        self.assertIn('Would move 1 covers to hashed names and merged 1 duplicates', out.getvalue())
+        self.assertTrue(default_storage.exists('cd.png'))
+
+        call_command('dedupe_covers', stdout=io.StringIO())
+        name = hashlib.sha256(self.artwork).hexdigest()[:16] + '.png'
+        self.assertEqual(set(Album.objects.values_list('cover_image', flat=True)), {name})
+        self.assertEqual(os.listdir(self.media_root), [name])
+        self.assertIn(f'/media/{name}', documents.get(cd.pk))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        tasks = mock.patch.dict(jobs.TASKS, {**jobs.tasks(), 'record': (self.record, 2)})
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def record(self, value):
+        if value == 'fail':
+            raise ValueError('Failed on purpose')
+        self.calls.append(value)
+        self.atomic_blocks = len(connection.atomic_blocks)
+
+    def test_unknown_task(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('missing')
+
+    def test_job_claimed_once(self):
+        job = jobs.enqueue('record', value='a')
+        self.assertEqual(jobs.claim('first'), job)
+        self.assertIsNone(jobs.claim('second'))
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual((job.status, job.claimed_by, job.attempts), (Job.RUNNING, 'first', 1))
+        # Due jobs are claimed oldest first; delayed ones wait
+        jobs.enqueue('record', value='b', delay=60)
+        older = jobs.enqueue('record', value='c')
+        newer = jobs.enqueue('record', value='d')
+        self.assertEqual(jobs.claim('first'), older)
+        self.assertEqual(jobs.claim('first'), newer)
+        self.assertIsNone(jobs.claim('first'))
+
+    def test_tasks_run_outside_a_transaction(self):
+        # A transaction around the task would hold the write lock while it runs
+        jobs.enqueue('record', value='a')
+        jobs.run(jobs.claim('worker'))
+        self.assertEqual(self.atomic_blocks, len(connection.atomic_blocks))
+
+    def test_failed_job_retried_with_backoff(self):
+        job = jobs.enqueue('record', value='fail')
+        self.assertFalse(jobs.run(jobs.claim('worker')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.last_error, 'ValueError: Failed on purpose')
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=jobs.BACKOFF_SECONDS / 2 - 1))
+        # The last attempt marks it failed
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertFalse(jobs.run(jobs.claim('worker')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_stuck_jobs_recovered(self):
+        job = jobs.enqueue('record', value='a')
+        jobs.claim('worker')
+        self.assertEqual(jobs.recover(), 0)
+        Job.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(seconds=jobs.TIMEOUT_SECONDS + 1))
+        self.assertEqual(jobs.recover(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+
+    def test_run_worker_command(self):
+        for value in ('a', 'b', 'fail'):
+            jobs.enqueue('record', value=value)
+        out = io.StringIO()
+        call_command('run_worker', burst=True, stdout=out)
+        self.assertEqual(self.calls, ['a', 'b'])
+        # The failed job waits out its backoff
+        self.assertIn('(2 done, 0 failed), 0 due', out.getvalue())
+        self.assertIn('Ran 3 jobs', out.getvalue())
+
+    def test_album_upload_queues_cover_work(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 200), 'green').save(buffer, 'PNG')
+        user = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=user, display_name='Editor', user_type='editor')
+        self.client.login(username='editor', password='54321')
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.post('/albums/new/', {
+                'title': 'Queued Album', 'description': '', 'artist': artist('Test Artist').pk, 'price': '9.99',
+                'format': 'CD', 'release_date': date.today(),
+                'cover_image': SimpleUploadedFile('cover.png', buffer.getvalue(), content_type='image/png'),
+            })
+            self.assertEqual(response.status_code, 302)
+            album = Album.objects.get(title='Queued Album')
+            self.assertFalse(covers.has_derivatives(album))
+            self.assertEqual(Job.objects.get().kwargs, {'name': album.cover_image.name})
+            jobs.work('test', burst=True)
+            self.assertTrue(covers.has_derivatives(album))
+            self.assertIn('/detail.jpg', documents.get(album.pk))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=self.user, display_name='Editor', user_type='editor')
+        self.album = Album.objects.create(
+            title='Conditional Album',
+            artist=artist('Test Artist'),
+            price=9.99,
+            format='CD',
+            release_date=date.today()
+        )
+        self.song = Song.objects.create(title='Conditional Song', length=180)
+
+    def test_api_detail_not_modified(self):
+        url = f'/api/albums/{self.album.id}/'
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        # Only the validator query runs for a matching ETag
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_tracklist_change_invalidates_etag(self):
+        url = f'/api/albums/{self.album.id}/'
+        etag = self.client.get(url)['ETag']
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song, position=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # Renaming a song on the album changes it again
+        etag = response['ETag']
+        self.song.title = 'Renamed Song'
+        self.song.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_collection_validator(self):
+        etag = self.client.get('/api/albums/')['ETag']
+        self.assertEqual(self.client.get('/api/albums/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # A different representation has a different tag
+        self.assertEqual(self.client.get('/api/albums/?view=summary', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        Album.objects.filter(pk=self.album.pk).delete()
+        self.assertEqual(self.client.get('/api/albums/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_collection_validator_reads_one_row(self):
+        url = '/api/songs/?min_length=100'
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        (query,) = queries.captured_queries
+        self.assertIn(CollectionVersion._meta.db_table, query['sql'])
+        self.assertNotIn('COUNT', query['sql'].upper())
+        # Bulk writers, which send no signals, change it too
+        imports.resolve_songs({('Imported Song', 240)})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_tracklist_change_invalidates_song_list(self):
+        url = f'/api/songs/?album={self.album.id}'
+        etag = self.client.get(url)['ETag']
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song, position=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in response.json()['results']], ['Conditional Song'])
+        etag = response['ETag']
+        self.album.set_tracklist([])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_song_detail_if_modified_since(self):
+        url = f'/api/songs/{self.song.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_html_detail_not_modified(self):
+        self.client.login(username='editor', password='54321')
+        url = reverse('album-detail', args=[self.album.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        slug_url = reverse('album-detail-slug', args=[self.album.id, self.album.slug])
+        etag = self.client.get(slug_url)['ETag']
+        self.assertEqual(self.client.get(slug_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_html_detail_etag_follows_csrf_secret(self):
+        # A page replayed after logging in again would post a stale token
+        credentials = {'username': 'editor', 'password': '54321'}
+        self.client.post(reverse('login'), credentials)
+        url = reverse('album-detail', args=[self.album.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.post(reverse('logout'))
+        self.client.post(reverse('login'), credentials)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AlbumCacheTests(TestCase):
+    def setUp(self):
+        self.editor = User.objects.create_user(username='editor', password='54321')
+        MusicManagerUser.objects.create(user=self.editor, display_name='Editor', user_type='editor')
+        self.artist = User.objects.create_user(username='artist', password='12345')
+        MusicManagerUser.objects.create(user=self.artist, display_name='Artist Name', user_type='artist')
+        self.album = Album.objects.create(
+            title='Cached Album',
+            artist=artist('Artist Name'),
+            price=9.99,
+            format='CD',
+            release_date=date.today()
+        )
+        self.song = Song.objects.create(title='Cached Song', length=180)
+        AlbumTracklistItem.objects.create(album=self.album, song=self.song, position=1)
+
+    def test_api_retrieve_served_from_cache(self):
+        url = f'/api/albums/{self.album.id}/'
+        first = self.client.get(url).json()
+        misses = album_cache.stats()['misses']
+        # Only the validator query runs on a hit
+        with self.assertNumQueries(1):
+            second = self.client.get(url).json()
+        self.assertEqual(first, second)
+        self.assertEqual(album_cache.stats()['misses'], misses)
+
+    def test_invalidation_reaches_other_processes(self):
+        self.assertEqual(album_cache.get_or_set(self.album.id, 'test', lambda: 'stale'), 'stale')
+        # e.g. a run_worker process, configured like this one
+        subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             f'from label_music_manager import album_cache; album_cache.invalidate({self.album.id})'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'CACHE_LOCATION': settings.CACHES['default']['LOCATION']},
+            check=True, capture_output=True)
+        self.assertEqual(album_cache.get_or_set(self.album.id, 'test', lambda: 'fresh'), 'fresh')
+
+    def test_hits_write_nothing(self):
+        album_cache.get_or_set(self.album.id, 'test', lambda: 'value')
+        with mock.patch.object(FileCache, 'set', side_effect=AssertionError), \
+                mock.patch.object(FileCache, 'incr', side_effect=AssertionError):
+            self.assertEqual(album_cache.get_or_set(self.album.id, 'test', lambda: 'other'), 'value')
+            self.assertEqual(album_cache.get_many_or_set([self.album.id], 'test', dict), {self.album.id: 'value'})
+
+    def test_culling_keeps_generations(self):
+        album_cache.get_or_set(self.album.id, 'test', lambda: 'value')
+        generation = album_cache._generation(self.album.id)
+        cache._cull_frequency = 1  # culling empties the cache
+        cache._max_entries, cache._next_cull = 1, 0
+        cache.set('filler', 'x')
+        self.assertEqual(album_cache.get_or_set(self.album.id, 'test', lambda: 'rebuilt'), 'rebuilt')
+        self.assertEqual(album_cache._generation(self.album.id), generation)
+
+    def test_file_cache_culls_once_per_interval(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        file_cache = FileCache(location, {'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 1, 'CULL_INTERVAL': 60}})
+        with mock.patch.object(FileCache, '_list_cache_files', autospec=True,
+                               side_effect=FileBasedCache._list_cache_files) as listing:
+            for i in range(5):
+                file_cache.set(f'key{i}', i)
+        self.assertEqual(listing.call_count, 1)
+        self.assertEqual(len(file_cache.get_many([f'key{i}' for i in range(5)])), 5)
+        file_cache._next_cull = 0
+        file_cache.set('key5', 5)
+        self.assertEqual(file_cache.get_many([f'key{i}' for i in range(6)]), {'key5': 5})
+
+    def test_song_change_invalidates(self):
+        url = f'/api/albums/{self.album.id}/'
+        self.client.get(url)
+        self.song.title = 'Renamed Song'
+        self.song.save()
+        self.assertEqual(self.client.get(url).json()['tracks'][0]['title'], 'Renamed Song')
+
+    def test_tracklist_change_invalidates_page(self):
+        self.client.login(username='editor', password='54321')
+        url = reverse('album-detail', args=[self.album.id])
+        self.assertContains(self.client.get(url), 'Cached Song')
+        AlbumTracklistItem.objects.filter(album=self.album).delete()
+        self.assertNotContains(self.client.get(url), 'Cached Song')
+
+    def test_pages_cached_per_role(self):
+        url = reverse('album-detail', args=[self.album.id])
+        self.client.login(username='editor', password='54321')
+        self.assertContains(self.client.get(url), 'Delete')
+        self.client.login(username='artist', password='12345')
+        response = self.client.get(url)
+        self.assertContains(response, 'Edit')
+        self.assertNotContains(response, 'Delete')
+
+    def test_stats_endpoint_requires_staff(self):
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+        self.editor.is_staff = True
+        self.editor.save()
+        self.client.login(username='editor', password='54321')
+        self.assertEqual(set(self.client.get('/api/cache-stats/').json()), {'hits', 'misses', 'hit_ratio'})
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.album = Album.objects.create(
+            title='Midnight Harbour',
+            description='Late night recordings from the docks',
+            artist=artist('Lighthouse Keepers'),
+            price=9.99,
+            format='VL',
+            release_date=date.today()
+        )
+        Album.objects.create(
+            title='Morning Light',
+            description='An album about the harbour at dawn',
+            artist=artist('Sunrise Band'),
+            price=9.99,
+            format='CD',
+            release_date=date.today()
+        )
+        self.song = Song.objects.create(title='Harbour Lights', length=200)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_ranked_prefix_search(self):
+        results = self.search('harb')
+        self.assertEqual(len(results), 3)
+        # A title match ranks above a description match
+        titles = [result.get('album', result.get('song'))['title'] for result in results]
+        self.assertLess(titles.index('Midnight Harbour'), titles.index('Morning Light'))
+
+    def test_type_filter_and_artist_match(self):
+        results = self.search('lighthouse', type='album')
+        self.assertEqual([result['album']['id'] for result in results], [self.album.id])
+        self.assertEqual([result['song']['id'] for result in self.search('lights', type='song')], [self.song.id])
+
+    def test_index_follows_changes(self):
+        self.song.title = 'Renamed'
+        self.song.save()
+        self.assertEqual(self.search('harbour', type='song'), [])
+        self.album.delete()
+        self.assertEqual(self.search('midnight'), [])
+
+    def test_rows_keyed_by_rowid(self):
+        def rows():
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT rowid, kind, object_id FROM {search.TABLE} ORDER BY rowid')
+                return cursor.fetchall()
+
+        expected = sorted([(search.rowid(search.ALBUM, pk), search.ALBUM, pk)
+                           for pk in Album.objects.values_list('pk', flat=True)] +
+                          [(search.rowid(search.SONG, self.song.pk), search.SONG, self.song.pk)])
+        self.assertEqual(rows(), expected)
+        # Updates replace the row in place and deletes find it by rowid, not
+        # by scanning the unindexed columns
+        album_row = (search.rowid(search.ALBUM, self.album.pk), search.ALBUM, self.album.pk)
+        remaining = [row for row in expected if row != album_row]
+        self.song.title = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            self.song.save()
+            self.album.delete()
+        self.assertFalse([query for query in queries.captured_queries
+                          if search.TABLE in query['sql'] and 'object_id =' in query['sql']])
+        self.assertEqual(rows(), remaining)
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(rows(), remaining)
+
+    def test_operators_in_query_are_literal(self):
+        self.assertEqual(self.search('"harbour" OR NOT (*'), self.search('harbour or not'))
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        self.assertEqual(self.search('harbour'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(len(self.search('harbour')), 3)
+
+    def test_failed_rebuild_keeps_the_index(self):
+        def rowid_sql(kind, column):
+            if kind == search.SONG:
+                raise OperationalError('Failed on purpose')
+            return f'{column} * 2'
+        with mock.patch.object(search, '_rowid_sql', rowid_sql), self.assertRaises(OperationalError):
+            search.rebuild()
+        self.assertEqual(len(self.search('harbour')), 3)
+
+
+class SeedCommandTests(TestCase):
+    def seed(self, **options):
+        call_command('seed', artists=3, albums=12, songs=40, min_tracks=2, max_tracks=5,
+                     stdout=io.StringIO(), **options)
+        return list(Album.objects.order_by('id').values_list('title', 'artist__name', 'format', 'slug'))
+
+    def test_catalog_is_deterministic(self):
+        first = self.seed()
+        self.assertEqual(first, self.seed(flush=True))
+        self.assertNotEqual(first, self.seed(flush=True, seed=7))
+
+    def test_catalog_shape(self):
+        self.seed()
+        self.assertEqual((Album.objects.count(), Song.objects.count()), (12, 40))
+        self.assertEqual(MusicManagerUser.objects.filter(user_type='artist').count(), 3)
+        artists = set(MusicManagerUser.objects.filter(user_type='artist').values_list('display_name', flat=True))
+        self.assertTrue(set(Album.objects.values_list('artist__name', flat=True)) <= artists)
+        for album in Album.objects.with_tracklist():
+            positions = [item.position for item in album.ordered_tracklist_items]
+            gap = AlbumTracklistItem.GAP
+            self.assertEqual(positions, list(range(gap, gap * (len(positions) + 1), gap)))
+            self.assertTrue(2 <= len(positions) <= 5)
+        # The search index is rebuilt after the bulk load
+        self.assertTrue(search.search(Song.objects.first().title.split()[0]))
+
+    def test_refuses_to_mix_with_existing_catalog(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class BenchmarkTests(TestCase):
+    def test_compare_flags_slowdowns_and_extra_queries(self):
+        baseline = {'small': {
+            'album_detail': {'time_ms': 10.0, 'queries': 5, 'peak_kb': 50},
+            'api_album_list': {'time_ms': 10.0, 'queries': 3, 'peak_kb': 50},
+        }}
+        results = {'small': {
+            'album_detail': {'time_ms': 12.0, 'queries': 6, 'peak_kb': 50},
+            'api_album_list': {'time_ms': 14.0, 'queries': 3, 'peak_kb': 50},
+            'tracklist_save': {'time_ms': 99.0, 'queries': 99, 'peak_kb': 50},
+        }}
+        self.assertEqual(benchmarks.compare(results, baseline, threshold=0.25), [
+            ('small', 'album_detail', 'queries', 5, 6),
+            ('small', 'api_album_list', 'time_ms', 10.0, 14.0),
+        ])
+
+    def test_benchmarks_run_against_seeded_catalog(self):
+        call_command('seed', artists=2, albums=5, songs=50, stdout=io.StringIO())
+        results = benchmarks.run_benchmarks(repeat=1)
+        self.assertEqual(set(results), set(benchmarks.BENCHMARKS))
+        for result in results.values():
+            self.assertEqual(set(result), {'time_ms', 'queries', 'peak_kb'})
+        self.assertLess(results['tracklist_save']['queries'], 30)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_runs_leave_the_real_cache_alone(self):
+        cache.set('live-page', 'kept')
+        with benchmarks.isolated():
+            self.assertEqual(settings.DATABASE_REPLICAS, [])
+            self.assertIsNone(cache.get('live-page'))
+            cache.set('benchmark-page', 'dropped')
+            cache.clear()
+        self.assertEqual(cache.get('live-page'), 'kept')
+        self.assertIsNone(cache.get('benchmark-page'))
+
+    def test_cascaded_tracklist_deletes_touch_albums_once(self):
+        call_command('seed', artists=2, albums=5, songs=50, stdout=io.StringIO())
+        album = Album.objects.first()
+        song = album.tracklist[0]
+        before = album.updated_at
+        song.delete()
+        album.refresh_from_db()
+        self.assertGreater(album.updated_at, before)
+        # A fixed number of queries, not one touch per tracklist row
+        with self.assertNumQueries(6):
+            album.delete()
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        call_command('seed', artists=2, albums=7, songs=20, min_tracks=2, max_tracks=4, stdout=io.StringIO())
+        self.empty = Album.objects.create(title='Empty', description='', artist=artist('Nobody'), price=1,
+                                          format='CD', release_date=date(2020, 1, 1))
+
+    def stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_albums_ndjson_nests_ordered_tracks(self):
+        lines = self.stream('/api/export/albums.ndjson').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['id'] for record in records], list(Album.objects.order_by('id').values_list('id', flat=True)))
+        for record in records:
+            album = Album.objects.get(pk=record['id'])
+            self.assertEqual([track['song_id'] for track in record['tracks']], [song.id for song in album.tracklist])
+        self.assertEqual(records[-1]['tracks'], [])
+
+    def test_albums_csv_has_a_row_per_track(self):
+        rows = list(csv.DictReader(io.StringIO(self.stream('/api/export/albums.csv'))))
+        self.assertEqual(len(rows), AlbumTracklistItem.objects.count() + 1)
+        self.assertEqual(rows[-1]['title'], 'Empty')
+        self.assertEqual(rows[-1]['track_song_id'], '')
+
+    def test_songs_and_tracklist(self):
+        songs = list(csv.DictReader(io.StringIO(self.stream('/api/export/songs.csv'))))
+        self.assertEqual(len(songs), Song.objects.count())
+        items = self.stream('/api/export/tracklist.ndjson').splitlines()
+        self.assertEqual(len(items), AlbumTracklistItem.objects.count())
+        self.assertEqual(self.client.get('/api/export/users.csv').status_code, 404)
+
+    async def test_streamed_under_asgi(self):
+        sync_response = await sync_to_async(self.client.get)('/api/export/albums.ndjson')
+        expected = b''.join(await sync_to_async(list)(sync_response.streaming_content))
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'), \
+                mock.patch.object(async_views, 'STREAM_BATCH_BYTES', 100):
+            response = await self.async_client.get('/api/export/albums.ndjson')
+            # Sent as it is read, not collected into a list first
+            self.assertTrue(response.is_async)
+            parts = [part async for part in response.streaming_content]
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(b''.join(parts), expected)
+
+    def test_reads_in_chunks(self):
+        # Each chunk of albums is one query plus one for its tracklists; the
+        # last chunk was full, so one more query finds nothing left
+        with self.assertNumQueries(9):
+            lines = list(exports.export_lines('albums', 'ndjson', chunk_size=2))
+        self.assertEqual(len(lines), 8)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'songs.ndjson')
+            call_command('export_catalog', 'songs', output=path, stdout=io.StringIO())
+            with open(path) as export:
+                self.assertEqual(len(export.readlines()), Song.objects.count())
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as source:
+            source.writelines(lines)
+        return path
+
+    def record(self, title, tracks=(), **fields):
+        record = {'title': title, 'description': '', 'artist': 'Importer', 'price': '9.99', 'format': 'CD',
+                  'release_date': '2020-01-01', 'tracks': [{'title': t, 'length': n} for t, n in tracks]}
+        record.update(fields)
+        return json.dumps(record) + '\n'
+
+    def import_file(self, path, **options):
+        output = io.StringIO()
+        call_command('import_catalog', path, stdout=output, stderr=output, **options)
+        return output.getvalue()
+
+    def test_round_trip_through_export(self):
+        call_command('seed', artists=2, albums=6, songs=30, min_tracks=2, max_tracks=4, stdout=io.StringIO())
+        for fmt in ('ndjson', 'csv'):
+            path = self.write(f'albums.{fmt}', exports.export_lines('albums', fmt))
+            before = {album.slug: [(song.title, song.length) for song in album.tracklist]
+                      for album in Album.objects.with_tracklist()}
+            Album.objects.all().delete()
+            Song.objects.all().delete()
+            self.import_file(path, chunk_size=4)
+            after = {album.slug: [(song.title, song.length) for song in album.tracklist]
+                     for album in Album.objects.with_tracklist()}
+            self.assertEqual(before, after)
+        self.assertTrue(search.search(Album.objects.first().title))
+
+    def test_upserts_by_slug_and_shares_songs(self):
+        path = self.write('a.ndjson', [self.record('One', [('Intro', 60), ('Outro', 90)]),
+                                       self.record('Two', [('Intro', 60)])])
+        self.import_file(path)
+        album_id = Album.objects.get(slug='one-cd').id
+        album_cache.get_or_set(album_id, 'test', lambda: 'stale')
+        self.assertEqual(Song.objects.filter(title='Intro').count(), 1)
+
+        path = self.write('b.ndjson', [self.record('One', [('Outro', 90)], description='Updated')])
+        self.assertIn('0 albums created, 1 updated, 0 songs created', self.import_file(path))
+        album = Album.objects.get(slug='one-cd')
+        self.assertEqual((album.id, album.description), (album_id, 'Updated'))
+        self.assertEqual([song.title for song in album.tracklist], ['Outro'])
+        self.assertEqual(album_cache.get_or_set(album.id, 'test', lambda: 'fresh'), 'fresh')
+
+    def test_documents_rewritten_by_the_worker(self):
+        path = self.write('a.ndjson', [self.record('One', [('Intro', 60)])])
+        self.import_file(path)
+        jobs.work('test', burst=True)
+        album = Album.objects.get(slug='one-cd')
+        self.import_file(self.write('b.ndjson', [self.record('One', [('Outro', 90)])]))
+        # The stale document is gone, so reads render the album meanwhile
+        self.assertFalse(AlbumDocument.objects.filter(album=album).exists())
+        self.assertEqual([track['title'] for track in self.client.get(f'/api/albums/{album.id}/').json()['tracks']],
+                         ['Outro'])
+        jobs.work('test', burst=True)
+        self.assertEqual(json.loads(AlbumDocument.objects.get(album=album).body)['tracks'][0]['title'], 'Outro')
+
+    def test_rejected_records_are_reported(self):
+        Album.objects.create(title='Taken', description='', artist=artist('Someone'), price=1, format='VL',
+                             release_date=date(2020, 1, 1))
+        path = self.write('a.ndjson', [self.record('Good'), 'not json\n', self.record('Bad', price='abc'),
+                                       self.record('Taken'), self.record('Short', [('Blip', 3)])])
+        report = os.path.join(self.directory, 'errors.csv')
+        output = self.import_file(path, errors=report)
+        self.assertIn('4 records rejected', output)
+        with open(report) as report_file:
+            rows = list(csv.DictReader(report_file))
+        self.assertEqual([row['line'] for row in rows], ['2', '3', '4', '5'])
+        self.assertIn('price', rows[1]['error'])
+        self.assertIn('already used', rows[2]['error'])
+        self.assertEqual(set(Album.objects.values_list('title', flat=True)), {'Taken', 'Good'})
+
+    def test_resume_skips_imported_records(self):
+        path = self.write('a.ndjson', [self.record(title) for title in ('A', 'B', 'C')])
+        state = f'{path}.import-state.json'
+        with open(state, 'w') as state_file:
+            json.dump({'size': os.path.getsize(path), 'records': 2, 'rejected': 0}, state_file)
+        self.import_file(path, resume=True)
+        self.assertEqual(list(Album.objects.values_list('title', flat=True)), ['C'])
+        self.assertFalse(os.path.exists(state))
+
+
+class BatchWriteTests(TestCase):
+    def setUp(self):
+        self.songs = [Song.objects.create(title=f'Song {i}', length=120 + i) for i in range(3)]
+        self.album = Album.objects.create(title='Existing', description='', artist=artist('Artist'), price=5,
+                                          format='CD', release_date=date(2020, 1, 1))
+        self.album.set_tracklist(self.songs)
+
+    def item(self, title, **fields):
+        item = {'title': title, 'description': '', 'artist': 'Artist', 'price': '9.99', 'format': 'VL',
+                'release_date': '2021-05-01'}
+        item.update(fields)
+        return item
+
+    def post(self, items):
+        return self.client.post('/api/albums/batch/', {'albums': items}, content_type='application/json')
+
+    def test_creates_and_updates_in_one_request(self):
+        tracks = [{'song': self.songs[2].id}, {'title': 'New Song', 'length': 200}, {'song': self.songs[0].id}]
+        response = self.post([
+            self.item('Fresh', tracks=tracks),
+            self.item('Existing', id=self.album.id, format='CD', description='Changed', tracks=[{'song': self.songs[1].id}]),
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'updated'])
+        fresh = Album.objects.get(pk=results[0]['id'])
+        self.assertEqual((fresh.slug, [song.title for song in fresh.tracklist]),
+                         ('fresh-vl', ['Song 2', 'New Song', 'Song 0']))
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.description, 'Changed')
+        self.assertEqual(self.album.tracklist, [self.songs[1]])
+        self.assertEqual(search.search('fresh'), [('album', fresh.id, search.search('fresh')[0][2])])
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def batch(prefix, size):
+            return [self.item(f'{prefix} {i}', tracks=[{'song': song.id} for song in self.songs]) for i in range(size)]
+        with CaptureQueriesContext(connection) as small:
+            self.post(batch('Small', 2))
+        with CaptureQueriesContext(connection) as large:
+            self.post(batch('Large', 40))
+        self.assertEqual(len(small), len(large))
+
+    def test_invalid_batch_writes_nothing(self):
+        response = self.post([
+            self.item('Fine'),
+            self.item('Existing', format='CD'),
+            self.item('Twice'),
+            self.item('Twice'),
+            self.item('Bad', price='-1', tracks=[{'song': 9999}]),
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['valid', 'invalid', 'valid', 'invalid', 'invalid'])
+        self.assertIn('title', results[1]['errors'])
+        self.assertIn('title', results[3]['errors'])
+        self.assertIn('price', results[4]['errors'])
+        self.assertEqual(Album.objects.count(), 1)
+
+    def test_item_errors_in_either_list_format(self):
+        # DRF 3.18 keys item errors by index instead of listing every item
+        serializer = AlbumBatchItemSerializer(many=True)
+        expected = [{}, {'price': ['Too low.']}, {}]
+        self.assertEqual(serializer.item_errors([{}, {'price': ['Too low.']}, {}], 3), expected)
+        self.assertEqual(serializer.item_errors({1: {'price': ['Too low.']}}, 3), expected)
+        self.assertIsNone(serializer.item_errors({'non_field_errors': ['Too many.']}, 3))
+
+    def test_batch_size_is_limited(self):
+        with override_settings(API_MAX_BATCH_SIZE=1):
+            response = self.post([self.item('One'), self.item('Two')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+
+
+class FilterTests(TestCase):
+    def setUp(self):
+        for i, (name, album_format, price) in enumerate([('Ana', 'CD', 5), ('Ana', 'VL', 15), ('Bo', 'CD', 25)]):
+            Album.objects.create(title=f'Album {i}', description='', artist=artist(name), price=price,
+                                 format=album_format, release_date=date(2020, 1, 1) + timedelta(days=100 * i))
+        self.song = Song.objects.create(title='Long', length=400)
+        Song.objects.create(title='Short', length=30)
+        Album.objects.get(title='Album 0').set_tracklist([self.song])
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['title'] for item in response.json()['results']]
+
+    def test_album_filters(self):
+        self.assertEqual(self.titles('/api/albums/?artist=Ana'), ['Album 0', 'Album 1'])
+        self.assertEqual(self.titles('/api/albums/?release_format=VL&release_format=CD&min_price=10'), ['Album 1', 'Album 2'])
+        self.assertEqual(self.titles('/api/albums/?released_after=2020-03-01&released_before=2020-06-01'), ['Album 1'])
+        self.assertEqual(self.titles('/api/albums/?ordering=-price&max_price=20'), ['Album 1', 'Album 0'])
+        self.assertEqual(self.titles('/api/albums/?view=summary&artist=Bo'), ['Album 2'])
+
+    def test_song_filters(self):
+        self.assertEqual(self.titles('/api/songs/?min_length=100'), ['Long'])
+        self.assertEqual(self.titles(f'/api/songs/?album={Album.objects.get(title="Album 0").id}'), ['Long'])
+        self.assertEqual(self.titles('/api/songs/?ordering=length'), ['Short', 'Long'])
+
+    def test_invalid_values_are_rejected(self):
+        response = self.client.get('/api/albums/?release_format=MP3&released_after=soon&min_price=cheap')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'release_format', 'released_after', 'min_price'})
+        self.assertEqual(self.client.get('/api/songs/?min_length=long').status_code, 400)
+
+    def test_out_of_range_values_are_rejected(self):
+        for url in ['/api/albums/?min_price=NaN', '/api/albums/?max_price=Infinity', '/api/albums/?min_price=-inf',
+                    '/api/songs/?album=99999999999999999999999', f'/api/songs/?min_length={-2**63 - 1}']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+        self.assertEqual(self.client.get(f'/api/songs/?max_length={2**63 - 1}').status_code, 200)
+        self.assertEqual(self.client.get('/api/albums/?max_price=1e999').status_code, 200)
+
+    def query_plan(self, url, table):
+        # EXPLAIN QUERY PLAN of the paginated query a request runs on `table`
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        sql = next(query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'] and 'LIMIT' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return ' | '.join(row[-1] for row in cursor.fetchall())
+
+    def test_common_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite')
+        album, song = Album._meta.db_table, Song._meta.db_table
+        for url, table, index in [
+            ('/api/albums/?artist=Ana', album, 'album_artist_idx'),
+            ('/api/albums/?release_format=CD&ordering=release_date', album, 'album_format_release_idx'),
+            ('/api/albums/?released_after=2020-03-01&ordering=release_date', album, 'release_date'),
+            ('/api/albums/?ordering=price', album, 'album_price_idx'),
+            ('/api/songs/?min_length=100&ordering=length', song, 'song_length_idx'),
+            ('/api/songs/?album=1', song, 'albumtracklistitem'),
+            ('/api/songs/?ordering=title', song, 'title'),
+        ]:
+            with self.subTest(url=url):
+                plan = self.query_plan(url, table)
+                self.assertIn(index, plan)
+                self.assertNotIn(f'SCAN {table}', plan.replace(f'SCAN {table} USING', ''))
+
+    def test_tied_orderings_walk_every_row(self):
+        # Far more rows share one length or price than fit on a page
+        Song.objects.bulk_create([Song(title=f'Tied {i}', length=200) for i in range(30)])
+        for i in range(12):
+            Album.objects.create(title=f'Tied Album {i}', description='', artist=artist('Ana'), price=10,
+                                 format='CD', release_date=date(2021, 1, 1))
+        for endpoint, ordering, model in [('songs', 'length', Song), ('albums', 'price', Album)]:
+            for direction in ('', '-'):
+                with self.subTest(endpoint=endpoint, ordering=direction + ordering):
+                    url, ids = f'/api/{endpoint}/?ordering={direction}{ordering}&page_size=4', []
+                    with CaptureQueriesContext(connection) as queries:
+                        while url:
+                            data = self.client.get(url).json()
+                            ids += [item['id'] for item in data['results']]
+                            url = data['next']
+                    self.assertEqual(sorted(ids), sorted(model.objects.values_list('id', flat=True)))
+                    self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+
+    def test_later_pages_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are checked on SQLite')
+        song = Song._meta.db_table
+        url = self.client.get('/api/songs/?ordering=length&page_size=1').json()['next']
+        plan = self.query_plan(url, song)
+        self.assertIn('song_length_idx', plan)
+        self.assertNotIn(f'SCAN {song}', plan.replace(f'SCAN {song} USING', ''))
+
+
+class ArtistOwnershipTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='artist', password='12345')
+        self.profile = MusicManagerUser.objects.create(user=self.user, display_name='Solo', user_type='artist')
+        self.album = Album.objects.create(title='Owned', description='', artist=artist('Solo'), price=5,
+                                          format='CD', release_date=date(2020, 1, 1))
+
+    def test_renamed_account_keeps_its_albums(self):
+        self.profile.display_name = 'Solo (Remastered)'
+        self.profile.save()
+        self.client.login(username='artist', password='12345')
+        response = self.client.get(reverse('album-edit', args=[self.album.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_same_display_name_does_not_grant_ownership(self):
+        other = User.objects.create_user(username='impostor', password='12345')
+        profile = MusicManagerUser.objects.create(user=other, display_name='Solo', user_type='artist')
+        self.assertIsNone(profile.artist_id)
+        self.client.login(username='impostor', password='12345')
+        response = self.client.get(reverse('album-edit', args=[self.album.id]))
+        self.assertRedirects(response, reverse('album-list'))
+
+    def test_other_artists_albums_hidden_on_every_url(self):
+        other = User.objects.create_user(username='other', password='12345')
+        MusicManagerUser.objects.create(user=other, display_name='Other', user_type='artist')
+        self.client.login(username='other', password='12345')
+        for url in (reverse('album-detail', args=[self.album.id]),
+                    reverse('album-detail-slug', args=[self.album.id, self.album.slug])):
+            self.assertRedirects(self.client.get(url), reverse('album-list'))
+        self.client.login(username='artist', password='12345')
+        url = reverse('album-detail-slug', args=[self.album.id, self.album.slug])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_renaming_an_artist_reindexes_its_albums(self):
+        self.album.artist.name = 'Duo'
+        self.album.artist.save()
+        self.assertEqual([object_id for _, object_id, _ in search.search('Duo')], [self.album.id])
+
+
+@override_settings(ALBUM_LIST_PAGE_SIZE=2)
+class AlbumListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username, user_type in [('editor', 'editor'), ('viewer', 'viewer'), ('artist', 'artist')]:
+            user = User.objects.create_user(username=username, password='12345')
+            MusicManagerUser.objects.create(user=user, display_name=username.title(), user_type=user_type)
+        self.albums = [Album.objects.create(title=f'Album {i}', description='', artist=artist(name), price=5,
+                                            format='CD', release_date=date(2020, 1, 1))
+                       for i, name in enumerate(['Artist', 'Someone', 'Artist', 'Someone', 'Artist'])]
+
+    def titles(self, response):
+        return [album.title for album in self.albums if f'{album.title} by' in response.content.decode()]
+
+    def test_keyset_pages(self):
+        self.client.login(username='viewer', password='12345')
+        first = self.client.get(reverse('album-list'))
+        self.assertEqual(self.titles(first), ['Album 0', 'Album 1'])
+        self.assertEqual(first.context['next_page'], self.albums[1].id)
+        self.assertIsNone(first.context['previous_page'])
+        second = self.client.get(reverse('album-list'), {'after': self.albums[1].id})
+        self.assertEqual(self.titles(second), ['Album 2', 'Album 3'])
+        back = self.client.get(reverse('album-list'), {'before': self.albums[2].id})
+        self.assertEqual(self.titles(back), ['Album 0', 'Album 1'])
+        self.assertIsNone(back.context['previous_page'])
+        last = self.client.get(reverse('album-list'), {'after': self.albums[3].id})
+        self.assertEqual(self.titles(last), ['Album 4'])
+        self.assertIsNone(last.context['next_page'])
+
+    def test_artists_see_their_own_albums(self):
+        self.client.login(username='artist', password='12345')
+        response = self.client.get(reverse('album-list'))
+        self.assertEqual(self.titles(response), ['Album 0', 'Album 2'])
+        self.assertContains(response, 'Edit')
+        self.assertNotContains(response, 'Delete')
+
+    def test_fragments_cached_per_role(self):
+        self.client.login(username='editor', password='12345')
+        self.assertContains(self.client.get(reverse('album-list')), 'Delete', count=2)
+        self.client.login(username='viewer', password='12345')
+        self.assertNotContains(self.client.get(reverse('album-list')), 'Edit')
+
+    def test_cached_page_query_count(self):
+        self.client.login(username='viewer', password='12345')
+        self.client.get(reverse('album-list'))
+        # Session, user, profile and the page of ids; no album rows
+        with self.assertNumQueries(4):
+            self.client.get(reverse('album-list'))
+
+    def test_change_invalidates_fragment(self):
+        self.client.login(username='viewer', password='12345')
+        self.client.get(reverse('album-list'))
+        self.albums[0].title = 'Renamed'
+        self.albums[0].save()
+        self.assertContains(self.client.get(reverse('album-list')), 'Renamed')
+
+
+class SQLiteConcurrencyTests(SimpleTestCase):
+    # Runs against a database file: the in-memory test database has no WAL
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'concurrency.sqlite3')
+
+    def connect(self, **pragmas):
+        # A connection configured like the default one, with `pragmas`
+        # replacing settings.SQLITE_PRAGMAS values
+        pragmas = {**settings.SQLITE_PRAGMAS, **pragmas}
+        options = dict(connections.settings['default']['OPTIONS'],
+                       init_command='; '.join(f'PRAGMA {name} = {value}' for name, value in pragmas.items()))
+        wrapper = DatabaseWrapper({**connections.settings['default'], 'NAME': self.path, 'OPTIONS': options}, 'concurrency')
+        self.addCleanup(wrapper.close)
+        self.execute(wrapper, 'CREATE TABLE IF NOT EXISTS item (id INTEGER PRIMARY KEY)')
+        return wrapper
+
+    def execute(self, wrapper, *statements):
+        with wrapper.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+            return cursor.fetchone()
+
+    def insert(self, wrapper):
+        self.execute(wrapper, 'BEGIN IMMEDIATE', 'INSERT INTO item DEFAULT VALUES', 'COMMIT')
+
+    def test_pragmas_applied(self):
+        wrapper = self.connect()
+        for pragma, expected in [('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 5000),
+                                 ('cache_size', -64000), ('mmap_size', 268435456)]:
+            self.assertEqual(self.execute(wrapper, f'PRAGMA {pragma}')[0], expected, pragma)
+
+    def test_reader_does_not_block_writer(self):
+        reader, writer = self.connect(), self.connect()
+        # The reader's transaction keeps a snapshot while the writer commits
+        self.assertEqual(self.execute(reader, 'BEGIN', 'SELECT COUNT(*) FROM item'), (0,))
+        started = time.perf_counter()
+        self.insert(writer)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(self.execute(reader, 'SELECT COUNT(*) FROM item'), (0,))
+        self.execute(reader, 'COMMIT')
+        self.assertEqual(self.execute(reader, 'SELECT COUNT(*) FROM item'), (1,))
+
+    def test_writer_does_not_block_reader(self):
+        reader, writer = self.connect(), self.connect()
+        self.execute(writer, 'BEGIN IMMEDIATE', 'INSERT INTO item DEFAULT VALUES')
+        # Readers see the last commit while the write is in progress
+        self.assertEqual(self.execute(reader, 'SELECT COUNT(*) FROM item'), (0,))
+        self.execute(writer, 'COMMIT')
+        self.assertEqual(self.execute(reader, 'SELECT COUNT(*) FROM item'), (1,))
+
+    def test_rollback_journal_blocks_writer(self):
+        # What WAL avoids: without it the writer cannot commit while a
+        # reader's transaction is open
+        reader = self.connect(journal_mode='DELETE')
+        writer = self.connect(journal_mode='DELETE', busy_timeout=50)
+        self.execute(reader, 'BEGIN', 'SELECT COUNT(*) FROM item')
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            self.insert(writer)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase would keep every query inside a transaction on the primary,
+    # which the router never sends to a replica
+    def setUp(self):
+        cache.clear()
+        # Creating the test database pinned this thread to the primary;
+        # each test starts unpinned and the writes below are scoped so that
+        # they do not pin the test either
+        self.enterContext(routers.scope())
+        with routers.scope():
+            editor = User.objects.create_user(username='editor', password='12345')
+            MusicManagerUser.objects.create(user=editor, display_name='Editor', user_type='editor')
+            self.album = Album.objects.create(title='Primary Album', description='', artist=artist('Artist'),
+                                              price=5, format='CD', release_date=date(2020, 1, 1))
+            self.client.force_login(editor)
+
+        # The replica is a copy of the primary in a database file, changed
+        # so that the rows show where they were read from
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        replica = DatabaseWrapper({**connections.settings['default'],
+                                   'NAME': os.path.join(directory, 'replica.sqlite3')}, 'replica')
+        connections['replica'] = replica
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(replica.close)
+        connection.ensure_connection()
+        replica.ensure_connection()
+        connection.connection.backup(replica.connection)
+        with replica.cursor() as cursor:
+            cursor.execute(f'UPDATE {Album._meta.db_table} SET title = %s', ['Replica Album'])
+            cursor.execute(f"UPDATE {AlbumDocument._meta.db_table} SET body = replace(body, %s, %s)",
+                           ['Primary Album', 'Replica Album'])
+
+    def titles(self):
+        return [album['title'] for album in self.client.get('/api/albums/').json()['results']]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.titles(), ['Replica Album'])
+        self.assertFalse(routers.is_pinned())
+
+    def test_reads_after_a_write_go_to_primary(self):
+        with routers.scope():
+            self.assertEqual(Album.objects.get(pk=self.album.pk).title, 'Replica Album')
+            Song.objects.create(title='New', length=100)
+            self.assertEqual(Album.objects.get(pk=self.album.pk).title, 'Primary Album')
+        self.assertEqual(Album.objects.get(pk=self.album.pk).title, 'Replica Album')
+
+    def test_pinned_view_reads_primary(self):
+        self.assertContains(self.client.get(reverse('album-edit', args=[self.album.id])), 'Primary Album')
+
+    def test_pinned_viewset_reads_primary(self):
+        with mock.patch.object(AlbumViewSet, 'use_primary', True, create=True):
+            self.assertEqual(self.titles(), ['Primary Album'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'])
+    def test_one_replica_per_request(self):
+        router = routers.PrimaryReplicaRouter()
+        for _ in range(10):
+            with routers.scope():
+                aliases = {router.db_for_read(model) for model in (Album, Song, AlbumTracklistItem) for _ in range(5)}
+                self.assertEqual(len(aliases), 1)
+        # Related rows are read where their instance came from
+        album = Album(pk=1)
+        album._state.db = 'replica2'
+        with routers.scope():
+            router.db_for_read(Album)
+            self.assertEqual(router.db_for_read(Song, instance=album), 'replica2')
+
+    def test_writes_never_touch_replica(self):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.post(reverse('album-delete', args=[self.album.id]))
+        self.assertRedirects(response, reverse('album-list'), fetch_redirect_response=False)
+        self.assertFalse(Album.objects.using('default').exists())
+        self.assertEqual(len(queries), 0)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username, user_type in [('editor', 'editor'), ('artist', 'artist')]:
+            user = User.objects.create_user(username=username, password='12345')
+            MusicManagerUser.objects.create(user=user, display_name=username.title(), user_type=user_type)
+        self.song = Song.objects.create(title='Opener', length=200)
+        Song.objects.create(title='Closer', length=90)
+        self.albums = [Album.objects.create(title=f'Album {i}', description='', artist=artist(name), price=price,
+                                            format=album_format, release_date=date(2020, 1, 1))
+                       for i, (name, album_format, price) in enumerate([('Artist', 'CD', 5), ('Other', 'VL', 15)])]
+        self.albums[0].set_tracklist([self.song])
+
+    async def get(self, url, **kwargs):
+        # The same URL through the sync views and through the async ones
+        sync_response = await sync_to_async(self.client.get)(url, **kwargs)
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            async_response = await self.async_client.get(url, **kwargs)
+        return sync_response, async_response
+
+    async def test_api_reads_match_viewsets(self):
+        self.assertIs(resolve('/api/albums/', urlconf='label_music_manager.async_urls').func,
+                      async_views.album_collection)
+        album, song = self.albums[0], self.song
+        for url in ['/api/albums/', '/api/albums/?view=summary&ordering=-price', '/api/albums/?release_format=VL',
+                    '/api/albums/?page_size=1&ordering=title', f'/api/albums/{album.id}/',
+                    f'/api/albums/{album.id}/?view=summary', '/api/albums/999/', '/api/albums/?min_price=lots',
+                    '/api/songs/?min_length=100', f'/api/songs/{song.id}/', '/api/songs/?ordering=color']:
+            sync_response, async_response = await self.get(url)
+            self.assertEqual(async_response.status_code, sync_response.status_code, url)
+            self.assertEqual(async_response.json(), sync_response.json(), url)
+            self.assertEqual(async_response.get('ETag'), sync_response.get('ETag'), url)
+
+    async def test_follows_next_link(self):
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            first = (await self.async_client.get('/api/albums/?page_size=1')).json()
+            second = (await self.async_client.get(first['next'])).json()
+        self.assertEqual([album['title'] for album in second['results']], ['Album 1'])
+
+    async def test_not_modified(self):
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            response = await self.async_client.get(f'/api/albums/{self.albums[0].id}/')
+            again = await self.async_client.get(f'/api/albums/{self.albums[0].id}/',
+                                                headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_api_reads_check_permissions(self):
+        with mock.patch.object(SongViewSet, 'permission_classes', [IsAuthenticated]):
+            for url in ['/api/songs/', f'/api/songs/{self.song.id}/']:
+                sync_response, async_response = await self.get(url)
+                self.assertEqual(async_response.status_code, 403, url)
+                self.assertEqual(async_response.json(), sync_response.json(), url)
+
+    async def test_page_not_modified(self):
+        await sync_to_async(self.client.login)(username='artist', password='12345')
+        self.async_client.cookies = self.client.cookies
+        detail = reverse('album-detail', args=[self.albums[0].id])
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            response = await self.async_client.get(detail)
+            again = await self.async_client.get(detail, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+    async def test_writes_go_to_viewset(self):
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            response = await self.async_client.post('/api/songs/', {'title': 'Encore', 'length': 120},
+                                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Song.objects.filter(title='Encore').aexists())
+
+    async def test_pages(self):
+        await sync_to_async(self.client.login)(username='artist', password='12345')
+        self.async_client.cookies = self.client.cookies
+        detail = reverse('album-detail', args=[self.albums[0].id])
+        # CSRF tokens are masked differently on every page
+        page = lambda response: re.sub(rb'value="\w+"', b'', response.content)
+        sync_list, async_list = await self.get(reverse('album-list'))
+        self.assertEqual(page(async_list), page(sync_list))
+        sync_detail, async_detail = await self.get(detail)
+        self.assertEqual(page(async_detail), page(sync_detail))
+        self.assertEqual(async_detail['ETag'], sync_detail['ETag'])
+        # Another artist's album
+        _, other = await self.get(reverse('album-detail', args=[self.albums[1].id]))
+        self.assertRedirects(other, reverse('album-list'), fetch_redirect_response=False)
+
+
+class AlbumDocumentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.song = Song.objects.create(title='Opener', length=200)
+        self.album = Album.objects.create(title='Stored', description='Says "cover_image":"/media/ in text',
+                                          artist=artist('Artist'), price=5, format='CD', release_date=date(2020, 1, 1))
+        self.album.set_tracklist([self.song])
+
+    def stored(self):
+        return json.loads(AlbumDocument.objects.get(album=self.album).body)
+
+    def test_documents_follow_writes(self):
+        self.assertEqual([track['title'] for track in self.stored()['tracks']], ['Opener'])
+        self.song.title = 'Renamed'
+        self.song.save()
+        self.assertEqual(self.stored()['tracks'][0]['title'], 'Renamed')
+        renamed = self.album.artist
+        renamed.name = 'Renamed Artist'
+        renamed.save()
+        self.assertEqual(self.stored()['artist'], 'Renamed Artist')
+        self.song.delete()
+        self.assertEqual(self.stored()['tracks'], [])
+
+    def test_built_documents_equal_the_serializer(self):
+        other = Album.objects.create(title='Ünïcode “Quotes”', description='', artist=artist('Another'), price=12.5,
+                                     format='VL', release_date=date(1999, 12, 31), cover_image='')
+        other.set_tracklist([Song.objects.create(title='Closer', length=95), self.song])
+        albums = list(Album.objects.with_tracklist().select_related('artist').order_by('pk'))
+        with self.assertNumQueries(2):
+            built = documents.build([album.pk for album in albums])
+        self.assertEqual(sorted((document.album_id, document.body) for document in built),
+                         [(album.pk, documents.render(album)) for album in albums])
+
+    def test_shared_covers_are_looked_up_once(self):
+        covered = [Album.objects.create(title=f'Covered {i}', description='', artist=artist('Artist'), price=5,
+                                        format='CD', release_date=date(2020, 1, 1), cover_image='covers/shared.png')
+                   for i in range(3)]
+        with mock.patch.object(covers, 'name_url', wraps=covers.name_url) as name_url:
+            built = documents.build([album.pk for album in covered])
+        self.assertEqual(name_url.call_count, len(covers.COVER_FORMATS))
+        self.assertEqual({document.body for document in built},
+                         {documents.render(album) for album in Album.objects.filter(pk__in=[a.pk for a in covered])
+                          .with_tracklist().select_related('artist')})
+
+    def test_api_serves_documents(self):
+        response = self.client.get(f'/api/albums/{self.album.id}/')
+        album = Album.objects.with_tracklist().select_related('artist').get()
+        self.assertEqual(response.json(), AlbumSerializer(album, context={'request': response.wsgi_request}).data)
+        self.assertEqual(response.json()['cover_image'], 'http://testserver/media/covers/default.jpg')
+        self.assertEqual(response.json()['description'], self.album.description)
+        self.assertEqual(self.client.get('/api/albums/').json()['results'], [response.json()])
+        self.assertEqual(self.client.get(f'/api/albums/{self.album.id}/?format=api').status_code, 200)
+
+    def test_albums_without_a_document_are_rendered(self):
+        AlbumDocument.objects.all().delete()
+        self.assertEqual(self.client.get('/api/albums/').json()['results'][0]['tracks'][0]['title'], 'Opener')
+        self.assertEqual(self.client.get(f'/api/albums/{self.album.id}/').json()['title'], 'Stored')
+        self.assertFalse(AlbumDocument.objects.exists())
+
+    def test_check_command_repairs_stale_documents(self):
+        AlbumDocument.objects.filter(album=self.album).update(body='{}')
+        with self.assertRaisesMessage(CommandError, f'1 of 1 album documents are missing or stale: {self.album.id}'):
+            call_command('check_album_documents', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('check_album_documents', repair=True, stdout=out)
+        self.assertIn('Repaired 1 of 1', out.getvalue())
+        self.assertEqual(self.stored()['title'], 'Stored')
+        self.assertEqual(documents.check(), (1, []))
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='viewer', password='12345')
+        MusicManagerUser.objects.create(user=user, display_name='Viewer', user_type='viewer')
+        album = Album.objects.create(title='Timed', description='', artist=artist('Artist'), price=5,
+                                     format='CD', release_date=date(2020, 1, 1))
+        album.set_tracklist([Song.objects.create(title='Opener', length=200)])
+
+    def timings(self, response):
+        return {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/albums/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'serializer', 'template', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+        summary = self.timings(self.client.get('/api/albums/?view=summary'))
+        self.assertNotEqual(summary['serializer'], 'serializer;dur=0.0')
+
+        self.client.login(username='viewer', password='12345')
+        page = self.timings(self.client.get(reverse('album-list')))
+        self.assertNotEqual(page['template'], 'template;dur=0.0')
+
+    def test_async_server_timing(self):
+        with override_settings(ROOT_URLCONF='label_music_manager.async_urls'):
+            response = async_to_sync(self.async_client.get)('/api/albums/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_logged_with_call_site(self):
+        with self.assertLogs('label_music_manager.instrumentation', 'WARNING') as logs:
+            Song.objects.filter(title='Opener').count()
+        self.assertIn('label_music_manager/tests.py', logs.output[0])
+        self.assertIn('FROM "label_music_manager_song"', logs.output[0])
+
+    @override_settings(METRICS_TOKEN='scraper')
+    def test_metrics(self):
+        self.client.get('/api/albums/')
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scraper')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        series = 'method="GET",route="api/albums/$",status="200"'
+        count = next(line for line in lines if line.startswith(f'http_request_duration_seconds_count{{{series}}}'))
+        self.assertIn(f'http_request_duration_seconds_bucket{{{series},le="+Inf"}} {count.split()[-1]}', lines)
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram('latency', 'Help.', ('route',), (0.1, 1))
+        for value in [0.05, 0.5, 5]:
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.exposition()[2:], [
+            'latency_bucket{route="a\\"b",le="0.1"} 1',
+            'latency_bucket{route="a\\"b",le="1"} 2',
+            'latency_bucket{route="a\\"b",le="+Inf"} 3',
+            'latency_sum{route="a\\"b"} 5.55',
+            'latency_count{route="a\\"b"} 3',
+        ])
+
+    def test_metrics_are_summed_over_processes(self):
+        counter = instrumentation.Counter('test_jobs_total', 'Help.')
+        counter.increment(2)
+        # e.g. another gunicorn worker, configured like this one
+        subprocess.run(
+            [sys.executable, 'manage.py', 'shell', '-c',
+             'from label_music_manager import instrumentation; '
+             'instrumentation.Counter("test_jobs_total", "Help.").increment(3)'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'METRICS_DIR': settings.METRICS_DIR},
+            check=True, capture_output=True)
+        self.assertEqual(counter.total(), 5)
+
+    def test_metric_files_grow_and_reopen(self):
+        path = os.path.join(tempfile.mkdtemp(), 'metrics')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        values = instrumentation.FileValues(path)
+        for i in range(5000):
+            values.add(f'key {i}', i)
+        values.add('key 1', 0.5)
+        self.assertGreater(os.path.getsize(path), instrumentation.FileValues.INITIAL_SIZE)
+        expected = {f'key {i}': i for i in range(5000)} | {'key 1': 1.5}
+        self.assertEqual(dict(instrumentation.FileValues.read(path)), expected)
+        # A process reusing the id carries on from the stored values
+        values = instrumentation.FileValues(path)
+        values.add('key 2', 1)
+        self.assertEqual(dict(values.items())['key 2'], 3)
+
+
+class LoadTestTests(LiveServerTestCase):
+    def test_load_test_against_live_server(self):
+        Song.objects.create(title='Loaded', length=100)
+        result = benchmarks.load_test(f'{self.live_server_url}/api/songs/', connections=4, duration=0.5)
+        self.assertGreater(result['requests'], 0)
+        self.assertEqual(result['failures'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        missing = benchmarks.load_test(f'{self.live_server_url}/api/songs/999/', connections=1, duration=0.2)
+        self.assertEqual(missing['failures'], missing['requests'])
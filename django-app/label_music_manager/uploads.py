@@ -0,0 +1,37 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+# Upload handlers that hash each file as its chunks arrive, so that
+# ContentHashedStorage can name it without reading it again. Replace Django's
+# handlers of the same names in FILE_UPLOAD_HANDLERS.
+
+
+class HashingMixin:
+    def new_file(self, *args, **kwargs):
+        # Before the memory handler raises StopFutureHandlers
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.hashes:
+            self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    @property
+    def hashes(self):
+        # Files too large to keep in memory are passed on, and hashed, by
+        # the next handler
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, TemporaryFileUploadHandler):
+    hashes = True
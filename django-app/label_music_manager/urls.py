@@ -1,7 +1,8 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .api_views import AlbumTracklistItemViewSet, AlbumViewSet, SongViewSet
-from . import views
+from .api_views import AlbumTracklistItemViewSet, AlbumViewSet, SongViewSet, cache_stats, export_catalog, metrics, search_catalog
+from . import media, views
 
 router = DefaultRouter()
 router.register(r'albums', AlbumViewSet)
@@ -10,7 +11,13 @@ router.register(r'tracklist', AlbumTracklistItemViewSet, )
 
 urlpatterns = [
     # API routes
+    path('api/cache-stats/', cache_stats, name='cache-stats'),
+    path('api/search/', search_catalog, name='search'),
+    re_path(r'^api/export/(?P<kind>albums|songs|tracklist)\.(?P<fmt>ndjson|csv)$', export_catalog, name='export'),
     path('api/', include(router.urls)),
+    path('metrics/', metrics, name='metrics'),
+    # Ahead of the static() media patterns in the project URLconf
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", media.serve, name='media'),
 
     # Web application routes
     path('', views.album_list, name='album-list'),
@@ -19,6 +26,7 @@ urlpatterns = [
     path('albums/<int:id>/', views.album_detail, name='album-detail'),
     path('albums/<int:id>/edit/', views.album_edit, name='album-edit'),
     path('albums/<int:id>/delete/', views.album_delete, name='album-delete'),
+    path('albums/<int:id>/tracks/move/', views.album_track_move, name='album-track-move'),
 
     path('albums/<int:id>/<slug:slug>/', views.album_detail_slug, name='album-detail-slug'),
     
@@ -1,33 +1,153 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Album, AlbumTracklistItem, MusicManagerUser, Song
+from .models import Album, MusicManagerUser
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from .forms import AlbumForm
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
+from django.db import transaction
+from django.views.decorators.http import condition, require_POST
+from django.http import Http404
+from django.template.loader import render_to_string
+from . import album_cache
+from .conditional import album_page_etag, album_page_last_modified, album_page_state
+from .routers import use_primary
 
 @login_required
 def album_list(request):
-    user = request.user
+    # Keyset pagination on id (?after=<id> for the next page, ?before=<id>
+    # for the previous one), so a page costs the same however large the
+    # catalog is. Each album is rendered from a cached fragment.
+    profile = getattr(request.user, 'musicmanageruser', None)
+    after, before = list_cursor(request.GET.get('after')), list_cursor(request.GET.get('before'))
+    rows = list(list_page_query(listed_albums(profile), after, before))
+    rows, previous_page, next_page = list_page(rows, after, before)
+    return render(request, 'label_music_manager/album_list.html', {
+        'album_items': render_list_items(profile, rows),
+        'previous_page': previous_page,
+        'next_page': next_page,
+    })
+
+def listed_albums(profile):
+    # Artists only see their own albums, users without a profile none
+    if profile is None:
+        return Album.objects.none()
+    if profile.user_type == 'artist':
+        return Album.objects.filter(artist_id=profile.artist_id)
+    return Album.objects.all()
+
+def list_cursor(value):
+    # An album id from ?after= or ?before=; anything else starts at the top
     try:
-        user_profile = user.musicmanageruser  
-        if user_profile.user_type == 'artist':
-            albums = Album.objects.filter(artist=user_profile.display_name)
-        else:
-            albums = Album.objects.all()
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-    except MusicManagerUser.DoesNotExist:
-        albums = Album.objects.none()
-    return render(request, 'label_music_manager/album_list.html', {'albums': albums})
+def list_page_query(albums, after, before):
+    # (id, artist id) rows of the page, plus one to tell if there are more
+    page_size = settings.ALBUM_LIST_PAGE_SIZE
+    if before is not None:
+        return albums.filter(id__lt=before).order_by('-id').values_list('id', 'artist_id')[:page_size + 1]
+    if after is not None:
+        albums = albums.filter(id__gt=after)
+    return albums.order_by('id').values_list('id', 'artist_id')[:page_size + 1]
+
+def list_page(rows, after, before):
+    # The rows of list_page_query in page order, with the cursors of the
+    # previous and next pages (None when there is no such page)
+    page_size = settings.ALBUM_LIST_PAGE_SIZE
+    if before is not None:
+        has_previous, has_next = len(rows) > page_size, True
+        rows = rows[:page_size][::-1]
+    else:
+        has_previous, has_next = after is not None, len(rows) > page_size
+        rows = rows[:page_size]
+    return (rows, rows[0][0] if rows and has_previous else None,
+            rows[-1][0] if rows and has_next else None)
+
+def list_variants(profile, rows):
+    # {variant: [album id, ...]} for (album id, artist id) rows
+    variants = {}
+    for album_id, artist_id in rows:
+        variants.setdefault(page_variant(profile, artist_id), []).append(album_id)
+    return variants
+
+def render_list_item(album, variant):
+    return render_to_string('label_music_manager/album_list_item.html', {'album': album, 'variant': variant})
+
+def render_list_items(profile, rows):
+    # Returns the list fragments for (album id, artist id) rows in order,
+    # fetching every variant's cached fragments at once and rendering the
+    # missing ones from a single query
+    items = {}
+    for variant, album_ids in list_variants(profile, rows).items():
+        def build(missing, variant=variant):
+            albums = Album.objects.filter(id__in=missing).select_related('artist')
+            return {album.id: render_list_item(album, variant) for album in albums}
+        items.update(album_cache.get_many_or_set(album_ids, f'list:{variant}', build))
+    # Albums deleted since the ids were read are skipped
+    return [items[album_id] for album_id, _ in rows if album_id in items]
 
 @login_required
+@condition(etag_func=album_page_etag, last_modified_func=album_page_last_modified)
 def album_detail(request, id):
-    album = get_object_or_404(Album, id=id)
-    if request.user.musicmanageruser.user_type == 'artist' and album.artist != request.user.musicmanageruser.display_name:
+    profile = getattr(request.user, 'musicmanageruser', None)
+    state = album_page_state(request, id)
+    refusal = album_page_refusal(request, state, profile)
+    if refusal is not None:
+        return refusal
+    return render_album_page(request, id, state, profile)
+
+def album_page_refusal(request, state, profile):
+    # The response for a user who may not see the album page, or None.
+    # Raises Http404 for a missing album.
+    if state is None:
+        raise Http404("No Album matches the given query.")
+    if not may_view(profile, state['artist']):
         messages.error(request, "You are not allowed to view this album.")
         return redirect('album-list')
-    return render(request, 'label_music_manager/album_detail.html', {'album': album})
+    return None
+
+def may_view(profile, artist_id):
+    # Artist accounts only see their own albums, compared by artist id
+    return profile is None or profile.user_type != 'artist' or profile.owns(artist_id)
+
+def page_variant(profile, artist_id):
+    # Which set of action links a user with `profile` (None for users
+    # without one) gets on an album by `artist_id`
+    if profile is None:
+        return 'viewer'
+    if profile.user_type == 'editor':
+        return 'editor'
+    if profile.owns(artist_id):
+        return 'owner'
+    return 'viewer'
+
+def render_album_body(album, variant):
+    return render_to_string('label_music_manager/album_detail_body.html', {'album': album, 'variant': variant})
+
+def album_body_query(id):
+    return Album.objects.with_tracklist().select_related('artist').filter(id=id)
+
+def render_album_page(request, id, state, profile):
+    # The album part of the page is cached per album and variant; the rest
+    # of the page (navigation, CSRF token) is rendered per request
+    variant = page_variant(profile, state['artist'])
+
+    def build():
+        album = album_body_query(id).first()
+        if album is None:
+            return None
+        return render_album_body(album, variant)
+
+    return album_page_response(request, album_cache.get_or_set(id, f'page:{variant}', build))
+
+def album_page_response(request, body):
+    if body is None:
+        raise Http404("No Album matches the given query.")
+    return render(request, 'label_music_manager/album_detail.html', {'album_body': body})
 
 @login_required
 def album_create(request):
@@ -36,28 +156,19 @@ def album_create(request):
         user_profile = user.musicmanageruser
         if user_profile.user_type == 'artist' or user_profile.user_type == 'editor':
             if request.method == 'POST':
-                form = AlbumForm(request.POST, request.FILES)
+                # Albums of artist accounts are their artist's
+                form = AlbumForm(request.POST, request.FILES, account=user_profile)
                 if form.is_valid():
-                    # Save the album first (commit=False to prevent saving it right now)
-                    album = form.save(commit=False)
-
-                    # Assign artist if the user is an artist
-                    if user_profile.user_type == 'artist':
-                        album.artist = user_profile.display_name  # Assign artist from user profile
-                    
-                    # Save the album now to get the ID
-                    album.save()
-
-                    # Add songs to album through the tracklist (via AlbumTracklistItem)
-                    tracklist_data = request.POST.getlist('tracklist')  # Get the list of song IDs
-                    for position, song_id in enumerate(tracklist_data, 1):
-                        song = Song.objects.get(id=song_id)
-                        AlbumTracklistItem.objects.create(album=album, song=song, position=position)
+                    # Save the album, its artist and its tracklist together so
+                    # a failure never leaves a partly written album behind
+                    with transaction.atomic():
+                        album = form.save()
+                        album.set_tracklist(form.cleaned_data['tracklist'])
 
                     messages.success(request, "Album created successfully!")
                     return redirect('album-list')
             else:
-                form = AlbumForm()
+                form = AlbumForm(account=user_profile)
             return render(request, 'label_music_manager/album_form.html', {'form': form})
         else:
             messages.error(request, "You do not have permission to create an album.")
@@ -67,34 +178,56 @@ def album_create(request):
         return redirect('album-list')
     
 @login_required
+@use_primary
 def album_edit(request, id):
     album = get_object_or_404(Album, id=id)
-    if (request.user.musicmanageruser.user_type == 'artist' and album.artist != request.user.musicmanageruser.display_name) or request.user.musicmanageruser.user_type == 'viewer':
+    profile = request.user.musicmanageruser
+    if (profile.user_type == 'artist' and not profile.owns(album.artist_id)) or profile.user_type == 'viewer':
         messages.error(request, "You do not have permission to edit this album.")
         return redirect('album-list')
 
     if request.method == 'POST':
-        form = AlbumForm(request.POST, request.FILES, instance=album)
+        form = AlbumForm(request.POST, request.FILES, instance=album, account=profile)
         if form.is_valid():
-            album = form.save()  
-            tracklist_data = form.cleaned_data['tracklist']  
-            album.songs.clear()
-            
-            for song in tracklist_data:
-                AlbumTracklistItem.objects.create(album=album, song=song)
-            
+            # Only the songs added or removed are written, existing tracks
+            # keep their positions
+            with transaction.atomic():
+                album = form.save()
+                album.set_tracklist(form.cleaned_data['tracklist'])
+
             messages.success(request, "Album updated successfully!")
             return redirect('album-detail', id=id)
     else:
-        form = AlbumForm(instance=album)
+        form = AlbumForm(instance=album, account=profile)
     
     return render(request, 'label_music_manager/album_form.html', {'form': form})
 
 @login_required
+@require_POST
+def album_track_move(request, id):
+    # The Up and Down buttons of the edit page post "<song id>:up" or
+    # "<song id>:down" as `move`
+    album = get_object_or_404(Album, id=id)
+    profile = request.user.musicmanageruser
+    if (profile.user_type == 'artist' and not profile.owns(album.artist_id)) or profile.user_type == 'viewer':
+        messages.error(request, "You do not have permission to edit this album.")
+        return redirect('album-list')
+
+    song_id, _, direction = request.POST.get('move', '').partition(':')
+    song_ids = list(album.albumtracklistitem_set.order_by('position', 'id').values_list('song_id', flat=True))
+    if not song_id.isdigit() or int(song_id) not in song_ids or direction not in ('up', 'down'):
+        messages.error(request, "That track cannot be moved.")
+        return redirect('album-edit', id=id)
+    album.move_track(int(song_id), song_ids.index(int(song_id)) + (1 if direction == 'down' else -1))
+    return redirect('album-edit', id=id)
+
+@login_required
+@use_primary
 def album_delete(request, id):
     album = get_object_or_404(Album, id=id)
     
-    if (request.user.musicmanageruser.user_type == 'artist' and album.artist != request.user.musicmanageruser.display_name) or request.user.musicmanageruser.user_type == 'viewer':
+    profile = request.user.musicmanageruser
+    if (profile.user_type == 'artist' and not profile.owns(album.artist_id)) or profile.user_type == 'viewer':
         messages.error(request, "You do not have permission to delete this album.")
         return redirect('album-list')
 
@@ -128,10 +261,15 @@ def user_logout(request):
     return redirect('album-list')
 
 @login_required
+@condition(etag_func=album_page_etag, last_modified_func=album_page_last_modified)
 def album_detail_slug(request, id, slug):
-    album = get_object_or_404(Album, id=id)
-    
-    if album.slug != slug:
-        return redirect('album-detail-slug', id=id, slug=album.slug)
+    profile = getattr(request.user, 'musicmanageruser', None)
+    state = album_page_state(request, id)
+    refusal = album_page_refusal(request, state, profile)
+    if refusal is not None:
+        return refusal
+
+    if state['slug'] != slug:
+        return redirect('album-detail-slug', id=id, slug=state['slug'])
 
-    return render(request, 'label_music_manager/album_detail.html', {'album': album})
\ No newline at end of file
+    return render_album_page(request, id, state, profile)
\ No newline at end of file
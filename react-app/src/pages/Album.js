@@ -25,11 +25,6 @@ const AlbumPage = () => {
     return <div>Error loading album details.</div>;
   }
 
-  const totalPlaytime = data.tracks.reduce(
-    (total, track) => total + track.length,
-    0
-  ); // Sum all song lengths for total playtime
-
   const releaseYear = new Date(data.release_date).getFullYear();
 
   return (
@@ -46,7 +41,7 @@ const AlbumPage = () => {
         {/* Resize the image to be responsive */}
         <Card.Img
           variant='top'
-          src={data.cover_image || '/static/covers/default.jpg'}
+          src={data.cover_urls?.webp || data.cover_image || '/static/covers/default.jpg'}
           style={{ width: '100%', maxHeight: '400px', objectFit: 'cover' }}
         />
         <Card.Body>
@@ -56,7 +51,7 @@ const AlbumPage = () => {
             <strong>Release Year:</strong> {releaseYear}
           </Card.Text>
           <Card.Text>
-            <strong>Total Playtime:</strong> {totalPlaytime} seconds
+            <strong>Total Playtime:</strong> {data.total_playtime} seconds
           </Card.Text>
           <Link to='/'>
             <Button variant='secondary'>Back to Home</Button>
@@ -1,18 +1,32 @@
 // src/pages/Home.js
 import React from 'react';
-import { useQuery } from 'react-query';
+import { useInfiniteQuery } from 'react-query';
 import { Card, Row, Col, Button, Container } from 'react-bootstrap';
 import { Link } from 'react-router-dom';
 import { API } from '../constants';
 
-const fetchAlbums = async () => {
-  const res = await fetch(`${API}albums/`);
+// The albums endpoint is cursor paginated and responds with
+// { next, previous, results }. `next` is the URL of the following page
+// (or null on the last page) and is followed as-is.
+// view=summary asks for album cards with the playtime, track count,
+// release year and shortened description worked out by the server.
+const fetchAlbums = async ({ pageParam = `${API}albums/?view=summary` }) => {
+  const res = await fetch(pageParam);
   const data = await res.json();
   return data;
 };
 
 const HomePage = () => {
-  const { data, isLoading, isError } = useQuery('albums', fetchAlbums);
+  const {
+    data,
+    isLoading,
+    isError,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useInfiniteQuery('albums', fetchAlbums, {
+    getNextPageParam: (lastPage) => lastPage.next ?? undefined,
+  });
 
   if (isLoading) {
     return <div>Loading...</div>;
@@ -26,22 +40,13 @@ const HomePage = () => {
     <Container>
       <h2>Album List</h2>
       <Row>
-        {data.map((album) => {
-          // Calculate the total playtime by summing all song lengths for the album
-          const totalPlaytime = album.tracks.reduce(
-            (total, track) => total + track.length,
-            0
-          );
-
-          // Format the release date to show only the year
-          const releaseYear = new Date(album.release_date).getFullYear();
-
+        {data.pages.flatMap((page) => page.results).map((album) => {
           return (
             <Col key={album.id} sm={12} md={6} lg={4}>
               <Card className='mb-4'>
                 <Card.Img
                   variant='top'
-                  src={album.cover_image || '/static/covers/default.jpg'}
+                  src={album.cover_urls?.webp || album.cover_image || '/static/covers/default.jpg'}
                 />
                 <Card.Body>
                   <Card.Title>{album.title}</Card.Title>
@@ -49,13 +54,13 @@ const HomePage = () => {
                     {album.artist}
                   </Card.Subtitle>
                   <Card.Text>
-                    <strong>Description: </strong>{album.description.substring(0, 100)}
+                    <strong>Description: </strong>{album.description}
                   </Card.Text>
                   <Card.Text>
-                    <strong>Release Year:</strong> {releaseYear}
+                    <strong>Release Year:</strong> {album.release_year}
                   </Card.Text>
                   <Card.Text>
-                    <strong>Total Playtime:</strong> {totalPlaytime} seconds
+                    <strong>Total Playtime:</strong> {album.total_playtime} seconds
                   </Card.Text>
                   <Link to={`/albums/${album.id}`}>
                     <Button variant='primary'>View Details</Button>
@@ -66,6 +71,15 @@ const HomePage = () => {
           );
         })}
       </Row>
+      {hasNextPage && (
+        <Button
+          variant='secondary'
+          onClick={() => fetchNextPage()}
+          disabled={isFetchingNextPage}
+        >
+          {isFetchingNextPage ? 'Loading...' : 'Load more'}
+        </Button>
+      )}
     </Container>
   );
 };